@@ -35,6 +35,7 @@ namespace VisioPlugin
             InitializeCustomComponents();
             PopulateModelDropdown(models);
             modelDropdown.SelectedItem = model;
+            modelDropdown.SelectedIndexChanged += (sender, e) => chatManager.SelectModel(modelDropdown.SelectedItem as string);
         }
 
         private void InitializeCustomComponents()
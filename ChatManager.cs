@@ -1,4 +1,5 @@
 using System;
+using System.Net;
 using System.Net.Http;
 using System.Threading.Tasks;
 using Newtonsoft.Json.Linq;
@@ -17,11 +18,19 @@ namespace VisioPlugin
         private readonly VisioCommandProcessor commandProcessor;
         private readonly AIChatPane chatPane;  // Reference to AIChatPane
 
+        // The service answers within this deadline (partially if it must); the client waits a little
+        // longer so a late answer arrives as the service's 504 rather than as a client timeout
+        private const int RequestDeadlineSeconds = 30;
+        private static readonly TimeSpan ClientTimeout = TimeSpan.FromSeconds(RequestDeadlineSeconds + 5);
+
         public VisioChatManager(string model, string apiEndpoint, string[] models, LibraryManager libraryManager, Action<string> appendToChatHistory, AIChatPane chatPane)
         {
             this.selectedModel = model;
             this.apiEndpoint = apiEndpoint;
-            this.httpClient = new HttpClient();
+            // The service gzips large responses for clients that accept it
+            this.httpClient = new HttpClient(new HttpClientHandler { AutomaticDecompression = DecompressionMethods.GZip | DecompressionMethods.Deflate });
+            this.httpClient.Timeout = ClientTimeout;
+            this.httpClient.DefaultRequestHeaders.Add("X-Request-Timeout", RequestDeadlineSeconds.ToString());
             this.libraryManager = libraryManager;
             this.appendToChatHistory = appendToChatHistory;
             this.commandProcessor = new VisioCommandProcessor(Globals.ThisAddIn.Application, libraryManager);
@@ -69,6 +78,15 @@ namespace VisioPlugin
                 // Update command status to Failed
                 chatPane.UpdateCommandStatus(userMessage, "Failed");
             }
+            catch (TaskCanceledException)
+            {
+                // HttpClient reports its timeout as a cancellation
+                appendToChatHistory($"Error: no response from the AI service within {ClientTimeout.TotalSeconds} seconds.");
+                Debug.WriteLine("[Error] Sending message timed out");
+
+                // Update command status to Failed
+                chatPane.UpdateCommandStatus(userMessage, "Failed");
+            }
             catch (Exception ex)
             {
                 appendToChatHistory("Error: " + ex.Message);
@@ -148,6 +166,23 @@ namespace VisioPlugin
             }
         }
 
+        // Switch models and ask the service to load the new one before the first message is sent
+        public async void SelectModel(string model)
+        {
+            if (string.IsNullOrEmpty(model) || model == selectedModel) return;
+            selectedModel = model;
+            try
+            {
+                var jsonContent = new StringContent(Newtonsoft.Json.JsonConvert.SerializeObject(new { model }), Encoding.UTF8, "application/json");
+                var response = await httpClient.PostAsync($"{apiEndpoint}/model-selected", jsonContent);
+                Debug.WriteLine($"[Debug] Preload of model {model}: {response.StatusCode}");
+            }
+            catch (Exception ex)
+            {
+                Debug.WriteLine($"[Error] Error preloading model {model}: {ex.Message}");
+            }
+        }
+
         // Validate if the input string is a valid JSON object
         private bool IsValidJson(string strInput)
         {
@@ -1,7 +1,10 @@
 using System;
 using System.Collections.Generic;
 using System.Diagnostics;
+using System.IO;
+using System.IO.Compression;
 using System.Linq;
+using System.Net;
 using Visio = Microsoft.Office.Interop.Visio;
 using System.Net.Http;
 using System.Text;
@@ -17,11 +20,15 @@ namespace VisioPlugin
         private readonly HttpClient httpClient;
         private readonly string apiEndpoint;
 
+        // Only the Python service decodes gzip request bodies; n8n webhooks do not, so leave this off
+        // unless apiEndpoint points at the service
+        public bool CompressLibraryUpload { get; set; }
+
         public LibraryManager(Visio.Application visioApp)
         {
             visioApplication = visioApp ?? throw new ArgumentNullException(nameof(visioApp));
             categories = new Dictionary<string, ShapeCategory>();
-            httpClient = new HttpClient();
+            httpClient = new HttpClient(new HttpClientHandler { AutomaticDecompression = DecompressionMethods.GZip | DecompressionMethods.Deflate });
             apiEndpoint = "http://localhost:5678"; // Set your API endpoint here
             LoadLibraries();
         }
@@ -271,7 +278,26 @@ namespace VisioPlugin
             try
             {
                 var libraryInfo = ListAllShapes();
-                var jsonContent = new StringContent(JsonConvert.SerializeObject(libraryInfo), Encoding.UTF8, "application/json");
+                var json = Encoding.UTF8.GetBytes(JsonConvert.SerializeObject(libraryInfo));
+                ByteArrayContent jsonContent;
+                if (CompressLibraryUpload)
+                {
+                    // The shape catalog is large and repetitive, so it compresses well
+                    using (var buffer = new MemoryStream())
+                    {
+                        using (var gzip = new GZipStream(buffer, CompressionLevel.Fastest))
+                        {
+                            gzip.Write(json, 0, json.Length);
+                        }
+                        jsonContent = new ByteArrayContent(buffer.ToArray());
+                    }
+                    jsonContent.Headers.ContentEncoding.Add("gzip");
+                }
+                else
+                {
+                    jsonContent = new ByteArrayContent(json);
+                }
+                jsonContent.Headers.ContentType = new System.Net.Http.Headers.MediaTypeHeaderValue("application/json") { CharSet = "utf-8" };
 
                 var response = await httpClient.PostAsync($"{apiEndpoint}/send-library-info", jsonContent);
                 response.EnsureSuccessStatusCode();
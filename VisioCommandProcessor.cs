@@ -38,6 +38,7 @@ namespace VisioPlugin
             commandRegistry.Add("CreateText", CreateText);
             commandRegistry.Add("RetrieveAllShapes", parameters => RetrieveAllShapes()); // Updated this line
             commandRegistry.Add("CreateMultipleShapes", CreateMultipleShapes); // Added this line
+            commandRegistry.Add("ImportDiagram", ImportDiagram);
         }
 
         // The core command processor method
@@ -189,6 +190,61 @@ namespace VisioPlugin
             }
         }
 
+        // Process the ImportDiagram command: a .vsdx written by the service (POST /diagram/vsdx) is
+        // opened as a new drawing, or its first page is pasted onto the active page, in one operation
+        private void ImportDiagram(JToken parameters)
+        {
+            try
+            {
+                Debug.WriteLine($"[ImportDiagram] Received Parameters: {parameters.ToString()}");
+
+                string path = parameters["path"]?.ToString();
+                string mode = parameters["mode"]?.ToString() ?? "open";
+
+                if (string.IsNullOrEmpty(path) || !System.IO.File.Exists(path))
+                {
+                    Debug.WriteLine($"[ImportDiagram] [Error] Drawing not found: {path}");
+                    return;
+                }
+
+                if (mode != "paste")
+                {
+                    visioApp.Documents.OpenEx(path, (short)Visio.VisOpenSaveArgs.visOpenCopy);
+                    Debug.WriteLine($"[ImportDiagram] Opened '{path}' as a new drawing.");
+                    return;
+                }
+
+                var activePage = visioApp.ActivePage;
+                if (activePage == null)
+                {
+                    Debug.WriteLine("[ImportDiagram] [Error] No active page found in Visio.");
+                    return;
+                }
+
+                Visio.Document source = visioApp.Documents.OpenEx(path, (short)(Visio.VisOpenSaveArgs.visOpenCopy | Visio.VisOpenSaveArgs.visOpenHidden));
+                try
+                {
+                    Visio.Page sourcePage = source.Pages[1];
+                    if (sourcePage.Shapes.Count > 0)
+                    {
+                        // Masters are matched by name against the stencils already in use
+                        sourcePage.CreateSelection(Visio.VisSelectionTypes.visSelTypeAll).Copy();
+                        activePage.Paste();
+                    }
+                    Debug.WriteLine($"[ImportDiagram] Pasted {sourcePage.Shapes.Count} shapes from '{path}'.");
+                }
+                finally
+                {
+                    source.Close();
+                }
+            }
+            catch (Exception ex)
+            {
+                Debug.WriteLine($"[ImportDiagram] [Error] Error importing diagram: {ex.Message}");
+                throw;
+            }
+        }
+
         // Process the DeleteShape command from AI
         private void DeleteShape(JToken parameters)
         {
@@ -1,23 +1,78 @@
+import asyncio
 import logging
 import json
-from fastapi import FastAPI, HTTPException, Form, WebSocket, WebSocketDisconnect
-from langchain_ollama import ChatOllama
+import os
+import uuid
+from fastapi import FastAPI, HTTPException, Form, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.vectorstores import SKLearnVectorStore
 from langchain_nomic.embeddings import NomicEmbeddings
 from langchain.schema import Document
 from typing import List
+from contextlib import aclosing, asynccontextmanager
 import requests
+import qdrant_async
+from agent_prompts import manager_agent_instructions, action_agent_instructions
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+from command_parser import parse_command, fast_path_stats
+from tools import expand_bulk_actions, validate_actions
+from shared_state import SHARED_STATE_DIR, run_once, get_shared_store
+from flat_index import FlatIndex, FlatIndexRetriever
+from vector_store import create_vector_store, embedding_dimension
+from corpus_refresh import CorpusIndex, is_local_source, run_refresher
+from speculative import CanvasState, SpeculativeExecutor
+from diagram_graph import answer_structural_query
+from vsdx_parser import iter_vsdx_pages, canvas_shapes
+from vsdx_writer import build_vsdx
+from workflow_engine import WorkflowEngine, WorkflowError, server_timing
+from tool_registry import run_tool_turn
+from model_registry import ModelRegistry
+from wire_format import WebSocketWire, WireFormatMiddleware
+from document_pipeline import DOCUMENT_CONCURRENCY, document_to_diagram
+from retrieval import AdaptiveRetriever, pack_context
+from profiling import ProfilingMiddleware, profile_block, request_flag, list_profiles, profile_file
+from resilience import (OLLAMA_HEDGE_HOST, REQUEST_DEADLINE_SECONDS, CircuitOpen, DeadlineExceeded, DeadlineMiddleware,
+                        ResilientOllama, current_deadline, deadline_scope, request_timeout, within_deadline)
 
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
-
-# Initialize LLM
+# Application-scoped resources are opened once at startup and released at shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Without QDRANT_HOST, QDRANT_LOCATION or VECTOR_STORE_BACKEND=qdrant there is no Qdrant to warm up
+    if qdrant_async.qdrant_configured():
+        await qdrant_async.start_async_qdrant_client()
+    refresher = asyncio.create_task(run_refresher(corpus, REMOTE_REFRESH_INTERVAL, LOCAL_REFRESH_INTERVAL)) \
+        if corpus is not None else None
+    model_refresher = asyncio.create_task(model_registry.run_refresher(preload=[local_llm]))
+    yield
+    model_refresher.cancel()
+    if refresher is not None:
+        refresher.cancel()
+    await workflow_engine.close()
+    await qdrant_async.close_async_qdrant_client()
+
+app = FastAPI(lifespan=lifespan)
+# Opt-in per-request profiling (VISIO_PROFILING=1, then X-Profile: 1 or ?profile=1)
+app.add_middleware(ProfilingMiddleware)
+# MessagePack and gzip for HTTP bodies, when the client asks for them (see wire_format)
+app.add_middleware(WireFormatMiddleware)
+# Per-request deadline (X-Request-Timeout: <seconds> or ?timeout=, else REQUEST_DEADLINE_SECONDS)
+app.add_middleware(DeadlineMiddleware)
+
+# Initialize LLM; chat clients for every model come from the registry's pool
 local_llm = "llama3.2:3b-instruct-fp16"
-llm = ChatOllama(model=local_llm, temperature=0)
-llm_json_mode = ChatOllama(model=local_llm, temperature=0, format="json")
+model_registry = ModelRegistry(default_model=local_llm)
+llm = model_registry.chat(local_llm)
+llm_json_mode = model_registry.chat(local_llm, format="json")
+# Ollama calls go through ResilientOllama: they stop at the request deadline, fail fast while Ollama
+# is unhealthy, and with OLLAMA_HEDGE_HOST set a slow call is also sent to that second Ollama
+hedge_registry = ModelRegistry(OLLAMA_HEDGE_HOST, default_model=local_llm) if OLLAMA_HEDGE_HOST else None
+ollama = ResilientOllama(model_registry.chat, hedge_registry.chat if hedge_registry else None)
+# ACTION_TOOL_CALLING=1 has the Action Agent call the tools.py functions through Ollama tool calling
+# instead of writing the action JSON itself
+ACTION_TOOL_CALLING = os.environ.get("ACTION_TOOL_CALLING", "0") == "1"
 
 # Load Documents from URLs
 urls = [
@@ -26,8 +81,20 @@ urls = [
     "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
 ]
 
-retriever = None
-try:
+# Number of uvicorn worker processes; with more than one, workers share a memory-mapped index
+workers = int(os.environ.get("VISIO_WORKERS", "1"))
+SHARED_INDEX_DIR = os.path.join(SHARED_STATE_DIR, "rag_index")
+
+embeddings = CachedEmbeddings(
+    NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local"),
+    model_name="nomic-embed-text-v1.5",
+)
+
+# Splitter for VectorDB chunks
+text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=1000, chunk_overlap=200)
+
+# Load the source documents
+def load_documents() -> List[Document]:
     loaded_docs = []
     for url in urls:
         loader = WebBaseLoader(url)
@@ -35,15 +102,56 @@ try:
         for doc in docs:
             if isinstance(doc, Document):
                 loaded_docs.append(doc)
-    # Split documents for VectorDB
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=1000, chunk_overlap=200)
-    doc_splits = text_splitter.split_documents(loaded_docs)
-    # Add to vectorDB
-    vectorstore = SKLearnVectorStore.from_documents(
-        documents=doc_splits,
-        embedding=NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local"),
-    )
-    retriever = vectorstore.as_retriever(k=3)
+    return loaded_docs
+
+# Load and split the source documents
+def load_document_splits() -> List[Document]:
+    return text_splitter.split_documents(load_documents())
+
+# Retrieval keeps between 1 and RETRIEVAL_K_MAX chunks depending on how scores fall off, and the
+# packed context is capped at CONTEXT_TOKEN_BUDGET tokens
+RETRIEVAL_K_MAX = int(os.environ.get("RETRIEVAL_K_MAX", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Build the on-disk index that all workers map into memory
+def build_shared_index():
+    doc_splits = load_document_splits()
+    texts = [doc.page_content for doc in doc_splits]
+    FlatIndex.save(SHARED_INDEX_DIR, embeddings.embed_documents(texts), texts, [doc.metadata for doc in doc_splits])
+
+# Seconds between checks of web sources (conditional requests) and of local files
+REMOTE_REFRESH_INTERVAL = float(os.environ.get("RAG_REMOTE_REFRESH_INTERVAL", "3600"))
+LOCAL_REFRESH_INTERVAL = float(os.environ.get("RAG_LOCAL_REFRESH_INTERVAL", "5"))
+
+# The refreshable corpus lives in the configured vector store (VECTOR_STORE_BACKEND, with
+# VECTOR_STORE_DIR for flat and ivf); with qdrant it gets its own collection
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "numpy").lower()
+CORPUS_COLLECTION = "rag_corpus"
+
+def new_vector_store():
+    return create_vector_store(VECTOR_STORE_BACKEND, dimension=embedding_dimension(embeddings),
+                               collection_name=CORPUS_COLLECTION)
+
+retriever = None
+corpus = None
+index_version = None
+try:
+    if workers > 1:
+        # Only the first process indexes; the others wait for it and reuse the files
+        run_once("rag_index", json.dumps(urls), build_shared_index)
+        flat_index = FlatIndex(SHARED_INDEX_DIR)
+        index_version = flat_index.version
+        search = FlatIndexRetriever(flat_index, embeddings).similarity_search_with_relevance_scores
+        retriever = AdaptiveRetriever(search, index_version=lambda: index_version, k_max=RETRIEVAL_K_MAX)
+    else:
+        # Sources added at runtime are kept in the shared store and survive restarts; only changed
+        # sources are re-chunked and re-embedded, and each refresh that changes something bumps the version
+        corpus = CorpusIndex(embeddings, text_splitter, new_vector_store())
+        for source in get_shared_store().get("rag", "sources", urls):
+            corpus.add_source(source)
+        corpus.refresh()
+        retriever = AdaptiveRetriever(corpus.similarity_search_with_relevance_scores,
+                                      index_version=lambda: corpus.version, k_max=RETRIEVAL_K_MAX)
 except Exception as e:
     logging.error(f"Failed to load documents from URLs: {e}")
 
@@ -72,49 +180,6 @@ def test_router():
         ])
         print(json.loads(response.content))
 
-# Detailed instructions for Manager and Action Agent
-
-manager_agent_instructions = """
-You are the Manager Agent responsible for understanding user input and deciding how to respond.
-
-1. If the user's message is a general chat or question, engage in a normal conversation.
-2. If the user's message involves actions like creating, modifying, or deleting shapes on a canvas, route the message to the Action Agent.
-
-For routing to the Action Agent, return a JSON object with the key "route" set to "action_agent".
-For handling the conversation yourself, return a JSON object with the key "route" set to "manager".
-
-Example:
-User: "How's the weather today?"
-Response: {"route": "manager"}
-
-User: "Create a red circle in the center"
-Response: {"route": "action_agent"}
-"""
-
-action_agent_instructions = """
-You are the Action Agent that interprets user requests to perform actions on a canvas for Visio-like operations.
-
-Given the user's message, extract the actions to be performed and represent them as a JSON array if there are multiple actions, or a JSON object for a single action.
-
-Each action should follow this schema:
-{
-  "action": "create_shape" | "modify_shape" | "delete_shape" | "connect_shapes",
-  "shape": "circle" | "square" | "rectangle" | "line",
-  "x": number,
-  "y": number,
-  "width": number,
-  "height": number,
-  "radius": number,
-  "color": string
-}
-
-Only respond with the JSON object/array, without any additional text.
-
-Example:
-User: "Create a red circle in the center"
-Response: {"action": "create_shape", "shape": "circle", "x": 50, "y": 50, "radius": 25, "color": "red"}
-"""
-
 # Test Retrieval Grader
 doc_grader_instructions = """
 You are a grader assessing relevance of a retrieved document to a user question.
@@ -176,7 +241,7 @@ Answer:
 """
 
 def format_docs(docs: List[Document]) -> str:
-    return "\n\n".join(doc.page_content for doc in docs)
+    return pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET)
 
 # Test Generation
 def test_generation():
@@ -301,43 +366,261 @@ def test_action_agent():
             print("Format: Incorrect - not valid JSON")
         print()
 
-# Function to list models using Ollama
-def list_models():
+# API endpoint to get models; served from the registry's cache, which refreshes in the background
+@app.get("/models")
+async def get_models():
     try:
-        response = llm.client.list_models()
-        model_names = [model['name'] for model in response]
-        return model_names
+        models = await model_registry.list_models()
+        return {"models": models}
     except Exception as e:
         logging.error(f"Error fetching models: {str(e)}")
-        raise Exception(f"Error fetching models: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching models: {str(e)}")
+
+# API endpoint to show loaded models, pooled clients and the memory budget
+@app.get("/models/status")
+async def get_models_status():
+    return model_registry.describe()
 
-# Function to list models using the existing Ollama setup
-def list_models():
+# API endpoint to load a model before its first message (the add-in calls it when a model is selected)
+@app.post("/models/preload")
+async def preload_model(model: str = Form(...)):
     try:
-        response = llm.client.list_models()
-        model_names = [model['name'] for model in response]
-        return model_names
+        return {"model": await model_registry.preload(model), "status": "loaded"}
     except Exception as e:
-        logging.error(f"Error fetching models: {str(e)}")
-        raise Exception(f"Error fetching models: {str(e)}")
+        logging.error(f"Error preloading model {model}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Error preloading model {model}: {str(e)}")
+
+# API endpoint to check the shared Qdrant connection
+@app.get("/health/qdrant")
+async def get_qdrant_health():
+    if not qdrant_async.qdrant_configured():
+        return {"status": "not_configured"}
+    healthy = await qdrant_async.health_check()
+    if not healthy:
+        raise HTTPException(status_code=503, detail="Qdrant is unreachable")
+    return {"status": "ok"}
+
+# API endpoint to report embedding cache hit rates
+@app.get("/embedding-cache/stats")
+async def get_embedding_cache_stats():
+    return get_embedding_cache().stats()
+
+# API endpoint to report retrieval cache hit rates
+@app.get("/retrieval/stats")
+async def get_retrieval_stats():
+    if retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever is not initialized")
+    return retriever.stats()
+
+# API endpoint to report Ollama call latency (p50/p95/p99), hedging and circuit breaker state
+@app.get("/ollama/health")
+async def get_ollama_health():
+    return ollama.snapshot()
+
+# Shares of the time left that routing and retrieval may use; generation gets the rest
+ROUTE_DEADLINE_SHARE = 0.2
+RETRIEVAL_DEADLINE_SHARE = 0.3
+
+async def route_question(question: str, model: str) -> str:
+    response = await ollama.ainvoke([
+        {"role": "system", "content": router_instructions},
+        {"role": "user", "content": question}
+    ], model, format="json")
+    return json.loads(response.content).get("datasource", "vectorstore")
+
+# API endpoint to answer a question from the RAG sources within the request deadline. A stage that
+# runs out of time falls back (routing to the vectorstore, retrieval to no context) and generation
+# stops where it is, so a late answer comes back partial instead of not at all. Questions the
+# router sends to web search skip retrieval: no web search is configured, so the model answers
+# them without context. Without a corpus the question goes straight to the model (datasource null).
+@app.post("/ask")
+async def ask_question(question: str = Form(...), model: str = Form(None)):
+    cut_short, datasource, docs = [], None, []
+    if retriever is not None:
+        try:
+            datasource, routing_cut = await within_deadline(route_question(question, model), ROUTE_DEADLINE_SHARE,
+                                                            "vectorstore")
+        except CircuitOpen as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            logging.error(f"Error routing question: {str(e)}")
+            datasource, routing_cut = "vectorstore", False
+        if routing_cut:
+            cut_short.append("routing")
+    if datasource not in (None, "websearch"):
+        docs, retrieval_cut = await within_deadline(asyncio.to_thread(retriever.invoke, question),
+                                                    RETRIEVAL_DEADLINE_SHARE, [])
+        if retrieval_cut:
+            cut_short.append("retrieval")
+        prompt = rag_prompt.format(context=format_docs(docs), question=question)
+    else:
+        prompt = question
+    answer = []
+    try:
+        async for chunk in ollama.astream([{"role": "user", "content": prompt}], model):
+            answer.append(chunk.content)
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error generating answer: {str(e)}")
+        return {"error": f"Error generating answer: {str(e)}"}
+    if current_deadline().expired:
+        cut_short.append("generation")
+    return {"answer": "".join(answer), "datasource": datasource, "documents": len(docs),
+            "partial": bool(cut_short), "cut_short": cut_short}
+
+# Files named in requests must lie inside a configured directory once symlinks and ".." are
+# resolved, so the API can't be used to read arbitrary files of the server
+RAG_SOURCES_DIR = os.environ.get("RAG_SOURCES_DIR", "rag_sources")
+
+def allowed_path(path: str, directory: str) -> str:
+    root = os.path.realpath(directory)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=403, detail=f"{path} is outside the {directory} directory")
+    return resolved
+
+# Admin endpoints to list, add and remove RAG sources (web URLs, or files under RAG_SOURCES_DIR) at runtime
+def _require_corpus() -> CorpusIndex:
+    if corpus is None:
+        raise HTTPException(status_code=409, detail="Runtime source management requires VISIO_WORKERS=1")
+    return corpus
+
+def _save_sources():
+    get_shared_store().set("rag", "sources", [state["source"] for state in corpus.describe()])
+
+@app.get("/admin/sources")
+async def get_sources():
+    return {"version": _require_corpus().version, "sources": corpus.describe()}
+
+@app.post("/admin/sources")
+async def add_source(source: str = Form(...)):
+    if is_local_source(source):
+        source = allowed_path(source[len("file://"):] if source.startswith("file://") else source, RAG_SOURCES_DIR)
+    if not _require_corpus().add_source(source):
+        raise HTTPException(status_code=409, detail=f"Source {source} is already indexed")
+    _save_sources()
+    return await asyncio.to_thread(corpus.refresh)
+
+@app.delete("/admin/sources")
+async def remove_source(source: str):
+    if not _require_corpus().remove_source(source):
+        raise HTTPException(status_code=404, detail=f"Source {source} is not indexed")
+    _save_sources()
+    return await asyncio.to_thread(corpus.refresh)
+
+@app.post("/admin/sources/refresh")
+async def refresh_sources():
+    return await asyncio.to_thread(_require_corpus().refresh)
+
+# The n8n workflows run in-process: LLM nodes call Ollama directly and the add-in's library
+# catalog is kept in the shared store instead of being posted to n8n
+async def workflow_llm(model: str, prompt: str) -> str:
+    response = await ollama.ainvoke([{"role": "user", "content": prompt}], model)
+    return response.content
+
+async def store_library_info(catalog):
+    get_shared_store().set("library", "catalog", catalog)
+    return {"status": "success"}
+
+# VisioCommandProcessorWorkflow hands each parsed command to execute-shape-command. In-process, that
+# route checks the command's parameters and returns the command for the add-in's VisioCommandProcessor
+SHAPE_COMMAND_PARAMETERS = {
+    "CreateShape": ["shapeType"],
+    "DeleteShape": ["shapeType"],
+    "ConnectShapes": ["shapeName1", "shapeName2"],
+}
 
-# API endpoint to get models
-@app.get("/models")
-async def get_models():
+async def execute_shape_command(body):
+    body = body or {}
+    command, parameters = body.get("command"), body.get("parameters") or {}
+    if command not in SHAPE_COMMAND_PARAMETERS:
+        return {"status": "error", "message": f"Unknown shape command: {command}"}
+    missing = [key for key in SHAPE_COMMAND_PARAMETERS[command] if not parameters.get(key)]
+    if missing:
+        return {"status": "error", "message": f"{command} is missing {', '.join(missing)}"}
+    return {"status": "success", "command": command, "parameters": parameters}
+
+# The add-in asks for the model list at startup and announces the model picked in its dropdown
+async def connection_model_list(body):
+    return await model_registry.list_models()
+
+async def model_selected(body):
+    model = (body or {}).get("model")
+    if not model:
+        return {"status": "error", "message": "No model given"}
     try:
-        models = list_models()
-        return {"models": models}
+        return {"status": "loaded", "model": await model_registry.preload(model)}
     except Exception as e:
-        logging.error(f"Error fetching models: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching models: {str(e)}")
+        logging.error(f"Error preloading model {model}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Error preloading model {model}: {str(e)}")
+
+workflow_engine = WorkflowEngine.from_files(llm=workflow_llm, local_routes={
+    "send-library-info": store_library_info,
+    "execute-shape-command": execute_shape_command,
+    "connection_model_list": connection_model_list,
+    "model-selected": model_selected,
+})
+
+# Webhook endpoint with n8n's URL layout, so the add-in's API endpoint can point at
+# http://<service>/webhook instead of n8n; per-node timings are returned in Server-Timing
+@app.post("/webhook/{path:path}")
+async def run_workflow_webhook(path: str, request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    path = path.strip("/")
+    if path in workflow_engine.local_routes:
+        return await workflow_engine.local_routes[path](body)
+    try:
+        run = await workflow_engine.run_webhook(path, body, dict(request.headers), dict(request.query_params))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No workflow serves /webhook/{path}")
+    except WorkflowError as e:
+        logging.error(str(e))
+        if isinstance(e.__cause__, (DeadlineExceeded, CircuitOpen)):
+            # The nodes that finished are in the timings; the client's HttpClient gets an answer in time
+            status = 504 if isinstance(e.__cause__, DeadlineExceeded) else 503
+            return JSONResponse(status_code=status, content={"error": str(e), "partial": True, "timings": e.run.report()},
+                                headers={"Server-Timing": server_timing(e.run.report())})
+        return JSONResponse(status_code=500, content={"error": str(e), "timings": e.run.report()},
+                            headers={"Server-Timing": server_timing(e.run.report())})
+    result = run.result()
+    headers = {"Server-Timing": server_timing(run.report())}
+    if isinstance(result, str):
+        return PlainTextResponse(result, headers=headers)
+    return JSONResponse(content=result, headers=headers)
+
+# API endpoint to list the loaded workflows and their per-node timings
+@app.get("/workflows")
+async def get_workflows():
+    return {"workflows": workflow_engine.describe(), "stats": workflow_engine.stats.snapshot()}
+
+# API endpoint to report how much command traffic the deterministic parser served
+@app.get("/fast-path/stats")
+async def get_fast_path_stats():
+    return fast_path_stats.snapshot()
+
+# API endpoints to list and download captured profiles
+@app.get("/profiles")
+async def get_profiles(limit: int = 100):
+    return {"profiles": list_profiles(limit)}
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, report: bool = False):
+    path = profile_file(profile_id, report=report)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return FileResponse(path, filename=os.path.basename(path))
 
 # Function to handle prompts from the agent
 async def handle_prompt_from_agent(prompt: str, model: str):
     try:
-        response = llm_json_mode.invoke([
+        response = await ollama.ainvoke([
             {"role": "system", "content": manager_agent_instructions},
             {"role": "user", "content": prompt}
-        ])
+        ], model, format="json")
         return json.loads(response.content)
     except Exception as e:
         logging.error(f"Error processing prompt: {str(e)}")
@@ -353,32 +636,270 @@ async def handle_agent_prompt(prompt: str = Form(...), model: str = Form("llama3
         logging.error(f"Error processing AI prompt: {str(e)}")
         return {"error": f"Error processing AI prompt: {str(e)}"}
 
-# Function to process Visio commands
-def process_visio_agent_command(command):
+# Function to process Visio commands; shape references are checked against the session canvas
+async def process_visio_agent_command(command, canvas: CanvasState):
+    # Fully specified commands are parsed deterministically; only ambiguous ones reach the LLM
+    actions = parse_command(command, known_shapes=canvas.shapes)
+    if actions is not None:
+        return expand_bulk_actions(actions[0] if len(actions) == 1 else actions)
     try:
-        response = llm_json_mode.invoke([
+        response = await ollama.ainvoke([
             {"role": "system", "content": action_agent_instructions},
             {"role": "user", "content": command}
-        ])
-        return json.loads(response.content)
+        ], format="json")
+        # Bulk actions keep the model's output short; they are expanded into shapes here
+        return expand_bulk_actions(json.loads(response.content))
     except Exception as e:
         logging.error(f"Error processing Visio command: {str(e)}")
         return {"error": f"Error processing command: {str(e)}"}
 
-# WebSocket endpoint for Visio commands
+# Tool-calling variant: one model turn produces all the tool calls, which then run concurrently
+# except where a call refers to a shape created by another (see tool_registry)
+async def tool_visio_agent_command(command, canvas: CanvasState):
+    actions = parse_command(command, known_shapes=canvas.shapes)
+    if actions is not None:
+        return expand_bulk_actions(actions[0] if len(actions) == 1 else actions)
+    try:
+        turn = await run_tool_turn(llm, command, guard=ollama.guard)
+        logging.info(f"Ran {len(turn['calls'])} tool calls in {len(turn['waves'])} waves "
+                     f"({turn['model_ms']} ms model, {turn.get('duration_ms', 0)} ms tools)")
+        failed = [result for result in turn["results"] if result["status"] == "error"]
+        if not turn["actions"]:
+            return {"error": failed[0]["error"] if failed else "Model made no tool calls."}
+        return turn["actions"]
+    except DeadlineExceeded:
+        return {"error": "Error processing command: no answer from Ollama before the deadline"}
+    except Exception as e:
+        logging.error(f"Error processing Visio command with tools: {str(e)}")
+        return {"error": f"Error processing command: {str(e)}"}
+
+# Session history lives in the shared store so any worker can serve a reconnecting client
+SESSION_TTL = 24 * 60 * 60
+SESSION_HISTORY_LENGTH = 20
+
+def record_session_command(session_id: str, command: str, response):
+    store = get_shared_store()
+    session = store.get("sessions", session_id, {"history": []})
+    session["history"] = (session["history"] + [{"command": command, "response": response}])[-SESSION_HISTORY_LENGTH:]
+    store.set("sessions", session_id, session, ttl=SESSION_TTL)
+
+# Canvas contents per session, used to check shape references in speculative mode
+def load_canvas(session_id: str) -> CanvasState:
+    return CanvasState.from_dict(get_shared_store().get("canvas", session_id))
+
+def save_canvas(session_id: str, canvas: CanvasState):
+    get_shared_store().set("canvas", session_id, canvas.to_dict(), ttl=SESSION_TTL)
+
+# Speculative mode: each action is validated and sent as soon as it has streamed in, followed by a
+# commit or rollback once the full response is known
+async def stream_visio_agent_command(command: str, canvas: CanvasState, send) -> SpeculativeExecutor:
+    executor = SpeculativeExecutor(canvas)
+    actions = parse_command(command, known_shapes=canvas.shapes)
+    if actions is not None:
+        for event in executor.admit_all(actions):
+            await send(event)
+        return executor
+    try:
+        # Closed as soon as the executor is done, so the stream's breaker outcome is recorded then
+        async with aclosing(ollama.astream([
+            {"role": "system", "content": action_agent_instructions},
+            {"role": "user", "content": command}
+        ], format="json")) as stream:
+            async for chunk in stream:
+                for event in executor.feed(chunk.content):
+                    await send(event)
+                if executor.done:
+                    break
+        if not executor.done and current_deadline().expired:
+            # Out of time: the actions validated so far are kept and the commit is marked partial
+            events = executor.commit_partial("Deadline reached before the response was complete.")
+        else:
+            events = executor.finish()
+        for event in events:
+            await send(event)
+    except Exception as e:
+        logging.error(f"Error streaming Visio command: {str(e)}")
+        if not executor.done:
+            await send(executor.rollback([f"Error processing command: {str(e)}"]))
+    return executor
+
+# Structural questions ("what is connected to the pump?") are answered from the canvas's
+# connectivity graph, and structural commands ("delete everything downstream of valve 3") become
+# an action batch for the resolved shapes, without a model call
+async def send_structural_result(result: dict, canvas: CanvasState, speculative: bool, send):
+    if result.get("actions") and speculative:
+        executor = SpeculativeExecutor(canvas)
+        for event in executor.admit_all(result["actions"]):
+            await send(event)
+        return executor.actions if not executor.problems else {"error": executor.problems}
+    if result.get("actions"):
+        for index, action in enumerate(result["actions"]):
+            canvas.apply(f"graph.{index}", action)
+        response = result["actions"]
+    else:
+        response = {key: value for key, value in result.items() if key != "actions"}
+    await send(response)
+    return response
+
+# API endpoint for the connectivity graph of a session's canvas
+@app.get("/sessions/{session_id}/graph")
+async def get_session_graph(session_id: str):
+    canvas = load_canvas(session_id)
+    return {"shapes": list(canvas.graph.shapes), "connections": canvas.connections,
+            "components": canvas.graph.components()}
+
+# API endpoint to answer a structural question about a session's canvas; commands return their
+# action batch without applying it
+@app.post("/sessions/{session_id}/query")
+async def query_session_graph(session_id: str, question: str = Form(...)):
+    result = answer_structural_query(question, load_canvas(session_id).graph)
+    if result is None:
+        raise HTTPException(status_code=422, detail="Not a structural question, or the shape is ambiguous")
+    return result
+
+# API endpoint to load a page of an existing drawing under DRAWINGS_DIR as a session's canvas,
+# without the add-in
+DRAWINGS_DIR = os.environ.get("DRAWINGS_DIR", "drawings")
+
+@app.post("/sessions/{session_id}/canvas")
+async def load_drawing_canvas(session_id: str, path: str = Form(...), page: int = Form(0)):
+    path = allowed_path(path, DRAWINGS_DIR)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Drawing {path} not found")
+    pages = await asyncio.to_thread(lambda: list(iter_vsdx_pages(path)))
+    if not 0 <= page < len(pages):
+        raise HTTPException(status_code=404, detail=f"Drawing {path} has no page {page}")
+    connections = [c for c in pages[page]["connections"] if c["from"] and c["to"]]
+    canvas = CanvasState(canvas_shapes(pages[page]), synced=True, connections=connections)
+    save_canvas(session_id, canvas)
+    return {"page": pages[page]["page"], "shapes": canvas.shapes, "connections": pages[page]["connections"]}
+
+# API endpoint to write an action list (plus optional connections) as a .vsdx drawing the add-in
+# opens in one operation (ImportDiagram) instead of issuing one command per shape
+@app.post("/diagram/vsdx")
+async def export_vsdx(actions: str = Form(...), connections: str = Form("[]")):
+    try:
+        data = await asyncio.to_thread(build_vsdx, json.loads(actions), json.loads(connections))
+    except (json.JSONDecodeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(content=data, media_type="application/vnd.ms-visio.drawing",
+                    headers={"Content-Disposition": "attachment; filename=diagram.vsdx"})
+
+# API endpoint to turn a long document into one diagram. Chunks are extracted concurrently and
+# progress is streamed as NDJSON, ending with the merged graph and its action batch. With a
+# session_id the actions are also applied to that session's canvas. A document given by path must
+# be a file under DOCUMENTS_DIR.
+DOCUMENTS_DIR = os.environ.get("DOCUMENTS_DIR", "documents")
+DOCUMENT_CALL_DEADLINE_SECONDS = float(os.environ.get("DOCUMENT_CALL_DEADLINE_SECONDS", "120"))
+
+@app.post("/diagram/from-document")
+async def diagram_from_document(document: str = Form(None), path: str = Form(None), model: str = Form(None),
+                                concurrency: int = Form(DOCUMENT_CONCURRENCY), session_id: str = Form(None)):
+    if document is None and path is None:
+        raise HTTPException(status_code=422, detail="Either document or path is required")
+    if document is None:
+        path = allowed_path(path, DOCUMENTS_DIR)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail=f"Document {path} not found")
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            document = f.read()
+    async def complete(system: str, text: str) -> str:
+        # The stream outlives the request deadline, so each extraction call gets its own; a circuit
+        # opened by failing calls fails the remaining chunks fast
+        with deadline_scope(DOCUMENT_CALL_DEADLINE_SECONDS, independent=True):
+            response = await ollama.ainvoke([{"role": "system", "content": system}, {"role": "user", "content": text}],
+                                            model, format="json")
+        return response.content
+
+    async def events():
+        async for event in document_to_diagram(document, complete, concurrency):
+            if event["type"] == "result" and session_id and event["actions"] and not event["problems"]:
+                canvas = load_canvas(session_id)
+                for index, action in enumerate(event["actions"]):
+                    canvas.apply(f"document.{index}", action)
+                save_canvas(session_id, canvas)
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+def _canvas_message(data):
+    # Clients report their canvas as {"type": "canvas_state", "shapes": [...]}; anything else is a command
+    if isinstance(data, dict):
+        return data if data.get("type") == "canvas_state" else None
+    if not data.lstrip().startswith("{"):
+        return None
+    try:
+        message = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return message if isinstance(message, dict) and message.get("type") == "canvas_state" else None
+
+def _command_text(data) -> str:
+    # Binary clients send a command as a bare string or as {"type": "command", "command": "..."}
+    if isinstance(data, dict):
+        return str(data.get("command", ""))
+    return data
+
+# WebSocket endpoint for Visio commands (?speculative=1 streams provisional actions). The wire
+# format (JSON or MessagePack, optionally gzip) is negotiated per connection, see wire_format
 @app.websocket("/ws/visio-command")
-async def websocket_visio_command(websocket: WebSocket):
-    await websocket.accept()
+async def websocket_visio_command(websocket: WebSocket, session_id: str = None, speculative: bool = False):
+    wire = await WebSocketWire.accept(websocket)
+    # A profile flag on the connection applies to each message it carries
+    flag = request_flag(websocket.scope)
+    canvas = load_canvas(session_id) if session_id else CanvasState()
+    message_timeout = request_timeout(websocket.scope) or REQUEST_DEADLINE_SECONDS
     while True:
         try:
-            data = await websocket.receive_text()
-            logging.info(f"Received Visio command: {data}")
-            processed_data = process_visio_agent_command(data)
-            await websocket.send_text(json.dumps(processed_data))
+            message = await wire.receive()
+            # Each command gets its own deadline; waiting for the next message doesn't count
+            with deadline_scope(message_timeout):
+                canvas_message = _canvas_message(message)
+                if canvas_message is not None:
+                    canvas = CanvasState(canvas_message.get("shapes", []), synced=True,
+                                         connections=canvas_message.get("connections"))
+                    if session_id:
+                        save_canvas(session_id, canvas)
+                    continue
+                data = _command_text(message)
+                logging.info(f"Received Visio command: {data}")
+                structural = answer_structural_query(data, canvas.graph)
+                if structural is not None:
+                    response = await send_structural_result(structural, canvas, speculative, wire.send)
+                    if session_id:
+                        record_session_command(session_id, data, response)
+                        save_canvas(session_id, canvas)
+                    continue
+                if speculative:
+                    executor = await stream_visio_agent_command(data, canvas, wire.send)
+                    if session_id:
+                        record_session_command(session_id, data, executor.actions if not executor.problems
+                                               else {"error": executor.problems})
+                        save_canvas(session_id, canvas)
+                    continue
+                with profile_block("websocket", "/ws/visio-command", flag=flag, session_id=session_id, message=data[:200]):
+                    if ACTION_TOOL_CALLING:
+                        processed_data = await tool_visio_agent_command(data, canvas)
+                    else:
+                        processed_data = await process_visio_agent_command(data, canvas)
+                    # Keep the canvas (and its connectivity graph) in step with what the client will draw
+                    if not validate_actions(processed_data):
+                        command_id = uuid.uuid4().hex[:12]
+                        actions = processed_data if isinstance(processed_data, list) else [processed_data]
+                        for index, action in enumerate(actions):
+                            canvas.apply(f"{command_id}.{index}", action)
+                    if session_id:
+                        record_session_command(session_id, data, processed_data)
+                        save_canvas(session_id, canvas)
+                await wire.send(processed_data)
         except WebSocketDisconnect:
             logging.info("WebSocket disconnected")
             break
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if workers > 1:
+        # Workers import this module by name; the index above was already built by this process
+        uvicorn.run("WorkingRagLangChain:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,167 @@
+import logging
+import sys
+import uuid
+from typing import Dict, List, Optional
+
+from langchain.schema import Document
+
+logging.basicConfig(level=logging.INFO)
+
+# Compact storage for split documents. Each source text is kept once and chunks are (doc_id,
+# start, end) offsets into it, so the overlap the splitter adds between neighbouring chunks costs
+# nothing. Metadata dicts are interned: chunks of the same source share one dict. Documents are
+# only built for the results a caller actually asks for.
+
+class ChunkRecord:
+    __slots__ = ("doc_id", "start", "end", "metadata_id")
+
+    def __init__(self, doc_id: int, start: int, end: int, metadata_id: int):
+        self.doc_id = doc_id
+        self.start = start
+        self.end = end
+        self.metadata_id = metadata_id
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+class ChunkStore:
+    def __init__(self):
+        self.sources: List[Optional[str]] = []
+        self.records: List[Optional[ChunkRecord]] = []
+        self._live = 0
+        self._metadata: List[Dict] = []
+        self._metadata_ids: Dict[tuple, int] = {}
+
+    def _intern_metadata(self, metadata: Dict) -> int:
+        key = _freeze(metadata)
+        metadata_id = self._metadata_ids.get(key)
+        if metadata_id is None:
+            metadata_id = self._metadata_ids[key] = len(self._metadata)
+            self._metadata.append(dict(metadata))
+        return metadata_id
+
+    def add_document(self, text: str, metadata: Dict, chunks: List[str]) -> List[int]:
+        """
+        Stores a source text and the chunks split from it; returns the new chunk ids. Each chunk is
+        located in the source after the previous one, the way the splitter's add_start_index does.
+        """
+        doc_id = len(self.sources)
+        self.sources.append(text)
+        metadata_id = self._intern_metadata(metadata)
+        chunk_ids = []
+        position = 0
+        for chunk in chunks:
+            start = text.find(chunk, position)
+            if start == -1:
+                start = text.find(chunk)
+            if start == -1:
+                # The splitter rewrote the text (e.g. normalized separators); keep this chunk as its own source
+                start, chunk_doc_id = 0, len(self.sources)
+                self.sources.append(chunk)
+            else:
+                chunk_doc_id = doc_id
+                position = start + 1
+            chunk_ids.append(len(self.records))
+            self.records.append(ChunkRecord(chunk_doc_id, start, start + len(chunk), metadata_id))
+        self._live += len(chunk_ids)
+        return chunk_ids
+
+    def remove_document(self, chunk_ids: List[int]):
+        """
+        Drops the chunks returned by one add_document call, and the text they point into. Chunk ids
+        are never reused, so ids held elsewhere stay valid for the chunks that remain.
+        """
+        for chunk_id in chunk_ids:
+            record = self.records[chunk_id]
+            if record is not None:
+                self.sources[record.doc_id] = None
+                self.records[chunk_id] = None
+                self._live -= 1
+
+    def add_documents(self, documents: List[Document], splitter) -> List[int]:
+        """
+        Splits LangChain documents with a text splitter straight into the store.
+        """
+        chunk_ids = []
+        for doc in documents:
+            chunk_ids.extend(self.add_document(doc.page_content, doc.metadata, splitter.split_text(doc.page_content)))
+        return chunk_ids
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return 0 <= chunk_id < len(self.records) and self.records[chunk_id] is not None
+
+    def text(self, chunk_id: int) -> str:
+        record = self.records[chunk_id]
+        return self.sources[record.doc_id][record.start:record.end]
+
+    def metadata(self, chunk_id: int) -> Dict:
+        return self._metadata[self.records[chunk_id].metadata_id]
+
+    def document(self, chunk_id: int) -> Document:
+        return Document(page_content=self.text(chunk_id), metadata=dict(self.metadata(chunk_id)))
+
+    def stats(self) -> Dict:
+        """
+        Approximate resident bytes of the store next to the same chunks held as separate strings and dicts.
+        """
+        live = [i for i, record in enumerate(self.records) if record is not None]
+        stored = sum(sys.getsizeof(s) for s in self.sources if s is not None) + sys.getsizeof(self.records) + \
+            sum(sys.getsizeof(self.records[i]) for i in live) + sum(sys.getsizeof(m) for m in self._metadata)
+        expanded = sum(sys.getsizeof(self.text(i)) + sys.getsizeof(dict(self.metadata(i))) for i in live)
+        return {
+            "chunks": len(live),
+            "sources": sum(1 for s in self.sources if s is not None),
+            "metadata_entries": len(self._metadata),
+            "bytes": stored,
+            "bytes_as_documents": expanded,
+        }
+
+# Vector stores that need UUID point ids (Qdrant) get one derived from the chunk id
+def chunk_point_id(chunk_id: int) -> str:
+    return str(uuid.UUID(int=chunk_id))
+
+def point_chunk_id(point_id: str) -> int:
+    return uuid.UUID(point_id).int
+
+# Search over a vector store that holds only vectors and chunk ids; texts stay in the ChunkStore.
+# Every entry shares one empty metadata dict.
+_NO_METADATA = {}
+
+class ChunkStoreSearch:
+    def __init__(self, store, chunks: ChunkStore, embeddings):
+        self.store = store
+        self.chunks = chunks
+        self.embeddings = embeddings
+
+    def index(self, chunk_ids: Optional[List[int]] = None, batch_size: int = 256):
+        """
+        Embeds and inserts chunks (all of them by default) in batches.
+        """
+        chunk_ids = [i for i in range(len(self.chunks.records)) if i in self.chunks] if chunk_ids is None else chunk_ids
+        for start in range(0, len(chunk_ids), batch_size):
+            ids = chunk_ids[start:start + batch_size]
+            self.add_vectors(ids, self.embeddings.embed_documents([self.chunks.text(i) for i in ids]))
+        self.store.flush()
+
+    def add_vectors(self, chunk_ids: List[int], vectors):
+        """
+        Inserts already computed vectors for chunks of the ChunkStore.
+        """
+        self.store.add(vectors, [""] * len(chunk_ids), [_NO_METADATA] * len(chunk_ids),
+                       [chunk_point_id(i) for i in chunk_ids])
+
+    def remove_vectors(self, chunk_ids: List[int]):
+        self.store.delete([chunk_point_id(i) for i in chunk_ids])
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[tuple]:
+        hits = self.store.search(self.embeddings.embed_query(query), k)
+        # A chunk removed between the search and this lookup is skipped
+        return [(self.chunks.document(chunk_id), hit.score) for hit in hits
+                if (chunk_id := point_chunk_id(hit.id)) in self.chunks]
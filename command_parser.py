@@ -0,0 +1,430 @@
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Union
+from tools import MAX_BULK_SHAPES, clamp_to_canvas
+
+logging.basicConfig(level=logging.INFO)
+
+# Vocabulary of the deterministic command grammar. Anything outside it makes a message
+# ambiguous, and ambiguous messages are left to the Action Agent LLM.
+
+VERBS = {
+    "create": "create_shape", "add": "create_shape", "draw": "create_shape", "make": "create_shape",
+    "place": "create_shape", "insert": "create_shape", "put": "create_shape",
+    "delete": "delete_shape", "remove": "delete_shape", "erase": "delete_shape",
+    "connect": "connect_shapes", "link": "connect_shapes", "join": "connect_shapes",
+    "change": "modify_shape", "modify": "modify_shape", "set": "modify_shape", "recolor": "modify_shape",
+    "color": "modify_shape", "colour": "modify_shape", "paint": "modify_shape",
+    "move": "modify_shape", "resize": "modify_shape",
+}
+
+SHAPES = {
+    "circle": "circle", "circles": "circle",
+    "square": "square", "squares": "square",
+    "rectangle": "rectangle", "rectangles": "rectangle", "rect": "rectangle", "rects": "rectangle",
+    "line": "line", "lines": "line",
+}
+
+COLORS = [
+    "red", "green", "blue", "yellow", "orange", "purple", "pink", "black", "white", "gray", "grey",
+    "brown", "cyan", "magenta", "teal", "navy", "lime", "maroon", "olive", "violet", "gold", "silver",
+]
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+# Named positions on the 0-100 canvas (y grows downwards, as in VisioCommandProcessor)
+NAMED_POSITIONS = {
+    "top left": (15, 15), "top right": (85, 15), "bottom left": (15, 85), "bottom right": (85, 85),
+    "upper left": (15, 15), "upper right": (85, 15), "lower left": (15, 85), "lower right": (85, 85),
+    "top": (50, 15), "bottom": (50, 85), "left": (15, 50), "right": (85, 50),
+    "center": (50, 50), "centre": (50, 50), "middle": (50, 50),
+}
+
+SIZE_WORDS = {"tiny": 5, "small": 10, "medium": 20, "big": 35, "large": 35, "huge": 50}
+
+RELATIONS = {"above": (0, -1), "below": (0, 1), "under": (0, 1), "left of": (-1, 0), "right of": (1, 0), "next to": (1, 0)}
+
+# Words that carry no meaning for the grammar
+FILLER = {
+    "the", "at", "in", "on", "of", "with", "to", "and", "shape", "shapes", "position", "size",
+    "please", "canvas", "page", "corner", "side", "new", "it", "its", "color", "colour", "by",
+}
+
+# Shapes cycled through when a request asks for generic "shapes"
+GENERIC_SHAPES = ["circle", "square", "rectangle"]
+LAYOUT_WORDS = {"grid": "grid", "row": "row", "line": "row", "column": "column", "circle": "circle", "ring": "circle"}
+
+DEFAULT_SIZE = 20
+RELATIVE_OFFSET = 20
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+_COORDINATES = re.compile(rf"\(?\s*(?:x\s*=?\s*)?({_NUMBER})\s*[,;]\s*(?:y\s*=?\s*)?({_NUMBER})\s*\)?", re.I)
+_DIMENSIONS = re.compile(rf"({_NUMBER})\s*(?:x|by|\*)\s*({_NUMBER})", re.I)
+_KEYED_NUMBER = re.compile(rf"\b(size|radius|width|height|x|y)\s*(?:=|of|:)?\s*({_NUMBER})", re.I)
+_HEX_COLOR = re.compile(r"#[0-9a-fA-F]{6}\b")
+_LAYOUT = re.compile(r"\b(?:in|as|on|along)\s+(?:a\s+)?(grid|row|line|column|circle|ring)\b", re.I)
+_MIXED_COLORS = re.compile(r"\b(?:different|various|random|multiple|many|assorted|mixed)\s+colou?rs\b", re.I)
+_CLAUSE_SPLIT = re.compile(r"\s*(?:;|\band then\b|\bthen\b|\band\b)\s*", re.I)
+
+# Fast-path usage counters, reported by the service
+class FastPathStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.fallback = 0
+        self.parse_seconds = 0.0
+
+    def record(self, parsed: bool, seconds: float):
+        with self._lock:
+            if parsed:
+                self.parsed += 1
+            else:
+                self.fallback += 1
+            self.parse_seconds += seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            total = self.parsed + self.fallback
+            return {
+                "total": total,
+                "fast_path": self.parsed,
+                "llm_fallback": self.fallback,
+                "fast_path_share": self.parsed / total if total else 0.0,
+                "mean_parse_microseconds": self.parse_seconds / total * 1e6 if total else 0.0,
+            }
+
+fast_path_stats = FastPathStats()
+
+class _Ambiguous(Exception):
+    pass
+
+def _clamp(value: float) -> float:
+    return max(0.0, min(100.0, value))
+
+def _number(text: str) -> Union[int, float]:
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+def _take(pattern, text: str, found: List):
+    """
+    Removes every match of pattern from text, collecting the matches.
+    """
+    def collect(match):
+        found.append(match)
+        return " "
+    return pattern.sub(collect, text)
+
+def _take_words(words, text: str, found: List):
+    """
+    Removes vocabulary words (case-insensitively) from text, collecting their canonical spelling.
+    """
+    for word in sorted(words, key=len, reverse=True):
+        pattern = re.compile(rf"\b{re.escape(word)}\b", re.I)
+        if pattern.search(text):
+            found.append(word)
+            text = pattern.sub(" ", text)
+    return text
+
+def _parse_reference(text: str) -> Dict:
+    """
+    Parses a shape reference such as "the red circle" or "A".
+    """
+    colors = []
+    text = _take(_HEX_COLOR, text, colors)
+    colors = [m.group(0).lower() for m in colors]
+    text = _take_words(COLORS, text, colors)
+    shapes = []
+    text = _take_words(SHAPES, text, shapes)
+    words = [w for w in re.findall(r"[\w#]+", text) if w.lower() not in FILLER]
+    if shapes or colors:
+        # Articles only count as a name ("connect A to B") when nothing else identifies the shape
+        words = [w for w in words if w.lower() not in ("a", "an")]
+    if len(colors) > 1 or len(shapes) > 1:
+        raise _Ambiguous()
+    reference = {}
+    if shapes:
+        reference["shape"] = SHAPES[shapes[0]]
+    if colors:
+        reference["color"] = colors[0]
+    if words:
+        # A bare name like "A" or "pump1" refers to a shape by name
+        if len(words) > 1 or shapes or colors:
+            raise _Ambiguous()
+        reference["name"] = words[0]
+    if not reference:
+        raise _Ambiguous()
+    return reference
+
+def _resolve_reference(reference: Dict, known_shapes: Optional[List[Dict]]) -> Dict:
+    if not known_shapes:
+        raise _Ambiguous()
+    matches = [
+        shape for shape in known_shapes
+        if all(shape.get(key) == value for key, value in reference.items())
+    ]
+    if len(matches) != 1:
+        raise _Ambiguous()
+    return matches[0]
+
+def _parse_create(text: str, known_shapes: Optional[List[Dict]]) -> List[Dict]:
+    # Relative position ("below the red circle") is split off first so its words are not reused
+    anchor = None
+    for relation in sorted(RELATIONS, key=len, reverse=True):
+        match = re.search(rf"\b{relation}\b(.*)$", text, re.I)
+        if match:
+            anchor = _resolve_reference(_parse_reference(match.group(1)), known_shapes)
+            anchor_direction = RELATIONS[relation]
+            text = text[:match.start()]
+            break
+
+    dimensions, keyed, coordinates, colors, shapes, named, sizes = [], [], [], [], [], [], []
+    layouts, mixed_colors = [], []
+    text = _take(_LAYOUT, text, layouts)
+    text = _take(_MIXED_COLORS, text, mixed_colors)
+    generic = re.search(r"\bshapes\b", text, re.I) is not None
+    text = _take(_DIMENSIONS, text, dimensions)
+    text = _take(_KEYED_NUMBER, text, keyed)
+    text = _take(_COORDINATES, text, coordinates)
+    hex_colors = []
+    text = _take(_HEX_COLOR, text, hex_colors)
+    text = _take_words(COLORS, text, colors)
+    colors = [m.group(0).lower() for m in hex_colors] + colors
+    text = _take_words(SHAPES, text, shapes)
+    text = _take_words(NAMED_POSITIONS, text, named)
+    text = _take_words(SIZE_WORDS, text, sizes)
+
+    count = None
+    words = []
+    for word in re.findall(r"[\w#.-]+", text.lower()):
+        if word in NUMBER_WORDS and count is None:
+            count = NUMBER_WORDS[word]
+        elif re.fullmatch(r"\d+", word) and count is None:
+            count = int(word)
+        elif word not in FILLER:
+            words.append(word)
+
+    if words or len(shapes) > 1 or len(colors) > 1 or len(coordinates) > 1 or len(named) > 1 or len(sizes) > 1:
+        raise _Ambiguous()
+    if coordinates and named or anchor and (coordinates or named) or len(layouts) > 1:
+        raise _Ambiguous()
+    if count == 0:
+        raise _Ambiguous()
+    count = count or 1
+    if count > 1 or layouts or mixed_colors:
+        return _bulk_create(count, shapes, generic, colors, layouts, mixed_colors, coordinates, named, sizes, dimensions,
+                            keyed, anchor)
+    if not shapes:
+        raise _Ambiguous()
+
+    shape = SHAPES[shapes[0]]
+    width = height = SIZE_WORDS[sizes[0]] if sizes else DEFAULT_SIZE
+    radius = None
+    x = y = None
+    if dimensions:
+        width, height = _number(dimensions[0].group(1)), _number(dimensions[0].group(2))
+    for match in keyed:
+        key, value = match.group(1).lower(), _number(match.group(2))
+        if key == "size":
+            width = height = value
+        elif key == "radius":
+            radius = value
+            width = height = value * 2
+        elif key == "width":
+            width = value
+        elif key == "height":
+            height = value
+        elif key == "x":
+            x = value
+        elif key == "y":
+            y = value
+    if (x is None) != (y is None):
+        raise _Ambiguous()
+    if coordinates:
+        x, y = _number(coordinates[0].group(1)), _number(coordinates[0].group(2))
+    elif named:
+        x, y = NAMED_POSITIONS[named[0]]
+    elif anchor:
+        dx, dy = anchor_direction
+        x = _clamp(anchor["x"] + dx * RELATIVE_OFFSET)
+        y = _clamp(anchor["y"] + dy * RELATIVE_OFFSET)
+    elif x is None:
+        x, y = 50, 50
+    if shape in ("square", "circle"):
+        # One side given sizes both; two different sides ("square 10x20") are left to the model
+        keys = {match.group(1).lower() for match in keyed}
+        if not dimensions and not keys & {"size", "radius"}:
+            if keys & {"width", "height"} == {"width"}:
+                height = width
+            elif keys & {"width", "height"} == {"height"}:
+                width = height
+        if width != height:
+            raise _Ambiguous()
+    if shape == "circle" and radius is None:
+        radius = width / 2
+    if width <= 0 or height <= 0:
+        raise _Ambiguous()
+    # Keep the whole shape on the canvas, as tools.create_shape does
+    x, y = clamp_to_canvas(x, y, width, height)
+
+    action = {"action": "create_shape", "shape": shape, "x": x, "y": y, "width": width, "height": height}
+    if radius is not None:
+        action["radius"] = radius
+    if colors:
+        action["color"] = colors[0]
+    return [action]
+
+def _bulk_create(count, shapes, generic, colors, layouts, mixed_colors, coordinates, named, sizes, dimensions, keyed,
+                 anchor) -> List[Dict]:
+    """
+    Builds a single create_shapes_bulk action; the service expands it into individual shapes.
+    """
+    if count < 2 or count > MAX_BULK_SHAPES or anchor or colors and mixed_colors or dimensions:
+        raise _Ambiguous()
+    # Without a shape type the request must ask for generic "shapes" ("create 5 red" names nothing)
+    if not shapes and not generic:
+        raise _Ambiguous()
+    if any(match.group(1).lower() not in ("size", "radius") for match in keyed):
+        raise _Ambiguous()
+    action = {
+        "action": "create_shapes_bulk",
+        "count": count,
+        "shapes": [SHAPES[shapes[0]]] if shapes else list(GENERIC_SHAPES),
+        "layout": LAYOUT_WORDS[layouts[0].group(1).lower()] if layouts else ("row" if count <= 5 else "grid"),
+    }
+    if colors:
+        action["palette"] = [colors[0]]
+    size = SIZE_WORDS[sizes[0]] if sizes else None
+    for match in keyed:
+        value = _number(match.group(2))
+        size = value * 2 if match.group(1).lower() == "radius" else value
+    if size is not None:
+        if size <= 0:
+            raise _Ambiguous()
+        action["size_range"] = [size, size]
+    if coordinates:
+        action["x"], action["y"] = _number(coordinates[0].group(1)), _number(coordinates[0].group(2))
+    elif named:
+        action["x"], action["y"] = NAMED_POSITIONS[named[0]]
+    return [action]
+
+def _check_reference(reference: Dict, known_shapes: Optional[List[Dict]]):
+    # With a canvas to check against, a reference must name exactly one shape on it
+    if known_shapes:
+        _resolve_reference(reference, known_shapes)
+
+def _parse_delete(text: str, known_shapes: Optional[List[Dict]]) -> List[Dict]:
+    if re.search(r"\b(all|every|everything)\b", text, re.I):
+        raise _Ambiguous()
+    reference = _parse_reference(text)
+    if "shape" not in reference:
+        raise _Ambiguous()
+    _check_reference(reference, known_shapes)
+    return [{"action": "delete_shape", **reference}]
+
+def _parse_connect(text: str, known_shapes: Optional[List[Dict]]) -> List[Dict]:
+    match = re.fullmatch(r"(.+?)\s+(?:to|and|with)\s+(.+)", text.strip(), re.I)
+    if not match:
+        raise _Ambiguous()
+    source, target = _parse_reference(match.group(1)), _parse_reference(match.group(2))
+    _check_reference(source, known_shapes)
+    _check_reference(target, known_shapes)
+    describe = lambda ref: ref.get("name") or " ".join(v for k, v in sorted(ref.items()) if k in ("color", "shape"))
+    return [{
+        "action": "connect_shapes", "shape": "line",
+        "shape1": describe(source), "shape2": describe(target),
+        "from": source, "to": target,
+    }]
+
+def _parse_modify(text: str, known_shapes: Optional[List[Dict]]) -> List[Dict]:
+    text = re.sub(r"^\s*the\s+(colou?r|size|position)\s+of\b", r" \1 of ", text, flags=re.I)
+    match = re.fullmatch(r"(.+?)\s+(?:to|into)\s+(.+)", text.strip(), re.I)
+    if not match:
+        # "make the red square blue": a trailing color is the new one
+        trailing = re.search(rf"\b({'|'.join(COLORS)})\s*$", text, re.I)
+        if not trailing:
+            raise _Ambiguous()
+        target_text, change_text = text[:trailing.start()], trailing.group(1)
+    else:
+        target_text, change_text = match.groups()
+
+    target = _parse_reference(target_text)
+    if "shape" not in target:
+        raise _Ambiguous()
+    _check_reference(target, known_shapes)
+    action = {"action": "modify_shape", "shape": target["shape"]}
+    if "color" in target:
+        action["current_color"] = target["color"]
+
+    change = change_text.strip().lower()
+    coordinates = _COORDINATES.fullmatch(re.sub(r"^(position|at)\s+", "", change))
+    dimensions = _DIMENSIONS.fullmatch(change)
+    if change in COLORS or _HEX_COLOR.fullmatch(change):
+        action["color"] = change
+    elif coordinates:
+        action["x"], action["y"] = _number(coordinates.group(1)), _number(coordinates.group(2))
+    elif change in NAMED_POSITIONS:
+        action["x"], action["y"] = NAMED_POSITIONS[change]
+    elif dimensions:
+        action["width"], action["height"] = _number(dimensions.group(1)), _number(dimensions.group(2))
+    elif re.fullmatch(_NUMBER, change):
+        action["width"] = action["height"] = _number(change)
+    elif change in SIZE_WORDS:
+        action["width"] = action["height"] = SIZE_WORDS[change]
+    else:
+        raise _Ambiguous()
+    return [action]
+
+def _parse_clause(clause: str, verb: Optional[str], known_shapes: Optional[List[Dict]]):
+    words = clause.split()
+    first = words[0].lower() if words else ""
+    if first in VERBS:
+        verb = VERBS[first]
+        clause = " ".join(words[1:])
+    if verb is None:
+        raise _Ambiguous()
+    if verb == "create_shape":
+        # "make the red square blue" is a modification, not a creation
+        if first == "make" and re.match(r"\s*the\b", clause, re.I):
+            return "modify_shape", _parse_modify(clause, known_shapes)
+        return verb, _parse_create(clause, known_shapes)
+    if verb == "delete_shape":
+        return verb, _parse_delete(clause, known_shapes)
+    if verb == "connect_shapes":
+        return verb, _parse_connect(clause, known_shapes)
+    return verb, _parse_modify(clause, known_shapes)
+
+def parse_command(message: str, known_shapes: Optional[List[Dict]] = None) -> Optional[List[Dict]]:
+    """
+    Parses a fully specified canvas command into Action Agent actions without calling a model.
+    known_shapes (dicts with shape/color/name/x/y) lets relative positions like "below the red circle"
+    resolve; when given, shapes to delete, modify or connect must each match exactly one of them.
+    Returns None when the message is not understood or is ambiguous.
+    """
+    start = time.perf_counter()
+    actions = None
+    try:
+        text = message.strip().rstrip(".!")
+        text = re.sub(r"^(please|can you|could you|would you)\s+", "", text, flags=re.I).strip()
+        # "connect A and B" must not be split into two clauses
+        if VERBS.get(text.split(" ", 1)[0].lower()) == "connect_shapes":
+            clauses = [text]
+        else:
+            clauses = [c for c in _CLAUSE_SPLIT.split(text) if c]
+        verb = None
+        actions = []
+        for clause in clauses:
+            verb, clause_actions = _parse_clause(clause, verb, known_shapes)
+            actions.extend(clause_actions)
+        if not actions:
+            actions = None
+    except _Ambiguous:
+        actions = None
+    fast_path_stats.record(actions is not None, time.perf_counter() - start)
+    if actions is not None:
+        logging.info(f"Fast path parsed command '{message}' into {len(actions)} action(s).")
+    return actions
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import requests
+from langchain.schema import Document
+from chunk_store import ChunkStore, ChunkStoreSearch
+from vsdx_parser import parse_many
+
+logging.basicConfig(level=logging.INFO)
+
+# RAG corpus that can change while the service runs. Sources are web pages (re-fetched with
+# conditional requests, ETag / Last-Modified) or local files (polled by size and mtime), including
+# .vsdx drawings. A source whose content hash changed is re-read, re-chunked and re-embedded, and
+# only its entries in the live vector store are replaced; other sources are not touched. The index
+# version changes with every refresh that changed something. A query running during a refresh may
+# briefly see a source's old and new chunks together.
+#
+# Chunk texts live once in a ChunkStore; a source only remembers its validators, content hash and
+# the ids of its chunks there.
+
+class SourceState:
+    def __init__(self, source: str):
+        self.source = source
+        self.etag = None
+        self.last_modified = None
+        self.file_signature = None
+        self.content_hash = None
+        self.chunk_ids: List[int] = []
+        self.refreshed_at = None
+
+    def describe(self) -> Dict:
+        return {
+            "source": self.source,
+            "local": is_local_source(self.source),
+            "chunks": len(self.chunk_ids),
+            "content_hash": self.content_hash,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "refreshed_at": self.refreshed_at,
+        }
+
+def is_local_source(source: str) -> bool:
+    return not source.startswith(("http://", "https://"))
+
+def _local_path(source: str) -> str:
+    return source[len("file://"):] if source.startswith("file://") else source
+
+def _html_document(html: str, source: str) -> Document:
+    # Same text and metadata as WebBaseLoader, so refreshed pages chunk exactly like the initial load
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {"source": source}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if root := soup.find("html"):
+        metadata["language"] = root.get("lang", "No language found.")
+    return Document(page_content=soup.get_text(), metadata=metadata)
+
+class CorpusIndex:
+    def __init__(self, embeddings, splitter, store, session: Optional[requests.Session] = None, timeout: float = 30,
+                 parse_workers: Optional[int] = None):
+        """
+        store is the live vector store, of any backend. Entries it holds from an earlier run can't be
+        matched to this run's chunks, so it is cleared; the first refresh re-adds every source, with
+        unchanged chunks coming from the embedding cache. parse_workers caps the processes that parse
+        changed drawings (default: one per CPU).
+        """
+        self.embeddings = embeddings
+        self.splitter = splitter
+        self.parse_workers = parse_workers
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.sources: Dict[str, SourceState] = {}
+        if len(store):
+            logging.info(f"Clearing {len(store)} entries of the {store.backend} store left by an earlier run.")
+        store.clear()
+        self.chunks = ChunkStore()
+        self.search = ChunkStoreSearch(store, self.chunks, embeddings)
+        self.version: Optional[str] = None
+        self._refresh_lock = threading.Lock()
+        self._sources_lock = threading.Lock()
+        self._removed: List[SourceState] = []
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[tuple]:
+        return self.search.similarity_search_with_relevance_scores(query, k)
+
+    def add_source(self, source: str) -> bool:
+        with self._sources_lock:
+            if source in self.sources:
+                return False
+            self.sources[source] = SourceState(source)
+            return True
+
+    def remove_source(self, source: str) -> bool:
+        """
+        Stops tracking a source; its chunks leave the store on the next refresh.
+        """
+        with self._sources_lock:
+            state = self.sources.pop(source, None)
+            if state is None:
+                return False
+            self._removed.append(state)
+            return True
+
+    def describe(self) -> List[Dict]:
+        with self._sources_lock:
+            return [state.describe() for state in self.sources.values()]
+
+    def _fetch_remote(self, state: SourceState) -> Optional[Document]:
+        headers = {}
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+        response = self.session.get(state.source, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        state.etag = response.headers.get("ETag")
+        state.last_modified = response.headers.get("Last-Modified")
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if content_hash == state.content_hash:
+            return None
+        state.content_hash = content_hash
+        return _html_document(response.text, state.source)
+
+    def _fetch_local(self, state: SourceState) -> Union[Document, str, None]:
+        # A changed drawing comes back as its path; refresh parses the changed drawings together
+        path = _local_path(state.source)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == state.file_signature:
+            return None
+        state.file_signature = signature
+        with open(path, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == state.content_hash:
+            return None
+        state.content_hash = content_hash
+        if path.lower().endswith(".vsdx"):
+            return path
+        text = content.decode("utf-8", errors="replace")
+        if path.lower().endswith((".html", ".htm")):
+            return _html_document(text, state.source)
+        return Document(page_content=text, metadata={"source": state.source})
+
+    def refresh(self, local_only: bool = False) -> Dict:
+        """
+        Checks sources for changes, replaces the chunks of changed ones, drops the chunks of removed
+        ones and bumps the version if anything changed. Returns what was done.
+        """
+        with self._refresh_lock:
+            with self._sources_lock:
+                states = list(self.sources.values())
+                removed, self._removed = self._removed, []
+            changed, failed, fetched = [], [], []
+            for state in states:
+                if local_only and not is_local_source(state.source):
+                    continue
+                validators = (state.etag, state.last_modified, state.file_signature, state.content_hash)
+                try:
+                    fetch = self._fetch_local if is_local_source(state.source) else self._fetch_remote
+                    document = fetch(state)
+                except Exception as e:
+                    self._failed(state, validators, e, failed)
+                    continue
+                if document is not None:
+                    fetched.append((state, validators, document))
+            # Changed drawings are parsed together, in a process pool when there are several
+            drawings = [document for _, _, document in fetched if isinstance(document, str)]
+            summaries = dict(zip(drawings, parse_many(drawings, self.parse_workers)))
+            for state, validators, document in fetched:
+                try:
+                    if isinstance(document, str):
+                        summary = summaries[document]
+                        if "error" in summary:
+                            raise ValueError(summary["error"])
+                        # Drawings are indexed as a text description of their shapes and connections
+                        document = Document(page_content=summary["text"], metadata={"source": state.source})
+                    chunks = self.splitter.split_text(document.page_content)
+                    vectors = np.asarray(self.embeddings.embed_documents(chunks), dtype=np.float32) if chunks else None
+                except Exception as e:
+                    self._failed(state, validators, e, failed)
+                    continue
+                # New chunks go in before the old ones leave, so the source is never missing
+                old_ids = state.chunk_ids
+                state.chunk_ids = self.chunks.add_document(document.page_content, document.metadata, chunks)
+                if state.chunk_ids:
+                    self.search.add_vectors(state.chunk_ids, vectors)
+                self._drop(old_ids)
+                state.refreshed_at = time.time()
+                changed.append(state.source)
+            # Removed sources are dropped last, after any chunks this refresh gave them
+            for state in removed:
+                self._drop(state.chunk_ids)
+                state.chunk_ids = []
+            if changed or removed or self.version is None:
+                self.search.store.flush()
+                self.version = uuid.uuid4().hex
+                logging.info(f"Corpus index version {self.version} live with {len(self.chunks)} chunks "
+                             f"from {len(states)} sources.")
+            return {"changed": changed, "failed": failed, "removed": [state.source for state in removed],
+                    "sources": len(states), "version": self.version}
+
+    def _failed(self, state: SourceState, validators: tuple, error: Exception, failed: List[str]):
+        # A source that can't be fetched, parsed or embedded keeps serving its last good content and
+        # is retried on the next refresh
+        logging.error(f"Error refreshing source {state.source}: {error}")
+        state.etag, state.last_modified, state.file_signature, state.content_hash = validators
+        failed.append(state.source)
+
+    def _drop(self, chunk_ids: List[int]):
+        if chunk_ids:
+            self.search.remove_vectors(chunk_ids)
+            self.chunks.remove_document(chunk_ids)
+
+# Background loop: local files are polled often, web sources less often
+async def run_refresher(corpus: CorpusIndex, remote_interval: float = 3600, local_interval: float = 5):
+    last_remote = time.monotonic()
+    while True:
+        await asyncio.sleep(local_interval)
+        remote_due = time.monotonic() - last_remote >= remote_interval
+        try:
+            await asyncio.to_thread(corpus.refresh, not remote_due)
+        except Exception as e:
+            logging.error(f"Corpus refresh failed: {e}")
+        if remote_due:
+            last_remote = time.monotonic()
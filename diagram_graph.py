@@ -0,0 +1,281 @@
+import logging
+import re
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Set
+
+from command_parser import COLORS
+from tools import normalize_color
+
+logging.basicConfig(level=logging.INFO)
+
+# Connectivity of a session's diagram: shapes are nodes keyed by name and every connect_shapes
+# connector is a directed edge from shape1 to shape2. Adjacency is kept in both directions as sets,
+# so neighbour lookups are O(1) and traversals are O(V + E), and structural questions ("what is
+# connected to the pump?", "delete everything downstream of valve 3") are answered from the graph
+# instead of going through the model.
+
+_ARTICLES = {"the", "a", "an", "all", "every"}
+
+class DiagramGraph:
+    def __init__(self, shapes: Optional[List[Dict]] = None, connections: Optional[List[Dict]] = None):
+        self.shapes: Dict[str, Dict] = {}
+        self.outgoing: Dict[str, Set[str]] = {}
+        self.incoming: Dict[str, Set[str]] = {}
+        for shape in shapes or []:
+            self.add_shape(shape)
+        for connection in connections or []:
+            self.connect(connection["from"], connection["to"])
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.shapes
+
+    def add_shape(self, shape: Dict):
+        name = shape.get("name")
+        if not name or shape.get("shape") == "line":
+            # Unnamed shapes can't be referred to, and connectors are edges rather than nodes
+            return
+        self.shapes[name] = shape
+        self.outgoing.setdefault(name, set())
+        self.incoming.setdefault(name, set())
+
+    def remove_shape(self, name: str):
+        if name not in self.shapes:
+            return
+        del self.shapes[name]
+        for target in self.outgoing.pop(name):
+            self.incoming[target].discard(name)
+        for source in self.incoming.pop(name):
+            self.outgoing[source].discard(name)
+
+    def connect(self, source: str, target: str):
+        for name in (source, target):
+            if name not in self.shapes:
+                self.add_shape({"name": name})
+        if source != target:
+            self.outgoing[source].add(target)
+            self.incoming[target].add(source)
+
+    def disconnect(self, source: str, target: str):
+        self.outgoing.get(source, set()).discard(target)
+        self.incoming.get(target, set()).discard(source)
+
+    def edges(self) -> List[Dict]:
+        return [{"from": source, "to": target} for source, targets in self.outgoing.items() for target in sorted(targets)]
+
+    def neighbours(self, name: str, direction: str = "both") -> Set[str]:
+        if direction == "out":
+            return set(self.outgoing.get(name, ()))
+        if direction == "in":
+            return set(self.incoming.get(name, ()))
+        return self.outgoing.get(name, set()) | self.incoming.get(name, set())
+
+    def _adjacent(self, name: str, direction: str) -> Iterator[str]:
+        if direction in ("out", "both"):
+            yield from sorted(self.outgoing.get(name, ()))
+        if direction in ("in", "both"):
+            yield from sorted(self.incoming.get(name, ()))
+
+    def bfs(self, start: str, direction: str = "out", max_depth: Optional[int] = None) -> Dict[str, int]:
+        """
+        Shapes reachable from start, with their distance in connectors (start itself at 0).
+        """
+        if start not in self.shapes:
+            return {}
+        depth = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if max_depth is not None and depth[node] >= max_depth:
+                continue
+            for neighbour in self._adjacent(node, direction):
+                if neighbour not in depth:
+                    depth[neighbour] = depth[node] + 1
+                    queue.append(neighbour)
+        return depth
+
+    def dfs(self, start: str, direction: str = "out") -> List[str]:
+        """
+        Shapes reachable from start in depth-first preorder.
+        """
+        if start not in self.shapes:
+            return []
+        order, seen, stack = [], {start}, [start]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for neighbour in reversed(list(self._adjacent(node, direction))):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    stack.append(neighbour)
+        return order
+
+    def downstream(self, name: str) -> List[str]:
+        return [node for node in self.bfs(name, "out") if node != name]
+
+    def upstream(self, name: str) -> List[str]:
+        return [node for node in self.bfs(name, "in") if node != name]
+
+    def component(self, name: str) -> List[str]:
+        return list(self.bfs(name, "both"))
+
+    def components(self) -> List[List[str]]:
+        """
+        Connected components (ignoring direction), largest first.
+        """
+        seen, components = set(), []
+        for name in self.shapes:
+            if name not in seen:
+                component = self.component(name)
+                seen.update(component)
+                components.append(component)
+        return sorted(components, key=len, reverse=True)
+
+    def path(self, source: str, target: str, direction: str = "both") -> Optional[List[str]]:
+        """
+        Shortest chain of shapes from source to target, or None when they aren't connected.
+        """
+        if source not in self.shapes or target not in self.shapes:
+            return None
+        parent = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parent[node]
+                return path[::-1]
+            for neighbour in self._adjacent(node, direction):
+                if neighbour not in parent:
+                    parent[neighbour] = node
+                    queue.append(neighbour)
+        return None
+
+    def resolve(self, reference: str) -> List[str]:
+        """
+        Shapes a reference names: an exact name, a color/shape description ("red circle"), or words
+        all found in the name ("pump" for "Pump P-101", "valve 3" for "Valve 3").
+        """
+        lowered = " ".join(reference.lower().split())
+        exact = [name for name in self.shapes if name.lower() == lowered]
+        if exact:
+            return exact
+        # "the pump" -> "pump"; only a leading article is dropped, so a shape named "A" still matches
+        first, _, rest = lowered.partition(" ")
+        if first in _ARTICLES and rest:
+            lowered = rest
+            exact = [name for name in self.shapes if name.lower() == lowered]
+            if exact:
+                return exact
+        words = set(_words(lowered))
+        if not words:
+            return []
+        colors = {normalize_color(word) for word in words}
+        described = [name for name, shape in self.shapes.items()
+                     if colors <= {normalize_color(shape.get("color", "")), str(shape.get("shape", "")).lower()}]
+        if described:
+            return described
+        return [name for name in self.shapes if words <= set(_words(name.lower()))]
+
+def _words(text: str) -> List[str]:
+    # "P-101" is kept as one word, and also split so "P 101" and "101" match it
+    words = re.findall(r"[a-z0-9]+(?:-[a-z0-9]+)*", text)
+    return words + [part for word in words if "-" in word for part in word.split("-")]
+
+# Structural questions and commands answered from the graph. Each pattern names the query kind;
+# the shape references are resolved with DiagramGraph.resolve.
+_QUERY_PATTERNS = [
+    ("path", r"(?:is|are)\s+(?P<a>.+?)\s+(?:connected|linked|joined)\s+(?:to|with)\s+(?P<b>.+?)"),
+    ("neighbours", r"(?:what|which\s+shapes?)(?:\s+is|\s+are|'s)?\s+(?:connected|linked|attached)\s+(?:to|with)\s+(?P<a>.+?)"),
+    ("neighbours", r"(?:show|list|find)\s+(?:the\s+)?(?:neighbou?rs|connections)\s+of\s+(?P<a>.+?)"),
+    ("downstream", r"(?:what|which\s+shapes?)(?:\s+is|\s+are|'s)?\s+(?:downstream|after)\s+(?:of|from)\s+(?P<a>.+?)"),
+    ("upstream", r"(?:what|which\s+shapes?)(?:\s+is|\s+are|'s)?\s+(?:upstream|before)\s+(?:of|from)\s+(?P<a>.+?)"),
+    ("components", r"how\s+many\s+(?:separate\s+|disconnected\s+)?(?:groups|components|networks|diagrams)(?:\s+are\s+there)?"),
+]
+_SELECTIONS = {
+    "downstream": r"(?:everything|all(?:\s+shapes)?)\s+(?:downstream\s+of|after)",
+    "upstream": r"(?:everything|all(?:\s+shapes)?)\s+(?:upstream\s+of|before)",
+    "component": r"(?:everything|all(?:\s+shapes)?)\s+(?:connected\s+to|attached\s+to|linked\s+to)",
+    "neighbours": r"(?:the\s+)?(?:neighbou?rs|shapes\s+(?:directly\s+)?connected\s+to)\s*(?:of)?",
+}
+# Recolors only take a known color name or hex code; anything else ("make ... bigger") goes to the model
+_COMMAND_PATTERNS = [
+    ("delete", r"(?:delete|remove|erase)\s+(?P<selection>{selection})\s+(?P<a>.+?)(?P<inclusive>\s+(?:and|including)\s+(?:itself|it))?"),
+    ("modify", r"(?:colou?r|paint|make|turn)\s+(?P<selection>{selection})\s+(?P<a>.+?)\s+(?P<color>#[0-9a-f]{{6}}|#[0-9a-f]{{3}}|" + "|".join(COLORS) + ")"),
+]
+
+def _select(graph: DiagramGraph, selection: str, name: str) -> List[str]:
+    if selection == "downstream":
+        return graph.downstream(name)
+    if selection == "upstream":
+        return graph.upstream(name)
+    if selection == "component":
+        return [node for node in graph.component(name) if node != name]
+    return sorted(graph.neighbours(name))
+
+def _selection_kind(text: str) -> str:
+    for kind, pattern in _SELECTIONS.items():
+        if re.fullmatch(pattern, text, re.I):
+            return kind
+    return "neighbours"
+
+def _one(graph: DiagramGraph, reference: str) -> Optional[str]:
+    matches = graph.resolve(reference)
+    return matches[0] if len(matches) == 1 else None
+
+def answer_structural_query(message: str, graph: DiagramGraph) -> Optional[Dict]:
+    """
+    Answers a structural question or runs a structural command from the graph. Returns None when
+    the message isn't one, or names a shape that isn't unique on the canvas, so the caller falls back
+    to the model. Commands come back as an action batch for the resolved shapes.
+    """
+    text = re.sub(r"^(please|can you|could you)\s+", "", message.strip().rstrip("?.!"), flags=re.I).strip()
+    selection = "|".join(_SELECTIONS.values())
+    for kind, pattern in _COMMAND_PATTERNS:
+        match = re.fullmatch(pattern.format(selection=selection), text, re.I)
+        if not match:
+            continue
+        name = _one(graph, match.group("a"))
+        if name is None:
+            return None
+        selected = _select(graph, _selection_kind(match.group("selection")), name)
+        if kind == "delete" and match.group("inclusive"):
+            selected = [name] + selected
+        shapes = [graph.shapes[node] for node in selected]
+        if kind == "delete":
+            actions = [{"action": "delete_shape", "shape": shape.get("shape", "rectangle"), "name": shape["name"]}
+                       for shape in shapes]
+        else:
+            actions = [{"action": "modify_shape", "shape": shape.get("shape", "rectangle"), "name": shape["name"],
+                        "color": match.group("color").lower()} for shape in shapes]
+        verb = "Deleting" if kind == "delete" else "Recoloring"
+        return {"query": kind, "shape": name, "shapes": selected, "actions": actions,
+                "answer": f"{verb} {len(actions)} shape(s)." if actions else f"No shapes matched around {name}."}
+    for kind, pattern in _QUERY_PATTERNS:
+        match = re.fullmatch(pattern, text, re.I)
+        if not match:
+            continue
+        if kind == "components":
+            components = graph.components()
+            return {"query": kind, "components": components,
+                    "answer": f"The diagram has {len(components)} separate group(s)."}
+        name = _one(graph, match.group("a"))
+        if name is None:
+            return None
+        if kind == "path":
+            other = _one(graph, match.group("b"))
+            if other is None:
+                return None
+            path = graph.path(name, other)
+            answer = f"Yes: {' - '.join(path)}." if path else f"No, {name} and {other} are not connected."
+            return {"query": kind, "shape": name, "shapes": path or [], "answer": answer}
+        selected = _select(graph, kind, name)
+        phrase = {"neighbours": "connected to", "downstream": "downstream of", "upstream": "upstream of"}[kind]
+        answer = f"{', '.join(selected)} {'is' if len(selected) == 1 else 'are'} {phrase} {name}." if selected \
+            else f"Nothing is {phrase} {name}."
+        return {"query": kind, "shape": name, "shapes": selected, "answer": answer}
+    return None
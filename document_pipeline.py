@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from agent_prompts import document_extraction_instructions
+from tools import clamp_to_canvas, validate_actions
+
+logging.basicConfig(level=logging.INFO)
+
+# Bulk document-to-diagram conversion. A long document is split into chunks, entities and
+# relationships are extracted from the chunks concurrently (at most DOCUMENT_CONCURRENCY requests
+# to Ollama at a time), merged into one deduplicated graph, laid out left to right by flow, and
+# returned as a single action batch. Progress is reported per chunk as it completes:
+#
+#   {"type": "progress", "done": 3, "chunks": 12, "entities": 17, "chunks_per_sec": 1.4}
+#   {"type": "result", "actions": [...], "graph": {...}, "stats": {...}}
+DOCUMENT_CONCURRENCY = int(os.environ.get("DOCUMENT_CONCURRENCY", "4"))
+DOCUMENT_CHUNK_CHARS = int(os.environ.get("DOCUMENT_CHUNK_CHARS", "3000"))
+
+# complete(system_prompt, text) -> model reply; the service passes a JSON-mode Ollama call
+Completion = Callable[[str, str], Awaitable[str]]
+
+# Shape and color per entity type
+ENTITY_STYLES = {
+    "equipment": ("rectangle", "blue"),
+    "process": ("rectangle", "green"),
+    "decision": ("square", "orange"),
+    "instrument": ("circle", "purple"),
+    "actor": ("circle", "gray"),
+    "other": ("rectangle", "default"),
+}
+
+# Equipment tags such as P-101, V-3 or FIC 204 identify an entity however the text names it
+_TAG = re.compile(r"\b([A-Z]{1,4})[- ]?(\d{1,5}[A-Z]?)\b")
+_ARTICLES = re.compile(r"^(the|a|an)\s+", re.I)
+
+def _split_long(text: str, chunk_chars: int) -> List[str]:
+    """
+    Pieces of at most chunk_chars: lines, then sentences, then consecutive windows for whatever is
+    still too long (lists and tables often have no sentence punctuation at all).
+    """
+    pieces = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if len(line) <= chunk_chars:
+            pieces.append(line)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", line):
+            pieces.extend(sentence[start:start + chunk_chars] for start in range(0, len(sentence), chunk_chars))
+    return [piece for piece in pieces if piece]
+
+def split_document(text: str, chunk_chars: int = DOCUMENT_CHUNK_CHARS) -> List[str]:
+    """
+    Splits on paragraphs, packing them into chunks of at most chunk_chars. Each chunk repeats the
+    last paragraph of the previous one, so relationships across the boundary are seen whole.
+    Paragraphs longer than a chunk are split on lines and sentences; no text is dropped.
+    """
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        flat = " ".join(paragraph.split())
+        if len(flat) <= chunk_chars:
+            paragraphs.append(flat)
+            continue
+        group = ""
+        for piece in _split_long(paragraph, chunk_chars):
+            if group and len(group) + len(piece) + 1 > chunk_chars:
+                paragraphs.append(group)
+                group = ""
+            group = f"{group}\n{piece}" if group else piece
+        paragraphs.append(group)
+    chunks, current = [], []
+    for paragraph in filter(None, paragraphs):
+        if current and sum(len(p) + 2 for p in current) + len(paragraph) > chunk_chars:
+            chunks.append("\n\n".join(current))
+            current = [current[-1]] if len(current[-1]) + len(paragraph) + 2 <= chunk_chars else []
+        current.append(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def entity_key(name: str) -> str:
+    """
+    Key under which mentions of the same entity are merged: its tag when it has one, otherwise the
+    name without articles, case and punctuation.
+    """
+    tag = _TAG.search(name)
+    if tag:
+        return f"{tag.group(1)}{tag.group(2)}".lower()
+    return re.sub(r"[^a-z0-9]", "", _ARTICLES.sub("", name.strip()).lower())
+
+def parse_extraction(reply: str) -> Dict[str, List[Dict]]:
+    data = json.loads(reply)
+    if not isinstance(data, dict):
+        raise ValueError("Extraction must be a JSON object")
+    entities = [e for e in data.get("entities") or [] if isinstance(e, dict) and str(e.get("name", "")).strip()]
+    relationships = [r for r in data.get("relationships") or []
+                     if isinstance(r, dict) and str(r.get("from", "")).strip() and str(r.get("to", "")).strip()]
+    return {"entities": entities, "relationships": relationships}
+
+class DocumentGraph:
+    """
+    Entities and relationships merged across chunks. Mentions of one entity share its entity_key;
+    the longest mention becomes the display name and the most frequent type wins.
+    """
+    def __init__(self):
+        self.names: Dict[str, Counter] = defaultdict(Counter)
+        self.types: Dict[str, Counter] = defaultdict(Counter)
+        self.edges: Dict[tuple, Counter] = {}
+        self.raw_entities = 0
+        self.raw_relationships = 0
+
+    def _mention(self, name: str, entity_type: Optional[str] = None) -> str:
+        name = _ARTICLES.sub("", " ".join(str(name).split()))
+        key = entity_key(name)
+        self.names[key][name] += 1
+        if entity_type:
+            self.types[key][str(entity_type).lower()] += 1
+        return key
+
+    def add(self, extraction: Dict[str, List[Dict]]):
+        for entity in extraction["entities"]:
+            self._mention(entity["name"], entity.get("type"))
+            self.raw_entities += 1
+        for relationship in extraction["relationships"]:
+            source, target = self._mention(relationship["from"]), self._mention(relationship["to"])
+            self.raw_relationships += 1
+            if source != target:
+                labels = self.edges.setdefault((source, target), Counter())
+                if relationship.get("label"):
+                    labels[str(relationship["label"])] += 1
+
+    def name(self, key: str) -> str:
+        return max(self.names[key].items(), key=lambda item: (len(item[0]), item[1]))[0]
+
+    def entity_type(self, key: str) -> str:
+        entity_type = self.types[key].most_common(1)[0][0] if self.types[key] else "other"
+        return entity_type if entity_type in ENTITY_STYLES else "other"
+
+    def to_dict(self) -> Dict:
+        return {
+            "entities": [{"name": self.name(key), "type": self.entity_type(key), "mentions": sum(self.names[key].values())}
+                         for key in self.names],
+            "relationships": [{"from": self.name(source), "to": self.name(target),
+                               "label": labels.most_common(1)[0][0] if labels else ""}
+                              for (source, target), labels in self.edges.items()],
+        }
+
+def layer_graph(nodes: List[str], edges: List[tuple]) -> Dict[str, int]:
+    """
+    Column of each node for a left-to-right layout: the length of the longest path reaching it.
+    Edges closing a cycle are ignored.
+    """
+    outgoing = defaultdict(list)
+    for source, target in edges:
+        outgoing[source].append(target)
+    # Drop back edges found by depth-first search so the rest is acyclic
+    state, forward = {}, defaultdict(list)
+    for root in nodes:
+        if root in state:
+            continue
+        state[root] = "open"
+        stack = [(root, iter(outgoing[root]))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node] = "done"
+                stack.pop()
+            elif state.get(child) != "open":
+                forward[node].append(child)
+                if child not in state:
+                    state[child] = "open"
+                    stack.append((child, iter(outgoing[child])))
+    incoming = Counter(target for targets in forward.values() for target in targets)
+    layer = {node: 0 for node in nodes}
+    ready = [node for node in nodes if incoming[node] == 0]
+    while ready:
+        node = ready.pop()
+        for child in forward[node]:
+            layer[child] = max(layer[child], layer[node] + 1)
+            incoming[child] -= 1
+            if incoming[child] == 0:
+                ready.append(child)
+    return layer
+
+def graph_actions(graph: DocumentGraph, margin: float = 6) -> List[Dict]:
+    """
+    Lays the graph out in columns by flow and returns the create_shape and connect_shapes actions.
+    """
+    keys = list(graph.names)
+    if not keys:
+        return []
+    layers = layer_graph(keys, list(graph.edges))
+    columns = defaultdict(list)
+    for key in keys:
+        columns[layers[key]].append(key)
+    # Tall columns wrap into several, so no column holds more than about twice the column count
+    max_rows = max(4, int(2 * len(columns) ** 0.5 * len(keys) ** 0.25) + 1)
+    placed = []
+    for layer in sorted(columns):
+        for start in range(0, len(columns[layer]), max_rows):
+            placed.append(columns[layer][start:start + max_rows])
+    column_width = (100 - 2 * margin) / len(placed)
+    row_height = (100 - 2 * margin) / max(len(column) for column in placed)
+    width, height = max(1.0, min(12.0, column_width * 0.6)), max(1.0, min(8.0, row_height * 0.6))
+
+    actions = []
+    for c, column in enumerate(placed):
+        # Centre shorter columns vertically
+        offset = margin + (100 - 2 * margin - row_height * len(column)) / 2
+        for r, key in enumerate(column):
+            shape, color = ENTITY_STYLES[graph.entity_type(key)]
+            x, y = clamp_to_canvas(margin + column_width * (c + 0.5), offset + row_height * (r + 0.5), width, height)
+            actions.append({"action": "create_shape", "shape": shape, "name": graph.name(key), "color": color,
+                            "x": round(x, 2), "y": round(y, 2), "width": round(width, 2), "height": round(height, 2)})
+    for source, target in graph.edges:
+        actions.append({"action": "connect_shapes", "shape": "line",
+                        "shape1": graph.name(source), "shape2": graph.name(target)})
+    return actions
+
+async def extract_chunk(complete: Completion, chunk: str, retries: int = 1) -> Dict[str, List[Dict]]:
+    for attempt in range(retries + 1):
+        try:
+            return parse_extraction(await complete(document_extraction_instructions, chunk))
+        except (json.JSONDecodeError, ValueError) as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Retrying chunk extraction after invalid reply: {e}")
+
+async def document_to_diagram(text: str, complete: Completion, concurrency: int = DOCUMENT_CONCURRENCY,
+                              chunk_chars: int = DOCUMENT_CHUNK_CHARS) -> AsyncIterator[Dict]:
+    """
+    Yields a progress event per finished chunk, then the result with the action batch.
+    """
+    started = time.perf_counter()
+    chunks = split_document(text, chunk_chars)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    graph = DocumentGraph()
+    failures = []
+
+    async def run(index: int):
+        async with semaphore:
+            try:
+                return index, await extract_chunk(complete, chunks[index]), None
+            except Exception as e:
+                logging.error(f"Extraction of chunk {index} failed: {e}")
+                return index, None, str(e)
+
+    yield {"type": "started", "chunks": len(chunks), "concurrency": concurrency}
+    tasks = [asyncio.create_task(run(index)) for index in range(len(chunks))]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            index, extraction, error = await task
+            if extraction is not None:
+                graph.add(extraction)
+            else:
+                failures.append({"chunk": index, "error": error})
+            elapsed = time.perf_counter() - started
+            yield {"type": "progress", "done": done, "chunks": len(chunks), "chunk": index, "failed": error is not None,
+                   "entities": len(graph.names), "relationships": len(graph.edges),
+                   "chunks_per_sec": round(done / elapsed, 3) if elapsed else None}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    layout_started = time.perf_counter()
+    actions = graph_actions(graph)
+    problems = validate_actions(actions) if actions else []
+    elapsed = time.perf_counter() - started
+    yield {
+        "type": "result",
+        "actions": actions,
+        "graph": graph.to_dict(),
+        "problems": problems,
+        "failures": failures,
+        "stats": {
+            "chunks": len(chunks),
+            "characters": len(text),
+            "entities_extracted": graph.raw_entities,
+            "entities": len(graph.names),
+            "relationships_extracted": graph.raw_relationships,
+            "relationships": len(graph.edges),
+            "layout_ms": round((time.perf_counter() - layout_started) * 1000, 3),
+            "elapsed_s": round(elapsed, 3),
+            "chunks_per_sec": round(len(chunks) / elapsed, 3) if elapsed else None,
+        },
+    }
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from shared_state import FileLock
+
+logging.basicConfig(level=logging.INFO)
+
+# Normalize text before hashing so whitespace-only differences share a cache entry
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+# Append-only float32 store for one model, read through a memory map. Several worker processes
+# may share the same files: writes take a file lock and each process picks up the index lines
+# appended by the others.
+class _DiskStore:
+    def __init__(self, directory: str, model: str):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.vectors_path = os.path.join(directory, f"{safe_name}.f32")
+        self.index_path = os.path.join(directory, f"{safe_name}.idx.jsonl")
+        self.lock = FileLock(os.path.join(directory, f"{safe_name}.lock"))
+        self.index = OrderedDict()  # key -> (offset, dim), oldest first
+        self.live = 0  # float32 slots referenced by the index
+        self.dead = 0  # float32 slots no longer referenced by the index
+        self._map = None
+        self._index_position = 0
+        self._index_inode = None
+        self.refresh()
+        # Drop entries whose vectors never made it to disk (e.g. after a crash mid-write)
+        size = self._slots()
+        for key in [k for k, (offset, dim) in self.index.items() if offset + dim > size]:
+            offset, dim = self.index.pop(key)
+            self.live -= dim
+
+    def refresh(self):
+        """
+        Applies index lines written since the last refresh, reloading from scratch after a compaction.
+        """
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._index_inode or stat.st_size < self._index_position:
+            self.index.clear()
+            self.live = self.dead = 0
+            self._index_position = 0
+            self._index_inode = stat.st_ino
+            self._map = None
+        if stat.st_size == self._index_position:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_position)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1  # a concurrent writer may have left a partial last line
+        for line in data[:complete].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("deleted"):
+                offset, dim = self.index.pop(entry["k"], (0, 0))
+                self.live -= dim
+                self.dead += dim
+            elif entry["k"] not in self.index:
+                self.index[entry["k"]] = (entry["o"], entry["d"])
+                self.live += entry["d"]
+        self._index_position += complete
+
+    def _slots(self) -> int:
+        return os.path.getsize(self.vectors_path) // 4 if os.path.exists(self.vectors_path) else 0
+
+    def read(self, key: str) -> Optional[List[float]]:
+        self.refresh()
+        location = self.index.get(key)
+        if location is None:
+            return None
+        offset, dim = location
+        if self._map is None or offset + dim > len(self._map):
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r")
+        self.index.move_to_end(key)
+        return self._map[offset:offset + dim].tolist()
+
+    def append(self, key: str, vector: List[float]) -> bool:
+        data = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            self.refresh()
+            if key in self.index:
+                return False
+            offset = self._slots()
+            with open(self.vectors_path, "ab") as f:
+                f.write(data.tobytes())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"k": key, "o": offset, "d": int(data.shape[0])}) + "\n")
+            self.refresh()
+        return True
+
+    def evict_oldest(self) -> str:
+        with self.lock:
+            self.refresh()
+            key = next(iter(self.index))
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"k": key, "deleted": True}) + "\n")
+            self.refresh()
+        return key
+
+    def compact(self):
+        """
+        Rewrites the vector file and index with only the live entries.
+        """
+        with self.lock:
+            self.refresh()
+            vectors_tmp = self.vectors_path + ".tmp"
+            index_tmp = self.index_path + ".tmp"
+            source = np.memmap(self.vectors_path, dtype=np.float32, mode="r") if self._slots() else None
+            offset = 0
+            with open(vectors_tmp, "wb") as vf, open(index_tmp, "w", encoding="utf-8") as idx:
+                for key, (old_offset, dim) in self.index.items():
+                    vf.write(np.asarray(source[old_offset:old_offset + dim], dtype=np.float32).tobytes())
+                    idx.write(json.dumps({"k": key, "o": offset, "d": dim}) + "\n")
+                    offset += dim
+            self._map = None
+            del source
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(index_tmp, self.index_path)
+            self.refresh()
+
+# Shared embedding cache: in-memory LRU in front of per-model append-only disk stores
+class EmbeddingCache:
+    def __init__(self, directory: str = "embedding_cache", max_memory_entries: int = 10000,
+                 max_disk_entries: int = 200000, compact_ratio: float = 0.5):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.compact_ratio = compact_ratio
+        self._memory = OrderedDict()
+        self._stores: Dict[str, _DiskStore] = {}
+        self._lock = threading.RLock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _store(self, model: str) -> _DiskStore:
+        store = self._stores.get(model)
+        if store is None:
+            store = self._stores[model] = _DiskStore(self.directory, model)
+        return store
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            vector = self._store(model).read(key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector: List[float]):
+        if not len(vector):
+            raise ValueError("Empty vectors are not cached")
+        key = cache_key(model, text)
+        vector = [float(v) for v in vector]
+        with self._lock:
+            self._remember(key, vector)
+            store = self._store(model)
+            if not store.append(key, vector):
+                return
+            while len(store.index) > self.max_disk_entries:
+                evicted = store.evict_oldest()
+                self._memory.pop(evicted, None)
+                self.evictions += 1
+            if store.dead and store.dead > self.compact_ratio * (store.live + store.dead):
+                store.compact()
+
+    def get_or_compute(self, model: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Returns embeddings for texts, calling compute once with only the distinct texts that missed the cache.
+        """
+        results = [self.get(model, text) for text in texts]
+        missing = OrderedDict()
+        for index, (text, vector) in enumerate(zip(texts, results)):
+            if vector is None:
+                missing.setdefault(normalize_text(text), []).append(index)
+        if missing:
+            pending = [texts[indexes[0]] for indexes in missing.values()]
+            computed = compute(pending)
+            if any(not len(vector) for vector in computed):
+                # An empty vector means the embedding request failed; caching it would keep the failure
+                raise ValueError(f"Embedding model '{model}' returned an empty vector")
+            for text, vector, indexes in zip(pending, computed, missing.values()):
+                self.put(model, text, vector)
+                for index in indexes:
+                    results[index] = [float(v) for v in vector]
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": {model: len(store.index) for model, store in self._stores.items()},
+                "evictions": self.evictions,
+            }
+
+# Process-wide cache shared by the RAG retriever, ollama_embedding and qdrant_db
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                directory=os.environ.get("EMBEDDING_CACHE_DIR", "embedding_cache"),
+                max_memory_entries=int(os.environ.get("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000")),
+                max_disk_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+            )
+        return _embedding_cache
+
+# LangChain embeddings wrapper that consults the shared cache before the wrapped model
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: Optional[EmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or get_embedding_cache()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(self.model_name, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries and documents can be embedded differently (e.g. Nomic task prefixes), so keep them apart
+        return self.cache.get_or_compute(f"{self.model_name}:query", [text],
+                                         lambda texts: [self.embeddings.embed_query(texts[0])])[0]
@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from agent_prompts import manager_agent_instructions, action_agent_instructions
+from stats_utils import percentile
+from tools import validate_actions
+
+logging.basicConfig(level=logging.INFO)
+
+VALID_ROUTES = ["manager", "action_agent"]
+
+# Load evaluation cases from a JSONL file (one case per line)
+def load_cases(path: str) -> List[Dict]:
+    """
+    Each case has a "message" and optionally "id", "expected_route" and "expected_actions".
+    Expected actions are matched partially: only the keys given in the case are compared.
+    """
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            case = json.loads(line)
+            if "message" not in case:
+                raise ValueError(f"Case on line {line_number} of {path} has no 'message'.")
+            case.setdefault("id", f"case-{line_number}")
+            cases.append(case)
+    return cases
+
+# Backend that calls a live Ollama model through LangChain
+class OllamaBackend:
+    def __init__(self, model: str, base_url: Optional[str] = None):
+        self.model = model
+        self.base_url = base_url
+        self._llm = None
+        self._lock = threading.Lock()
+
+    def _get_llm(self):
+        with self._lock:
+            if self._llm is None:
+                from langchain_ollama import ChatOllama
+                from ollama_cassette import cassette_client_kwargs
+                kwargs = {"model": self.model, "temperature": 0, "format": "json",
+                          "client_kwargs": cassette_client_kwargs()}
+                if self.base_url:
+                    kwargs["base_url"] = self.base_url
+                self._llm = ChatOllama(**kwargs)
+            return self._llm
+
+    def complete(self, system_prompt: str, user_message: str) -> Dict:
+        response = self._get_llm().invoke([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ])
+        usage = getattr(response, "usage_metadata", None) or {}
+        metadata = getattr(response, "response_metadata", None) or {}
+        return {
+            "content": response.content,
+            "prompt_tokens": usage.get("input_tokens", metadata.get("prompt_eval_count", 0)),
+            "completion_tokens": usage.get("output_tokens", metadata.get("eval_count", 0)),
+        }
+
+# Backend that replays recorded completions, optionally recording misses from another backend
+class ReplayBackend:
+    def __init__(self, recordings_path: str, model: str, fallback=None):
+        self.recordings_path = recordings_path
+        self.model = model
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._recordings = {}
+        if os.path.exists(recordings_path):
+            with open(recordings_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._recordings[record["key"]] = record["completion"]
+
+    def _key(self, system_prompt: str, user_message: str) -> str:
+        payload = json.dumps([self.model, system_prompt, user_message])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def complete(self, system_prompt: str, user_message: str) -> Dict:
+        key = self._key(system_prompt, user_message)
+        with self._lock:
+            completion = self._recordings.get(key)
+        if completion is not None:
+            return completion
+        if self.fallback is None:
+            raise KeyError(f"No recording for message {user_message!r} with model '{self.model}'.")
+
+        completion = self.fallback.complete(system_prompt, user_message)
+        with self._lock:
+            self._recordings[key] = completion
+            with open(self.recordings_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "completion": completion}) + "\n")
+        return completion
+
+# Backend with the service's tail-latency controls: completions go through resilience's
+# ResilientOllama, so the deadline, circuit breakers and hedging behave exactly as in the service,
+# with each backend's blocking complete() run on a thread pool. close() shuts the pool down.
+class ResilientBackend:
+    def __init__(self, primary, hedge=None, hedge_after: float = 2.0, deadline: Optional[float] = None):
+        from resilience import REQUEST_DEADLINE_SECONDS, ResilientOllama
+        # Calls can't be interrupted; ones that lose the race or miss the deadline finish in the background
+        self._executor = ThreadPoolExecutor(max_workers=32)
+        self.ollama = ResilientOllama(_ThreadedChat(primary, self._executor),
+                                      _ThreadedChat(hedge, self._executor) if hedge is not None else None,
+                                      hedge_after)
+        self.deadline = deadline or REQUEST_DEADLINE_SECONDS
+
+    def complete(self, system_prompt: str, user_message: str) -> Dict:
+        from resilience import deadline_scope
+
+        async def call():
+            with deadline_scope(self.deadline):
+                return await self.ollama.ainvoke([{"role": "system", "content": system_prompt},
+                                                  {"role": "user", "content": user_message}])
+        return asyncio.run(call())
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Presents a backend as the chat client ResilientOllama expects
+class _ThreadedChat:
+    def __init__(self, backend, executor: ThreadPoolExecutor):
+        self.backend = backend
+        self.executor = executor
+
+    def __call__(self, model: Optional[str] = None, **options):
+        return self
+
+    async def ainvoke(self, messages: List[Dict]) -> Dict:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.backend.complete, messages[0]["content"], messages[1]["content"])
+
+# A prompt/model combination to evaluate
+class EvalConfig:
+    def __init__(self, name: str, backend, manager_prompt: str = manager_agent_instructions,
+                 action_prompt: str = action_agent_instructions):
+        self.name = name
+        self.backend = backend
+        self.manager_prompt = manager_prompt
+        self.action_prompt = action_prompt
+
+def _actions_match(expected: List[Dict], actual) -> bool:
+    if isinstance(actual, dict):
+        actual = [actual]
+    if not isinstance(actual, list) or len(actual) != len(expected):
+        return False
+    return all(
+        isinstance(got, dict) and all(got.get(key) == value for key, value in want.items())
+        for want, got in zip(expected, actual)
+    )
+
+def _run_stage(backend, system_prompt: str, message: str, result: Dict, stage: str):
+    start = time.perf_counter()
+    try:
+        completion = backend.complete(system_prompt, message)
+    except Exception as e:
+        result[f"{stage}_latency"] = time.perf_counter() - start
+        result["errors"].append(f"{stage}: {e}")
+        return None
+    result[f"{stage}_latency"] = time.perf_counter() - start
+    result["prompt_tokens"] += completion.get("prompt_tokens") or 0
+    result["completion_tokens"] += completion.get("completion_tokens") or 0
+    try:
+        return json.loads(completion["content"])
+    except (json.JSONDecodeError, TypeError):
+        result["errors"].append(f"{stage}: response is not valid JSON")
+        return None
+
+# Evaluate a single case: route with the manager prompt, then extract actions when expected
+def evaluate_case(config: EvalConfig, case: Dict) -> Dict:
+    result = {
+        "id": case["id"],
+        "message": case["message"],
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "errors": [],
+    }
+
+    if "expected_route" in case:
+        routing = _run_stage(config.backend, config.manager_prompt, case["message"], result, "route")
+        route = routing.get("route") if isinstance(routing, dict) else None
+        result["route"] = route
+        result["route_correct"] = route == case["expected_route"]
+        result["route_valid"] = route in VALID_ROUTES
+
+    if "expected_actions" in case or case.get("expected_route") == "action_agent":
+        actions = _run_stage(config.backend, config.action_prompt, case["message"], result, "action")
+        result["actions"] = actions
+        result["schema_valid"] = actions is not None and not validate_actions(actions)
+        if "expected_actions" in case:
+            result["actions_correct"] = _actions_match(case["expected_actions"], actions)
+
+    result["latency"] = result.get("route_latency", 0.0) + result.get("action_latency", 0.0)
+    return result
+
+def _rate(results: List[Dict], key: str) -> Optional[float]:
+    scored = [r[key] for r in results if key in r]
+    return sum(scored) / len(scored) if scored else None
+
+def summarize(results: List[Dict], wall_time: float) -> Dict:
+    latencies = [r["latency"] for r in results]
+    return {
+        "cases": len(results),
+        "route_accuracy": _rate(results, "route_correct"),
+        "schema_validity": _rate(results, "schema_valid"),
+        "action_accuracy": _rate(results, "actions_correct"),
+        "errors": sum(1 for r in results if r["errors"]),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "prompt_tokens": sum(r["prompt_tokens"] for r in results),
+        "completion_tokens": sum(r["completion_tokens"] for r in results),
+        "wall_time": wall_time,
+        "throughput": len(results) / wall_time if wall_time > 0 else 0.0,
+    }
+
+# Run all cases for one config concurrently
+def run_evaluation(config: EvalConfig, cases: List[Dict], concurrency: int = 4) -> Dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(lambda case: evaluate_case(config, case), cases))
+    wall_time = time.perf_counter() - start
+    return {"config": config.name, "summary": summarize(results, wall_time), "results": results}
+
+def _format_metric(value, percent=False) -> str:
+    if value is None:
+        return "-"
+    if percent:
+        return f"{value * 100:.1f}%"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+# Run two configs over the same cases and print their summaries side by side
+def compare_configs(config_a: EvalConfig, config_b: EvalConfig, cases: List[Dict], concurrency: int = 4) -> Dict:
+    report_a = run_evaluation(config_a, cases, concurrency)
+    report_b = run_evaluation(config_b, cases, concurrency)
+
+    rows = [
+        ("route_accuracy", True), ("schema_validity", True), ("action_accuracy", True),
+        ("errors", False), ("latency_p50", False), ("latency_p95", False), ("latency_p99", False),
+        ("latency_mean", False),
+        ("prompt_tokens", False), ("completion_tokens", False), ("wall_time", False), ("throughput", False),
+    ]
+    print(f"{'metric':<20}{config_a.name:>20}{config_b.name:>20}")
+    for metric, percent in rows:
+        print(f"{metric:<20}"
+              f"{_format_metric(report_a['summary'][metric], percent):>20}"
+              f"{_format_metric(report_b['summary'][metric], percent):>20}")
+
+    disagreements = [
+        (a["id"], a.get("route"), b.get("route"))
+        for a, b in zip(report_a["results"], report_b["results"])
+        if a.get("route_correct") != b.get("route_correct") or a.get("actions_correct") != b.get("actions_correct")
+    ]
+    for case_id, route_a, route_b in disagreements:
+        print(f"Differs on {case_id}: {config_a.name} route={route_a}, {config_b.name} route={route_b}")
+
+    return {"a": report_a, "b": report_b}
+
+def _load_prompts(path: Optional[str]) -> Dict:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        prompts = json.load(f)
+    return {
+        "manager_prompt": prompts.get("manager", manager_agent_instructions),
+        "action_prompt": prompts.get("action", action_agent_instructions),
+    }
+
+def _build_config(name: str, model: str, prompts_path: Optional[str], replay_path: Optional[str], record: bool,
+                  resilience: Optional[Dict] = None):
+    backend = OllamaBackend(model)
+    if replay_path:
+        backend = ReplayBackend(replay_path, model, fallback=backend if record else None)
+    if resilience is not None:
+        hedge = OllamaBackend(model, base_url=resilience["hedge_url"]) if resilience.get("hedge_url") else None
+        backend = ResilientBackend(backend, hedge, resilience["hedge_after"], resilience.get("deadline"))
+    return EvalConfig(name, backend, **_load_prompts(prompts_path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate agent prompts against a dataset of cases.")
+    parser.add_argument("--cases", default="eval_cases.jsonl")
+    parser.add_argument("--model-a", default="llama3.2:3b-instruct-fp16")
+    parser.add_argument("--prompts-a", help="JSON file with 'manager' and/or 'action' prompts")
+    parser.add_argument("--model-b", help="Second model to compare against")
+    parser.add_argument("--prompts-b", help="JSON file with 'manager' and/or 'action' prompts for config B")
+    parser.add_argument("--replay", help="JSONL recordings file; replays instead of calling Ollama")
+    parser.add_argument("--record", action="store_true", help="Record replay misses from the live model")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--hedge-url", help="Second Ollama to hedge slow completions to; compares config A without "
+                                            "and with deadline, hedging and circuit breaking")
+    parser.add_argument("--hedge-after-ms", type=float, default=2000)
+    parser.add_argument("--deadline", type=float, help="Seconds per completion before it counts as an error; "
+                                                       "compares config A without and with the controls")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    config_a = _build_config("A:" + args.model_a, args.model_a, args.prompts_a, args.replay, args.record)
+    if args.hedge_url or args.deadline:
+        if args.model_b or args.prompts_b:
+            parser.error("--hedge-url and --deadline compare config A with itself; drop --model-b and --prompts-b")
+        resilience = {"hedge_url": args.hedge_url, "hedge_after": args.hedge_after_ms / 1000, "deadline": args.deadline}
+        config_b = _build_config("B:resilient", args.model_a, args.prompts_a, args.replay, args.record, resilience)
+        try:
+            report = compare_configs(config_a, config_b, cases, args.concurrency)
+        finally:
+            config_b.backend.close()
+    elif args.model_b or args.prompts_b:
+        model_b = args.model_b or args.model_a
+        config_b = _build_config("B:" + model_b, model_b, args.prompts_b, args.replay, args.record)
+        report = compare_configs(config_a, config_b, cases, args.concurrency)
+    else:
+        report = run_evaluation(config_a, cases, args.concurrency)
+        for metric, value in report["summary"].items():
+            print(f"{metric:<20}{_format_metric(value):>20}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
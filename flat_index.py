@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import uuid
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+logging.basicConfig(level=logging.INFO)
+
+# Read-only vector index stored as flat files and opened with memory maps, so every worker
+# process on a machine shares the same pages instead of holding its own copy.
+#
+#   vectors.npy   float32 (n, dim), L2-normalized
+#   texts.bin     UTF-8 chunk texts back to back
+#   offsets.npy   int64 (n + 1) byte offsets into texts.bin
+#   metadata.jsonl one JSON object per chunk
+#   version       id of this build, used to invalidate caches of search results
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class FlatIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.texts = np.memmap(os.path.join(directory, "texts.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(directory, "metadata.jsonl"), "r", encoding="utf-8") as f:
+            self.metadata = [json.loads(line) for line in f]
+        version_path = os.path.join(directory, "version")
+        if os.path.exists(version_path):
+            with open(version_path, "r", encoding="utf-8") as f:
+                self.version = f.read().strip()
+        else:
+            self.version = "0"
+
+    @staticmethod
+    def save(directory: str, vectors, texts: List[str], metadatas: List[Dict]):
+        """
+        Writes a new index; files are written under temporary names and renamed into place.
+        """
+        os.makedirs(directory, exist_ok=True)
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(chunk) for chunk in encoded])
+
+        outputs = {
+            "vectors.npy": lambda f: np.save(f, vectors),
+            "offsets.npy": lambda f: np.save(f, offsets),
+            "texts.bin": lambda f: f.write(b"".join(encoded)),
+            "metadata.jsonl": lambda f: f.write("".join(json.dumps(m) + "\n" for m in metadatas).encode("utf-8")),
+            "version": lambda f: f.write(uuid.uuid4().hex.encode("ascii")),
+        }
+        for name, write in outputs.items():
+            temp_path = os.path.join(directory, f"{name}.tmp")
+            with open(temp_path, "wb") as f:
+                write(f)
+            os.replace(temp_path, os.path.join(directory, name))
+        logging.info(f"Flat index with {len(texts)} chunks written to '{directory}'.")
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def text(self, index: int) -> str:
+        return bytes(self.texts[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+
+    def document(self, index: int) -> Document:
+        return Document(page_content=self.text(index), metadata=dict(self.metadata[index]))
+
+    def search(self, query_vector, k: int = 3) -> List[Tuple[int, float]]:
+        """
+        Exact cosine search; returns (chunk index, similarity) pairs, best first.
+        """
+        if len(self) == 0:
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+# Retriever over a FlatIndex with the same invoke() interface as the LangChain retrievers used here
+class FlatIndexRetriever:
+    def __init__(self, index: FlatIndex, embeddings, k: int = 3):
+        self.index = index
+        self.embeddings = embeddings
+        self.k = k
+
+    def similarity_search_with_score(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
+        hits = self.index.search(self.embeddings.embed_query(query), k or self.k)
+        return [(self.index.document(i), score) for i, score in hits]
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
+        # Cosine similarity already ranks higher-is-better
+        return self.similarity_search_with_score(query, k)
+
+    def invoke(self, query: str) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query)]
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from vector_store import NumpyVectorStore, SearchHit, _top_k
+
+logging.basicConfig(level=logging.INFO)
+
+# Inverted-file (IVF) approximate nearest-neighbour index. Vectors are clustered with spherical
+# k-means; a query is scored against the n_probe closest clusters only instead of the whole corpus.
+#
+# Tuning knobs:
+#   n_lists         clusters; more lists means fewer vectors scanned per probe (default ~4*sqrt(n))
+#   n_probe         clusters scanned per query; raise for recall, lower for latency
+#   min_train_size  below this many vectors searches stay exact and no clustering is done
+#   retrain_growth  re-cluster when the corpus has grown by this factor since the last training,
+#                   so incremental inserts don't leave a few lists oversized
+#
+# Persisted files (written by flush):
+#   vectors.npy, centroids.npy, assignments.npy, records.jsonl (id, text, metadata), params.json
+
+ASSIGN_CHUNK = 4096
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Nearest centroid (by cosine) for each vector, computed in chunks to bound memory.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        assignments[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return assignments
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Empty clusters are reseeded from random vectors rather than left dead
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class IVFVectorStore(NumpyVectorStore):
+    backend = "ivf"
+
+    def __init__(self, dimension: Optional[int] = None, directory: Optional[str] = None, n_lists: Optional[int] = None,
+                 n_probe: int = 8, min_train_size: int = 5000, retrain_growth: float = 4.0,
+                 kmeans_iterations: int = 10, max_train_sample: int = 100000):
+        super().__init__(dimension)
+        self.directory = directory
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.kmeans_iterations = kmeans_iterations
+        self.max_train_sample = max_train_sample
+        self.centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[np.ndarray] = []
+        self._trained_size = 0
+        if directory and os.path.exists(os.path.join(directory, "params.json")):
+            self._load()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self):
+        """
+        Clusters the current corpus and rebuilds every inverted list.
+        """
+        vectors = self._vectors[:self._size]
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(self._size)))
+        n_lists = min(n_lists, self._size)
+        rng = np.random.default_rng(0)
+        sample = vectors if self._size <= self.max_train_sample else \
+            vectors[rng.choice(self._size, size=self.max_train_sample, replace=False)]
+        self.centroids = spherical_kmeans(sample, n_lists, self.kmeans_iterations)
+        self._assignments = _assign(vectors, self.centroids)
+        self._rebuild_lists()
+        self._trained_size = self._size
+        logging.info(f"IVF index trained with {n_lists} lists over {self._size} vectors.")
+
+    def _rebuild_lists(self):
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def _add(self, vectors, texts, metadatas, ids):
+        start = self._size
+        super()._add(vectors, texts, metadatas, ids)
+        if not self.trained:
+            if self._size >= self.min_train_size:
+                self.train()
+            return
+        if self._size >= self._trained_size * self.retrain_growth:
+            self.train()
+            return
+        # Incremental insert: append each new vector to its nearest list
+        new_assignments = _assign(vectors, self.centroids)
+        self._assignments = np.concatenate([self._assignments, new_assignments])
+        positions = np.arange(start, self._size)
+        for list_id in np.unique(new_assignments):
+            self._lists[list_id] = np.concatenate([self._lists[list_id], positions[new_assignments == list_id]])
+
+    def _delete(self, ids):
+        # Deletes keep the clusters; the remaining vectors stay in their lists
+        before = self._size
+        if before:
+            keep = self._keep(ids)
+            if self.trained:
+                self._assignments = self._assignments[keep]
+                self._rebuild_lists()
+        return before - self._size
+
+    def _clear(self):
+        super()._clear()
+        self._assignments = np.zeros(0, dtype=np.int32)
+        if self.trained:
+            self._rebuild_lists()
+
+    def _search_batch(self, queries, k):
+        with self._lock:
+            if not self.trained:
+                return super()._search_batch(queries, k)
+            n_probe = min(self.n_probe, len(self.centroids))
+            probes = _top_k(queries @ self.centroids.T, n_probe)
+            results = []
+            for query, lists in zip(queries, probes):
+                candidates = np.concatenate([self._lists[i] for i in lists])
+                if len(candidates) == 0:
+                    results.append([])
+                    continue
+                scores = self._vectors[candidates] @ query
+                top = _top_k(scores[None, :], k)[0]
+                results.append([
+                    SearchHit(self.ids[c], float(scores[i]), self.texts[c], self.metadatas[c])
+                    for i, c in ((int(i), int(candidates[i])) for i in top)
+                ])
+            return results
+
+    def flush(self):
+        """
+        Writes the index to its directory (if any); files are replaced atomically.
+        """
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        params = {"dimension": self.dimension, "n_lists": self.n_lists, "n_probe": self.n_probe,
+                  "trained_size": self._trained_size}
+        outputs = {
+            "vectors.npy": lambda f: np.save(f, self._vectors[:self._size] if self._vectors is not None
+                                             else np.zeros((0, self.dimension or 0), dtype=np.float32)),
+            "assignments.npy": lambda f: np.save(f, self._assignments),
+            "centroids.npy": lambda f: np.save(f, self.centroids if self.trained else np.zeros((0, self.dimension or 0), dtype=np.float32)),
+            "records.jsonl": lambda f: f.write("".join(
+                json.dumps({"id": i, "text": t, "metadata": m}) + "\n"
+                for i, t, m in zip(self.ids, self.texts, self.metadatas)).encode("utf-8")),
+            "params.json": lambda f: f.write(json.dumps(params).encode("utf-8")),
+        }
+        for name, write in outputs.items():
+            temp_path = os.path.join(self.directory, f"{name}.tmp")
+            with open(temp_path, "wb") as f:
+                write(f)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        logging.info(f"IVF index with {self._size} vectors written to '{self.directory}'.")
+
+    def _load(self):
+        with open(os.path.join(self.directory, "params.json"), "r", encoding="utf-8") as f:
+            params = json.load(f)
+        if self.dimension is not None and params["dimension"] not in (None, self.dimension):
+            raise ValueError(f"IVF index in '{self.directory}' holds {params['dimension']}-dimensional vectors, "
+                             f"but the embedding model produces {self.dimension}")
+        self.dimension = params["dimension"]
+        self.n_lists = self.n_lists or params["n_lists"]
+        self._trained_size = params["trained_size"]
+        self._vectors = np.load(os.path.join(self.directory, "vectors.npy"))
+        self._size = len(self._vectors)
+        with open(os.path.join(self.directory, "records.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.texts.append(record["text"])
+                self.metadatas.append(record["metadata"])
+        centroids = np.load(os.path.join(self.directory, "centroids.npy"))
+        if len(centroids):
+            self.centroids = centroids
+            self._assignments = np.load(os.path.join(self.directory, "assignments.npy"))
+            self._rebuild_lists()
+
+    def stats(self) -> Dict:
+        sizes = [len(ids) for ids in self._lists]
+        return {
+            "size": self._size,
+            "trained": self.trained,
+            "lists": len(sizes),
+            "n_probe": self.n_probe,
+            "largest_list": max(sizes) if sizes else 0,
+            "mean_list": float(np.mean(sizes)) if sizes else 0.0,
+        }
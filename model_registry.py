@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from langchain_ollama import ChatOllama
+from ollama import AsyncClient
+
+from ollama_cassette import cassette_client_kwargs
+
+logging.basicConfig(level=logging.INFO)
+
+# Ollama models known to the service. The model list is cached and refreshed in the background, so
+# /models and the add-in's model dropdown never wait on Ollama. Chat clients are pooled per model,
+# and the model the add-in selects is loaded ahead of its first message. Models the service loaded
+# are unloaded again once idle, or sooner when the loaded models exceed the memory budget.
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
+MODEL_REFRESH_INTERVAL = float(os.environ.get("MODEL_REFRESH_INTERVAL", "60"))
+# Seconds a model stays loaded after its last use; Ollama's own keep_alive is set to match
+MODEL_IDLE_SECONDS = float(os.environ.get("MODEL_IDLE_SECONDS", "900"))
+# Total size of loaded models in GB before least recently used ones are unloaded (0 disables)
+MODEL_MEMORY_BUDGET_GB = float(os.environ.get("MODEL_MEMORY_BUDGET_GB", "0"))
+
+class ModelRegistry:
+    def __init__(self, host: Optional[str] = OLLAMA_HOST, default_model: Optional[str] = None,
+                 idle_seconds: float = MODEL_IDLE_SECONDS, memory_budget_gb: float = MODEL_MEMORY_BUDGET_GB,
+                 client: Optional[AsyncClient] = None, chat_factory: Optional[Callable[..., object]] = None):
+        """
+        chat_factory(model=..., **options) builds the pooled chat clients (ChatOllama by default).
+        """
+        self.host = host
+        self.default_model = default_model
+        self.idle_seconds = idle_seconds
+        self.memory_budget = int(memory_budget_gb * 1024 ** 3)
+        self.client = client or AsyncClient(host, **cassette_client_kwargs())
+        self.chat_factory = chat_factory or (lambda **kwargs: ChatOllama(
+            base_url=host, client_kwargs=cassette_client_kwargs(), keep_alive=int(idle_seconds), **kwargs))
+        self.models: List[Dict] = []
+        self.loaded: Dict[str, Dict] = {}
+        self.refreshed_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._clients: Dict[tuple, object] = {}
+        self._last_used: Dict[str, float] = {}
+        self._managed = set()  # models this service loaded, the only ones it unloads
+        self._lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+
+    def names(self) -> List[str]:
+        return [model["name"] for model in self.models]
+
+    def resolve(self, model: Optional[str]) -> str:
+        """
+        Installed model name for a requested one: "llama3.2" matches "llama3.2:latest" or another tag.
+        """
+        if not model:
+            return self.default_model
+        names = self.names()
+        if model in names or not names:
+            return model
+        if f"{model}:latest" in names:
+            return f"{model}:latest"
+        tagged = [name for name in names if name.split(":", 1)[0] == model]
+        return tagged[0] if tagged else model
+
+    def chat(self, model: Optional[str] = None, **options):
+        """
+        Pooled chat client for a model; options (temperature, format, ...) are part of the pool key.
+        """
+        model = self.resolve(model)
+        options.setdefault("temperature", 0)
+        key = (model, tuple(sorted(options.items())))
+        with self._lock:
+            self._last_used[model] = time.monotonic()
+            if key not in self._clients:
+                self._clients[key] = self.chat_factory(model=model, **options)
+            return self._clients[key]
+
+    async def refresh(self):
+        """
+        Reloads the installed and the currently loaded models from Ollama.
+        """
+        async with self._refresh_lock:
+            try:
+                listed, running = await asyncio.gather(self.client.list(), self.client.ps())
+            except Exception as e:
+                self.error = str(e)
+                logging.error(f"Error refreshing models: {e}")
+                return
+            self.models = [
+                {"name": model.model, "size": model.size,
+                 "modified_at": model.modified_at.isoformat() if model.modified_at else None}
+                for model in listed.models
+            ]
+            self.loaded = {
+                model.model: {"size": model.size, "size_vram": model.size_vram,
+                              "expires_at": model.expires_at.isoformat() if model.expires_at else None}
+                for model in running.models
+            }
+            self.refreshed_at = time.time()
+            self.error = None
+
+    async def list_models(self) -> List[str]:
+        if self.refreshed_at is None:
+            await self.refresh()
+            if self.refreshed_at is None:
+                raise RuntimeError(f"Error fetching models: {self.error}")
+        return self.names()
+
+    async def preload(self, model: Optional[str]) -> str:
+        """
+        Loads a model into Ollama before it is first used (an empty generate request loads it).
+        """
+        model = self.resolve(model)
+        with self._lock:
+            self._last_used[model] = time.monotonic()
+        if model not in self.loaded:
+            started = time.perf_counter()
+            await self.client.generate(model=model, prompt="", keep_alive=int(self.idle_seconds))
+            logging.info(f"Preloaded model {model} in {time.perf_counter() - started:.2f}s")
+            self._managed.add(model)
+            await self.refresh()
+        await self.enforce_budget(keep=model)
+        return model
+
+    async def unload(self, model: str):
+        await self.client.generate(model=model, prompt="", keep_alive=0)
+        logging.info(f"Unloaded model {model}")
+        self.loaded.pop(model, None)
+        self._managed.discard(model)
+
+    def _unload_order(self, keep: Optional[str]) -> List[str]:
+        # Least recently used first; models loaded by someone else are left alone
+        candidates = [model for model in self.loaded if model in self._managed and model != keep]
+        return sorted(candidates, key=lambda model: self._last_used.get(model, 0))
+
+    async def enforce_budget(self, keep: Optional[str] = None):
+        """
+        Unloads models idle for longer than idle_seconds, then least recently used ones while the
+        loaded models exceed the memory budget.
+        """
+        now = time.monotonic()
+        for model in self._unload_order(keep):
+            if now - self._last_used.get(model, 0) >= self.idle_seconds:
+                await self.unload(model)
+        if not self.memory_budget:
+            return
+        for model in self._unload_order(keep):
+            if sum(info["size"] for info in self.loaded.values()) <= self.memory_budget:
+                break
+            await self.unload(model)
+
+    async def run_refresher(self, interval: float = MODEL_REFRESH_INTERVAL, preload: Optional[List[str]] = None):
+        """
+        Background task: loads the given models once, then refreshes and enforces the budget periodically.
+        """
+        await self.refresh()
+        for model in preload or []:
+            try:
+                await self.preload(model)
+            except Exception as e:
+                logging.error(f"Error preloading model {model}: {e}")
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+            try:
+                await self.enforce_budget()
+            except Exception as e:
+                logging.error(f"Error unloading idle models: {e}")
+
+    def describe(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "models": self.models,
+            "loaded": {
+                model: dict(info, managed=model in self._managed,
+                            idle_seconds=round(now - self._last_used[model], 1) if model in self._last_used else None)
+                for model, info in self.loaded.items()
+            },
+            "clients": len(self._clients),
+            "memory_budget": self.memory_budget,
+            "refreshed_at": self.refreshed_at,
+            "error": self.error,
+        }
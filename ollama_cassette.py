@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logging.basicConfig(level=logging.INFO)
+
+# Modes: "record" always calls Ollama and overwrites, "replay" never calls Ollama,
+# "auto" replays when a cassette exists and records otherwise.
+CASSETTE_MODES = ["record", "replay", "auto"]
+
+# Headers that describe the wire encoding of the original body, not the decoded body we store
+_DROPPED_HEADERS = ["content-encoding", "content-length", "transfer-encoding", "connection", "date"]
+
+class CassetteMiss(Exception):
+    pass
+
+# Content-addressed store of recorded Ollama request/response pairs
+class Cassette:
+    def __init__(self, directory: str, mode: str = "replay", simulate_timing: bool = False, timing_scale: float = 1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}'. Expected one of {CASSETTE_MODES}.")
+        self.directory = directory
+        self.mode = mode
+        self.simulate_timing = simulate_timing
+        self.timing_scale = timing_scale
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, method: str, url: str, body) -> str:
+        """
+        Hashes the method, URL path and canonical request body. The host is left out so
+        recordings can be replayed against any Ollama endpoint.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            pass
+        digest = hashlib.sha256()
+        digest.update(method.upper().encode("utf-8") + b" " + urlparse(url).path.encode("utf-8") + b"\n")
+        digest.update(body)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str):
+        if self.mode == "record":
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            if self.mode == "replay":
+                raise CassetteMiss(f"No cassette recorded for request {key} in '{self.directory}'.")
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        with self._lock:
+            self.hits += 1
+        return record
+
+    def save(self, key: str, method: str, url: str, body, status_code: int, headers, content: bytes, elapsed: float):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        record = {
+            "request": {"method": method, "path": urlparse(url).path, "body": body},
+            "response": {
+                "status_code": status_code,
+                "headers": {k: v for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS},
+                "body": content.decode("utf-8", errors="replace"),
+                "elapsed": elapsed,
+            },
+        }
+        # Write to a temporary file first so concurrent readers never see a partial cassette
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        os.replace(temp_path, path)
+
+    def replay_delay(self, record) -> float:
+        if not self.simulate_timing:
+            return 0.0
+        return record["response"].get("elapsed", 0.0) * self.timing_scale
+
+# httpx transport used by the ollama client (and therefore ChatOllama)
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, transport=None, async_transport=None):
+        self.cassette = cassette
+        self._transport = transport or httpx.HTTPTransport()
+        self._async_transport = async_transport or httpx.AsyncHTTPTransport()
+
+    def _replayed_response(self, request: httpx.Request, record) -> httpx.Response:
+        response = record["response"]
+        return httpx.Response(
+            status_code=response["status_code"],
+            headers=response["headers"],
+            content=response["body"].encode("utf-8"),
+            request=request,
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        key = self.cassette.key(request.method, str(request.url), body)
+        record = self.cassette.load(key)
+        if record is not None:
+            delay = self.cassette.replay_delay(record)
+            if delay:
+                time.sleep(delay)
+            return self._replayed_response(request, record)
+
+        start = time.perf_counter()
+        response = self._transport.handle_request(request)
+        content = response.read()
+        elapsed = time.perf_counter() - start
+        response.close()
+        self.cassette.save(key, request.method, str(request.url), body, response.status_code, response.headers, content, elapsed)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS},
+            content=content,
+            request=request,
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = self.cassette.key(request.method, str(request.url), body)
+        record = self.cassette.load(key)
+        if record is not None:
+            delay = self.cassette.replay_delay(record)
+            if delay:
+                await asyncio.sleep(delay)
+            return self._replayed_response(request, record)
+
+        start = time.perf_counter()
+        response = await self._async_transport.handle_async_request(request)
+        content = await response.aread()
+        elapsed = time.perf_counter() - start
+        await response.aclose()
+        self.cassette.save(key, request.method, str(request.url), body, response.status_code, response.headers, content, elapsed)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS},
+            content=content,
+            request=request,
+        )
+
+    def close(self):
+        self._transport.close()
+
+    async def aclose(self):
+        await self._async_transport.aclose()
+
+# requests adapter used by the plain HTTP helpers (e.g. ollama_embedding.generate_ollama_embedding)
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        key = self.cassette.key(request.method, request.url, request.body)
+        record = self.cassette.load(key)
+        if record is not None:
+            delay = self.cassette.replay_delay(record)
+            if delay:
+                time.sleep(delay)
+            response = requests.Response()
+            response.status_code = record["response"]["status_code"]
+            response.headers = CaseInsensitiveDict(record["response"]["headers"])
+            response._content = record["response"]["body"].encode("utf-8")
+            response.encoding = "utf-8"
+            response.url = request.url
+            response.request = request
+            return response
+
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        content = response.content
+        elapsed = time.perf_counter() - start
+        self.cassette.save(key, request.method, request.url, request.body, response.status_code, response.headers, content, elapsed)
+        return response
+
+# Cassette configured from the environment, shared by every Ollama client in the process
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette():
+    """
+    Returns the process-wide cassette, or None when OLLAMA_CASSETTE_MODE is unset or "off".
+    OLLAMA_CASSETTE_DIR picks the directory and OLLAMA_CASSETTE_SIMULATE_TIMING=1 replays recorded latencies.
+    """
+    global _cassette
+    mode = os.environ.get("OLLAMA_CASSETTE_MODE", "off").lower()
+    if mode in ("", "off"):
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                directory=os.environ.get("OLLAMA_CASSETTE_DIR", "cassettes"),
+                mode=mode,
+                simulate_timing=os.environ.get("OLLAMA_CASSETTE_SIMULATE_TIMING", "0") == "1",
+                timing_scale=float(os.environ.get("OLLAMA_CASSETTE_TIMING_SCALE", "1.0")),
+            )
+            logging.info(f"Ollama cassette enabled in '{mode}' mode at '{_cassette.directory}'.")
+        return _cassette
+
+def cassette_client_kwargs() -> dict:
+    """
+    Keyword arguments for ChatOllama(client_kwargs=...) that route its traffic through the cassette.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return {}
+    return {"transport": CassetteTransport(cassette)}
+
+def install_cassette(session: requests.Session) -> requests.Session:
+    """
+    Mounts the cassette adapter on a requests session when a cassette is configured.
+    """
+    cassette = get_cassette()
+    if cassette is not None:
+        adapter = CassetteAdapter(cassette)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
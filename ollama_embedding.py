@@ -1,19 +1,34 @@
 import requests
 import json
+from typing import List
+from ollama_cassette import install_cassette
+from embedding_cache import get_embedding_cache
 
-def generate_ollama_embedding(text: str, model: str = "llama2"):
+# Shared session so connections are reused and cassettes can be mounted for record/replay
+session = install_cassette(requests.Session())
+
+def _request_ollama_embeddings(texts: List[str], model: str) -> List[List[float]]:
+    # /api/embed takes a batch in "input" and returns one vector per input in "embeddings"
     url = "http://localhost:11434/api/embed"
     headers = {"Content-Type": "application/json"}
     
     payload = {
         "model": model,
-        "prompt": text
+        "input": texts
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = session.post(url, headers=headers, json=payload)
     
     if response.status_code == 200:
-        embedding_data = response.json()
-        return embedding_data.get("embedding", [])
+        embeddings = response.json().get("embeddings") or []
+        if len(embeddings) != len(texts) or not all(embeddings):
+            raise Exception(f"Ollama returned {len(embeddings)} embeddings for {len(texts)} texts with model '{model}'")
+        return embeddings
     else:
         raise Exception(f"Failed to generate embeddings: {response.status_code}, {response.text}")
+
+# Embeddings are served from the shared cache and only requested from Ollama on a miss
+def generate_ollama_embedding(text: str, model: str = "llama2"):
+    return get_embedding_cache().get_or_compute(
+        model, [text], lambda texts: _request_ollama_embeddings(texts, model)
+    )[0]
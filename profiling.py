@@ -0,0 +1,213 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+logging.basicConfig(level=logging.INFO)
+
+# Opt-in request profiling. Nothing is measured unless VISIO_PROFILING is set; a request is then
+# profiled when it carries "X-Profile: 1" or "?profile=1", or when it is picked by the sampling rate.
+#
+#   VISIO_PROFILING             1/true/yes to enable
+#   VISIO_PROFILE_SAMPLE_RATE   fraction of unflagged requests to profile (default 0)
+#   VISIO_PROFILER              cprofile (default) or pyinstrument
+#   VISIO_PROFILE_DIR           where profiles are written (default "profiles")
+#   VISIO_PROFILE_MAX_FILES     oldest profiles beyond this count are deleted (default 200)
+PROFILING_ENABLED = os.environ.get("VISIO_PROFILING", "0").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("VISIO_PROFILE_SAMPLE_RATE", "0"))
+PROFILER = os.environ.get("VISIO_PROFILER", "cprofile").lower()
+PROFILE_DIR = os.environ.get("VISIO_PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("VISIO_PROFILE_MAX_FILES", "200"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+# Only one profiler can be attached to the event loop thread at a time; overlapping requests
+# are served unprofiled rather than waiting
+_active = threading.Lock()
+
+def _flag_value(value) -> Optional[bool]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    return value.strip().lower() in ("1", "true", "yes")
+
+def wants_profile(flag=None) -> bool:
+    """
+    flag is the header or query value from the request (None when absent); an explicit
+    "0" opts a request out of sampling.
+    """
+    if not PROFILING_ENABLED:
+        return False
+    explicit = _flag_value(flag)
+    if explicit is not None:
+        return explicit
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+class _Capture:
+    def __init__(self, profiler: str):
+        self.profiler = profiler
+        self._profiler = None
+
+    def start(self):
+        if self.profiler == "pyinstrument":
+            # Optional dependency; only imported when selected
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self.profiler == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def write(self, base_path: str) -> str:
+        """
+        Writes the raw profile next to a plain-text report; returns the raw file name.
+        """
+        if self.profiler == "pyinstrument":
+            raw_name = os.path.basename(base_path) + ".html"
+            with open(base_path + ".html", "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+            report = self._profiler.output_text(unicode=False, color=False)
+        else:
+            raw_name = os.path.basename(base_path) + ".prof"
+            self._profiler.dump_stats(base_path + ".prof")
+            buffer = io.StringIO()
+            pstats.Stats(self._profiler, stream=buffer).sort_stats("cumulative").print_stats(40)
+            report = buffer.getvalue()
+        with open(base_path + ".txt", "w", encoding="utf-8") as f:
+            f.write(report)
+        return raw_name
+
+def _prune(directory: str):
+    entries = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    for name in entries[:max(0, len(entries) - PROFILE_MAX_FILES)]:
+        profile_id = name[:-len(".json")]
+        for suffix in (".json", ".txt", ".prof", ".html"):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+@contextmanager
+def profile_block(kind: str, name: str, flag=None, **metadata):
+    """
+    Profiles the enclosed block when the request is selected; yields the metadata dict so the
+    caller can add fields (e.g. a status code) before it is written.
+    """
+    if not wants_profile(flag) or not _active.acquire(blocking=False):
+        yield None
+        return
+    try:
+        capture = _Capture(PROFILER)
+        metadata = dict(metadata, kind=kind, name=name, profiler=PROFILER, pid=os.getpid())
+        started = time.time()
+        start = time.perf_counter()
+        capture.start()
+        try:
+            yield metadata
+        finally:
+            capture.stop()
+            metadata["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            metadata["started_at"] = started
+            _save(capture, metadata)
+    finally:
+        _active.release()
+
+def _save(capture: _Capture, metadata: Dict):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_id = f"{int(metadata['started_at'] * 1000)}-{uuid.uuid4().hex[:8]}"
+        base_path = os.path.join(PROFILE_DIR, profile_id)
+        metadata.update(id=profile_id, file=capture.write(base_path), report=f"{profile_id}.txt")
+        with open(base_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        _prune(PROFILE_DIR)
+        logging.info(f"Profile {profile_id} saved for {metadata['kind']} {metadata['name']} ({metadata['duration_ms']} ms).")
+    except Exception as e:
+        logging.error(f"Error saving profile: {e}")
+
+def list_profiles(limit: int = 100) -> List[Dict]:
+    """
+    Profile metadata, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(PROFILE_DIR, name), "r", encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return profiles
+
+def profile_file(profile_id: str, report: bool = False) -> Optional[str]:
+    """
+    Path of the raw profile (or its text report) for a listed id, or None if there is no such profile.
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    metadata_path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    path = os.path.join(PROFILE_DIR, metadata["report"] if report else metadata["file"])
+    return path if os.path.exists(path) else None
+
+# ASGI middleware rather than an @app.middleware("http") function, so a disabled profiler costs one
+# attribute check per request and streaming responses are left untouched
+class ProfilingMiddleware:
+    def __init__(self, app, exclude_prefixes=("/profiles",)):
+        self.app = app
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILING_ENABLED or scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        with profile_block("http", scope["path"], flag=request_flag(scope), method=scope["method"],
+                           query=scope.get("query_string", b"").decode("latin-1")) as metadata:
+            if metadata is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    metadata["status"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+def request_flag(scope) -> Optional[str]:
+    """
+    The profile flag from an ASGI scope (HTTP or WebSocket): the X-Profile header, else ?profile=.
+    """
+    for key, value in scope.get("headers", []):
+        if key == PROFILE_HEADER:
+            return value.decode("latin-1")
+    query_string = scope.get("query_string", b"")
+    if PROFILE_QUERY_PARAM.encode() in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get(PROFILE_QUERY_PARAM)
+        if values:
+            return values[0]
+    return None
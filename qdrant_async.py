@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+import httpx
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from qdrant_client.http.models import PointStruct, PayloadSchemaType, QueryRequest
+from qdrant_db import (COLLECTION_NAMES, PAYLOAD_INDEXES, build_collection_config, build_payload_filter,
+                       build_search_params, embedding_dimension, to_vector)
+
+logging.basicConfig(level=logging.INFO)
+
+# Application-scoped async client, created on first use or at service startup
+_client = None
+_client_lock = asyncio.Lock()
+
+def _env_flag(name, default="0"):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+# Retry transient failures (connection errors, timeouts, 5xx) with exponential backoff and jitter
+async def with_retry(operation, *args, retries=3, base_delay=0.2, max_delay=2.0, **kwargs):
+    for attempt in range(retries + 1):
+        try:
+            return await operation(*args, **kwargs)
+        except (ResponseHandlingException, httpx.TransportError, ConnectionError, asyncio.TimeoutError) as e:
+            error = e
+        except UnexpectedResponse as e:
+            if e.status_code is None or e.status_code < 500:
+                raise
+            error = e
+        if attempt == retries:
+            raise error
+        delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+        logging.warning(f"Qdrant call failed ({error}); retrying in {delay:.2f}s (attempt {attempt + 1}/{retries}).")
+        await asyncio.sleep(delay)
+
+# Check that the client can reach Qdrant
+async def health_check(client=None, timeout=2.0):
+    try:
+        client = client or await get_async_qdrant_client()
+        await asyncio.wait_for(client.get_collections(), timeout=timeout)
+        return True
+    except Exception as e:
+        logging.error(f"Qdrant health check failed: {e}")
+        return False
+
+def _create_client():
+    """
+    QDRANT_LOCATION=":memory:" runs Qdrant in-process (for tests); otherwise QDRANT_HOST, QDRANT_PORT,
+    QDRANT_PREFER_GRPC and QDRANT_POOL_SIZE configure the remote client and its keep-alive pool.
+    """
+    location = os.environ.get("QDRANT_LOCATION")
+    if location:
+        return AsyncQdrantClient(location=location)
+    pool_size = int(os.environ.get("QDRANT_POOL_SIZE", "10"))
+    return AsyncQdrantClient(
+        host=os.environ.get("QDRANT_HOST", "localhost"),
+        port=int(os.environ.get("QDRANT_PORT", "6333")),
+        grpc_port=int(os.environ.get("QDRANT_GRPC_PORT", "6334")),
+        prefer_grpc=_env_flag("QDRANT_PREFER_GRPC"),
+        timeout=int(os.environ.get("QDRANT_TIMEOUT", "10")),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+    )
+
+# Get (or create) the shared async client
+async def get_async_qdrant_client():
+    global _client
+    if _client is not None:
+        return _client
+    async with _client_lock:
+        if _client is None:
+            _client = _create_client()
+        return _client
+
+# The service only talks to Qdrant when a deployment configures it
+def qdrant_configured() -> bool:
+    return bool(os.environ.get("QDRANT_HOST") or os.environ.get("QDRANT_LOCATION")) \
+        or os.environ.get("VECTOR_STORE_BACKEND") == "qdrant"
+
+# Create the client and open its pooled connections; falls back to local mode when allowed
+async def start_async_qdrant_client(warm_connections=None):
+    global _client
+    client = await get_async_qdrant_client()
+    warm_connections = warm_connections or int(os.environ.get("QDRANT_POOL_SIZE", "10"))
+    # Concurrent requests force the pool to open that many keep-alive connections
+    results = await asyncio.gather(*[health_check(client) for _ in range(warm_connections)])
+    if all(results):
+        logging.info(f"Async Qdrant client ready with {warm_connections} warm connections.")
+        return client
+    if _env_flag("QDRANT_LOCAL_FALLBACK"):
+        logging.warning("Qdrant is unreachable; falling back to in-process local mode.")
+        async with _client_lock:
+            await client.close()
+            _client = AsyncQdrantClient(location=":memory:")
+        return _client
+    logging.error("Qdrant is unreachable; async client will keep retrying on use.")
+    return client
+
+# Close the shared client on shutdown
+async def close_async_qdrant_client():
+    global _client
+    async with _client_lock:
+        if _client is not None:
+            await _client.close()
+            _client = None
+
+# Async versions of the qdrant_db helpers; client may be None to use the shared client
+
+async def ensure_collection_exists(client, collection_name, vector_size, quantization=False, hnsw_m=None, hnsw_ef_construct=None):
+    try:
+        client = client or await get_async_qdrant_client()
+        if await with_retry(client.collection_exists, collection_name):
+            info = await with_retry(client.get_collection, collection_name)
+            if info.config.params.vectors.size != vector_size:
+                logging.error(f"Collection '{collection_name}' holds {info.config.params.vectors.size}-dimensional "
+                              f"vectors, expected {vector_size}.")
+            else:
+                logging.info(f"Collection '{collection_name}' already exists.")
+            return
+        await with_retry(
+            client.create_collection,
+            collection_name=collection_name,
+            **build_collection_config(vector_size, quantization, hnsw_m, hnsw_ef_construct)
+        )
+        for field_name in PAYLOAD_INDEXES.get(collection_name, []):
+            await with_retry(
+                client.create_payload_index,
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+        logging.info(f"Collection '{collection_name}' created with vector size {vector_size}.")
+    except Exception as e:
+        logging.error(f"Error ensuring collection exists: {e}")
+
+async def create_all_collections(client=None, quantization=False, vector_size=None):
+    vector_size = vector_size or await asyncio.to_thread(embedding_dimension)
+    if vector_size <= 0:
+        raise ValueError(f"Invalid vector size {vector_size}")
+    await asyncio.gather(*[
+        ensure_collection_exists(client, collection_name, vector_size=vector_size, quantization=quantization)
+        for collection_name in COLLECTION_NAMES
+    ])
+    logging.info("All collections ensured to exist.")
+
+async def _store_point(client, collection_name, data, payload, label):
+    try:
+        client = client or await get_async_qdrant_client()
+        point_id = str(uuid.uuid4())  # Use a UUID for point ID
+        # Text is embedded in a worker thread so the event loop stays free
+        vector = await asyncio.to_thread(to_vector, data)
+        await with_retry(
+            client.upsert,
+            collection_name=collection_name,
+            points=[PointStruct(id=point_id, vector=vector, payload=payload)]
+        )
+        logging.info(f"{label} stored successfully with UUID {point_id}")
+        return point_id
+    except Exception as e:
+        logging.error(f"Error storing {label} in Qdrant: {e}")
+        return None
+
+async def store_model_in_qdrant(client, model_name, model_data):
+    return await _store_point(client, "models", model_data, {"model_name": model_name}, f"Model {model_name}")
+
+async def store_action_in_qdrant(client, action_name, action_type, action_data):
+    payload = {"action_name": action_name, "action_type": action_type}
+    return await _store_point(client, "actions", action_data, payload, f"Action {action_name}")
+
+async def store_shape_in_qdrant(client, shape_name, shape_data, category=None):
+    payload = {"shape_name": shape_name}
+    if category is not None:
+        payload["category"] = category
+    return await _store_point(client, "shapes", shape_data, payload, f"Shape {shape_name}")
+
+async def fetch_data_from_qdrant(client, collection_name, query_vector, limit=5, query_filter=None, hnsw_ef=None, exact=False):
+    try:
+        client = client or await get_async_qdrant_client()
+        result = await with_retry(
+            client.query_points,
+            collection_name=collection_name,
+            query=await asyncio.to_thread(to_vector, query_vector),
+            query_filter=query_filter,
+            search_params=build_search_params(hnsw_ef, exact),
+            limit=limit,
+            with_payload=True
+        )
+        return result.points
+    except Exception as e:
+        logging.error(f"Error fetching data from Qdrant: {e}")
+        return None
+
+async def fetch_batch_from_qdrant(client, collection_name, query_vectors, limit=5, query_filter=None, hnsw_ef=None, exact=False):
+    try:
+        client = client or await get_async_qdrant_client()
+        search_params = build_search_params(hnsw_ef, exact)
+        vectors = await asyncio.gather(*[asyncio.to_thread(to_vector, v) for v in query_vectors])
+        requests = [
+            QueryRequest(query=vector, filter=query_filter, params=search_params, limit=limit, with_payload=True)
+            for vector in vectors
+        ]
+        responses = await with_retry(client.query_batch_points, collection_name=collection_name, requests=requests)
+        return [response.points for response in responses]
+    except Exception as e:
+        logging.error(f"Error fetching batch from Qdrant: {e}")
+        return None
+
+async def search_similar_actions(client, query_vector, limit=5, action_type=None):
+    return await fetch_data_from_qdrant(client, "actions", query_vector, limit=limit,
+                                        query_filter=build_payload_filter(action_type=action_type))
+
+async def search_similar_shapes(client, query_vector, limit=5, category=None):
+    return await fetch_data_from_qdrant(client, "shapes", query_vector, limit=limit,
+                                        query_filter=build_payload_filter(category=category))
@@ -1,34 +1,103 @@
 import uuid
 import logging
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, Distance, VectorParams
+from qdrant_client.http.models import (
+    PointStruct, Distance, VectorParams, Filter, FieldCondition, MatchValue, MatchAny,
+    SearchParams, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, HnswConfigDiff, PayloadSchemaType, QueryRequest
+)
+from ollama_embedding import generate_ollama_embedding
 
-# Initialize Qdrant Client
-def initialize_qdrant_client():
-    client = QdrantClient(host="localhost", port=6333)
+# Embedding model used when text is passed instead of a vector
+EMBEDDING_MODEL = "nomic-embed-text"
+
+# Payload fields that get a keyword index so filters are resolved server-side
+PAYLOAD_INDEXES = {
+    "actions": ["action_type"],
+    "shapes": ["category"],
+    "function_blocks": ["category"],
+}
+
+# Initialize Qdrant Client (prefer_grpc switches to the gRPC transport on grpc_port)
+def initialize_qdrant_client(host="localhost", port=6333, prefer_grpc=False, grpc_port=6334):
+    client = QdrantClient(host=host, port=port, grpc_port=grpc_port, prefer_grpc=prefer_grpc)
     return client
 
+# Collections the service keeps, all holding to_vector() embeddings
+COLLECTION_NAMES = ("models", "actions", "shapes", "function_blocks")
+
+# create_collection arguments shared by the sync and async clients. With quantization=True vectors
+# are also stored as int8 scalar-quantized copies kept in RAM, which searches use before rescoring
+# with the originals.
+def build_collection_config(vector_size, quantization=False, hnsw_m=None, hnsw_ef_construct=None):
+    quantization_config = None
+    if quantization:
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    hnsw_config = None
+    if hnsw_m is not None or hnsw_ef_construct is not None:
+        hnsw_config = HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+    return {
+        "vectors_config": VectorParams(size=vector_size, distance=Distance.COSINE),
+        "quantization_config": quantization_config,
+        "hnsw_config": hnsw_config,
+    }
+
 # Function to ensure collections exist or create them if they don't
-def ensure_collection_exists(client, collection_name, vector_size):
+def ensure_collection_exists(client, collection_name, vector_size, quantization=False, hnsw_m=None, hnsw_ef_construct=None):
+    """
+    Creates the collection if needed, configured by build_collection_config.
+    """
     try:
         collections = client.get_collections().collections
         if collection_name not in [col.name for col in collections]:
             client.create_collection(
                 collection_name=collection_name,
-                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
+                **build_collection_config(vector_size, quantization, hnsw_m, hnsw_ef_construct)
             )
+            for field_name in PAYLOAD_INDEXES.get(collection_name, []):
+                client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=field_name,
+                    field_schema=PayloadSchemaType.KEYWORD
+                )
             logging.info(f"Collection '{collection_name}' created with vector size {vector_size}.")
         else:
-            logging.info(f"Collection '{collection_name}' already exists.")
+            size = client.get_collection(collection_name).config.params.vectors.size
+            if size != vector_size:
+                logging.error(f"Collection '{collection_name}' holds {size}-dimensional vectors, expected {vector_size}.")
+            else:
+                logging.info(f"Collection '{collection_name}' already exists.")
     except Exception as e:
         logging.error(f"Error ensuring collection exists: {e}")
 
-# Create all necessary collections
-def create_all_collections(client):
-    ensure_collection_exists(client, "models", vector_size=1536)
-    ensure_collection_exists(client, "actions", vector_size=512)
-    ensure_collection_exists(client, "shapes", vector_size=128)
-    ensure_collection_exists(client, "function_blocks", vector_size=512)
+# Accept either a ready vector or text, which is embedded through the shared embedding cache
+def to_vector(data, model=EMBEDDING_MODEL):
+    if isinstance(data, str):
+        return generate_ollama_embedding(data, model=model)
+    return data
+
+# Dimension of the vectors to_vector produces for a model, measured once per model
+_embedding_dimensions = {}
+
+def embedding_dimension(model=EMBEDDING_MODEL):
+    if model not in _embedding_dimensions:
+        dimension = len(to_vector("dimension probe", model=model))
+        if not dimension:
+            # Never remember (or create collections with) a 0-dimensional vector
+            raise ValueError(f"Embedding model '{model}' returned an empty vector")
+        _embedding_dimensions[model] = dimension
+    return _embedding_dimensions[model]
+
+# Create all necessary collections. Every collection stores to_vector() embeddings, so they all
+# use the embedding model's dimension unless vector_size is given.
+def create_all_collections(client, quantization=False, vector_size=None):
+    vector_size = vector_size or embedding_dimension()
+    if vector_size <= 0:
+        raise ValueError(f"Invalid vector size {vector_size}")
+    for collection_name in COLLECTION_NAMES:
+        ensure_collection_exists(client, collection_name, vector_size=vector_size, quantization=quantization)
     logging.info("All collections ensured to exist.")
 
 # Store model in Qdrant with descriptive metadata
@@ -40,7 +109,7 @@ def store_model_in_qdrant(client, model_name, model_data):
             points=[
                 PointStruct(
                     id=model_id,  # Use UUID as ID
-                    vector=model_data,  # Model data as vector (embedding)
+                    vector=to_vector(model_data),  # Model data as vector (embedding)
                     payload={"model_name": model_name}  # Payload with descriptive name
                 )
             ]
@@ -58,7 +127,7 @@ def store_action_in_qdrant(client, action_name, action_type, action_data):
             points=[
                 PointStruct(
                     id=action_id,  # Use UUID as ID
-                    vector=action_data,  # Action data as vector (embedding)
+                    vector=to_vector(action_data),  # Action data as vector (embedding)
                     payload={
                         "action_name": action_name,
                         "action_type": action_type
@@ -71,16 +140,19 @@ def store_action_in_qdrant(client, action_name, action_type, action_data):
         logging.error(f"Error storing action in Qdrant: {e}")
 
 # Store shape data in Qdrant with descriptive metadata
-def store_shape_in_qdrant(client, shape_name, shape_data):
+def store_shape_in_qdrant(client, shape_name, shape_data, category=None):
     try:
         shape_id = str(uuid.uuid4())  # Use a UUID for point ID
+        payload = {"shape_name": shape_name}
+        if category is not None:
+            payload["category"] = category  # Stencil category, used for filtered searches
         client.upsert(
             collection_name="shapes",  # Separate collection for shapes
             points=[
                 PointStruct(
                     id=shape_id,  # Use UUID as ID
-                    vector=shape_data,  # Shape data as vector (embedding)
-                    payload={"shape_name": shape_name}
+                    vector=to_vector(shape_data),  # Shape data as vector (embedding)
+                    payload=payload
                 )
             ]
         )
@@ -88,20 +160,68 @@ def store_shape_in_qdrant(client, shape_name, shape_data):
     except Exception as e:
         logging.error(f"Error storing shape in Qdrant: {e}")
 
+# Build a payload filter from field/value pairs; lists match any of their values, None is ignored
+def build_payload_filter(**conditions):
+    must = []
+    for key, value in conditions.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            must.append(FieldCondition(key=key, match=MatchAny(any=list(value))))
+        else:
+            must.append(FieldCondition(key=key, match=MatchValue(value=value)))
+    return Filter(must=must) if must else None
+
+# Search-time knobs: hnsw_ef trades latency for recall, exact bypasses the HNSW index
+def build_search_params(hnsw_ef=None, exact=False, rescore=True):
+    return SearchParams(
+        hnsw_ef=hnsw_ef,
+        exact=exact,
+        quantization=QuantizationSearchParams(rescore=rescore)
+    )
+
 # Fetch data from Qdrant knowledge base
-def fetch_data_from_qdrant(client, collection_name, query_vector):
+def fetch_data_from_qdrant(client, collection_name, query_vector, limit=5, query_filter=None, hnsw_ef=None, exact=False):
     try:
-        result = client.search(
+        result = client.query_points(
             collection_name=collection_name,
-            query_vector=query_vector,  # The query vector (embedding)
-            limit=5
+            query=to_vector(query_vector),  # The query vector (embedding) or query text
+            query_filter=query_filter,  # Resolved server-side, e.g. build_payload_filter(action_type="create")
+            search_params=build_search_params(hnsw_ef, exact),
+            limit=limit,
+            with_payload=True
         )
-        return result
+        return result.points
     except Exception as e:
         logging.error(f"Error fetching data from Qdrant: {e}")
         return None
 
-# Function to search for similar actions
-def search_similar_actions(client, query_vector, limit=5):
-    return fetch_data_from_qdrant(client, "actions", query_vector)
+# Fetch results for many query vectors in a single round trip
+def fetch_batch_from_qdrant(client, collection_name, query_vectors, limit=5, query_filter=None, hnsw_ef=None, exact=False):
+    try:
+        search_params = build_search_params(hnsw_ef, exact)
+        requests = [
+            QueryRequest(
+                query=to_vector(query_vector),
+                filter=query_filter,
+                params=search_params,
+                limit=limit,
+                with_payload=True
+            )
+            for query_vector in query_vectors
+        ]
+        responses = client.query_batch_points(collection_name=collection_name, requests=requests)
+        return [response.points for response in responses]
+    except Exception as e:
+        logging.error(f"Error fetching batch from Qdrant: {e}")
+        return None
+
+# Function to search for similar actions, optionally restricted to an action type
+def search_similar_actions(client, query_vector, limit=5, action_type=None):
+    return fetch_data_from_qdrant(client, "actions", query_vector, limit=limit,
+                                  query_filter=build_payload_filter(action_type=action_type))
 
+# Function to search for similar shapes, optionally restricted to a stencil category
+def search_similar_shapes(client, query_vector, limit=5, category=None):
+    return fetch_data_from_qdrant(client, "shapes", query_vector, limit=limit,
+                                  query_filter=build_payload_filter(category=category))
@@ -0,0 +1,368 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs
+
+from stats_utils import percentile
+
+logging.basicConfig(level=logging.INFO)
+
+# Tail-latency controls for Ollama calls.
+#
+# Deadlines: every request gets one (X-Request-Timeout header or ?timeout=, in seconds, else
+# REQUEST_DEADLINE_SECONDS). It lives in a context variable, so routing, retrieval and generation
+# running for the request, including tasks and threads started from it, all see the same deadline.
+# Stages that run out of time return what they have and mark the result partial.
+#
+# Circuit breaking: an endpoint that fails OLLAMA_BREAKER_FAILURES times in a row is skipped for
+# OLLAMA_BREAKER_RESET_SECONDS, then gets one trial call. Only errors count as failures: deadlines
+# are set by clients, so a call cut short by one is counted as a timeout in the stats only.
+#
+# Hedging: with OLLAMA_HEDGE_HOST set, a call that hasn't returned after OLLAMA_HEDGE_AFTER_MS is
+# sent to the second endpoint as well and the first answer wins.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "30"))
+OLLAMA_BREAKER_FAILURES = int(os.environ.get("OLLAMA_BREAKER_FAILURES", "5"))
+OLLAMA_BREAKER_RESET_SECONDS = float(os.environ.get("OLLAMA_BREAKER_RESET_SECONDS", "30"))
+OLLAMA_HEDGE_HOST = os.environ.get("OLLAMA_HEDGE_HOST")
+OLLAMA_HEDGE_AFTER_MS = float(os.environ.get("OLLAMA_HEDGE_AFTER_MS", "2000"))
+
+DEADLINE_HEADER = b"x-request-timeout"
+DEADLINE_QUERY_PARAM = "timeout"
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class CircuitOpen(RuntimeError):
+    pass
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def budget(self, fraction: float, minimum: float = 0.0) -> float:
+        """
+        Share of the remaining time for one stage, so later stages still get some.
+        """
+        return max(minimum, self.remaining() * fraction)
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+def current_deadline() -> Deadline:
+    """
+    The deadline of the request being served, or a fresh default one outside a request.
+    """
+    return _deadline.get() or Deadline(REQUEST_DEADLINE_SECONDS)
+
+@contextmanager
+def deadline_scope(seconds: Optional[float] = None, independent: bool = False):
+    """
+    Sets the deadline for the code inside. A nested scope can only shorten the outer deadline,
+    unless it is independent: work that legitimately outlives the request's own deadline (a
+    long-running stream) gets a fresh one.
+    """
+    outer = None if independent else _deadline.get()
+    deadline = Deadline(seconds if seconds is not None else REQUEST_DEADLINE_SECONDS)
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def request_timeout(scope) -> Optional[float]:
+    """
+    Timeout in seconds asked for by an ASGI request (header, else query parameter), if any.
+    """
+    for key, value in scope.get("headers", []):
+        if key == DEADLINE_HEADER:
+            try:
+                return float(value.decode("latin-1"))
+            except ValueError:
+                return None
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get(DEADLINE_QUERY_PARAM)
+    try:
+        return float(values[0]) if values else None
+    except ValueError:
+        return None
+
+class DeadlineMiddleware:
+    def __init__(self, app, default_seconds: float = REQUEST_DEADLINE_SECONDS, max_seconds: float = 300):
+        self.app = app
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        seconds = min(request_timeout(scope) or self.default_seconds, self.max_seconds)
+        with deadline_scope(seconds):
+            await self.app(scope, receive, send)
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = OLLAMA_BREAKER_FAILURES,
+                 reset_seconds: float = OLLAMA_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go out now. While half open only one trial call is let through.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    logging.warning(f"Circuit {self.name} opened after {self.failures} failure(s)")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """
+        Ends a call that neither succeeded nor failed (cancelled, or cut off by the deadline), so a
+        half-open breaker can let its next trial call through.
+        """
+        with self._lock:
+            self._trial = False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "short_circuited": self.short_circuited}
+
+class LatencyStats:
+    """
+    Latency percentiles over the most recent calls, plus outcome counters.
+    """
+    def __init__(self, window: int = 2000):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.counts: Dict[str, int] = {}
+
+    def record(self, seconds: Optional[float] = None, **outcomes: bool):
+        with self._lock:
+            if seconds is not None:
+                self.latencies.append(seconds)
+            for outcome, happened in outcomes.items():
+                if happened:
+                    self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = list(self.latencies)
+            counts = dict(self.counts)
+        return dict(counts, samples=len(latencies),
+                    p50_ms=percentile(latencies, 50) * 1000, p95_ms=percentile(latencies, 95) * 1000,
+                    p99_ms=percentile(latencies, 99) * 1000)
+
+class ResilientOllama:
+    """
+    Chat calls with deadline, circuit breaker and optional hedging. chat(model, **options) and
+    hedge_chat(model, **options) return the LangChain chat clients for the primary and second endpoint.
+    """
+    def __init__(self, chat: Callable[..., object], hedge_chat: Optional[Callable[..., object]] = None,
+                 hedge_after: float = OLLAMA_HEDGE_AFTER_MS / 1000):
+        self.endpoints = [("primary", chat, CircuitBreaker("ollama"))]
+        if hedge_chat is not None:
+            self.endpoints.append(("hedge", hedge_chat, CircuitBreaker("ollama-hedge")))
+        self.hedge_after = hedge_after
+        self.stats = LatencyStats()
+
+    def _endpoints(self) -> Iterator[tuple]:
+        # Breakers are asked lazily, so a half-open endpoint only uses its trial call when it is called
+        for endpoint in self.endpoints:
+            if endpoint[2].allow():
+                yield endpoint
+
+    async def ainvoke(self, messages: List[Dict], model: Optional[str] = None, **options):
+        """
+        One completion within the current deadline. Raises DeadlineExceeded or CircuitOpen.
+        """
+        deadline = current_deadline()
+        if deadline.expired:
+            raise DeadlineExceeded("Deadline passed before the model call")
+        started = time.perf_counter()
+        candidates = self._endpoints()
+        running: Dict[asyncio.Task, tuple] = {}
+
+        def launch() -> bool:
+            endpoint = next(candidates, None)
+            if endpoint is None:
+                return False
+            name, chat, breaker = endpoint
+            running[asyncio.create_task(chat(model, **options).ainvoke(messages))] = (name, breaker)
+            return True
+
+        if not launch():
+            self.stats.record(short_circuited=True)
+            raise CircuitOpen("Ollama is unavailable (circuit open)")
+        spare, hedged, errors = len(self.endpoints) > 1, False, []
+        try:
+            while running:
+                # Until the second endpoint is tried, wake up at the hedge threshold
+                wait = deadline.remaining()
+                if spare:
+                    wait = min(wait, max(0.0, self.hedge_after - (time.perf_counter() - started)))
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name, breaker = running.pop(task)
+                    if task.exception() is None:
+                        breaker.record_success()
+                        self.stats.record(time.perf_counter() - started, calls=True, hedged=hedged,
+                                          hedge_wins=hedged and name != "primary")
+                        return task.result()
+                    breaker.record_failure()
+                    errors.append(f"{name}: {task.exception()}")
+                    logging.warning(f"Ollama call to {name} failed: {task.exception()}")
+                if deadline.expired:
+                    break
+                if spare and (not running or not done):
+                    # A failed call falls over to the other endpoint at once; a slow one is hedged
+                    spare, still_running = False, bool(running)
+                    hedged = launch() and still_running
+        finally:
+            for task, (_, breaker) in running.items():
+                task.cancel()
+                breaker.release()
+        if running:
+            # Running out of the caller's time is not the endpoint failing; only the stats count it
+            self.stats.record(time.perf_counter() - started, calls=True, timeouts=True, hedged=hedged)
+            raise DeadlineExceeded(f"No answer from Ollama within {deadline.seconds:.1f}s")
+        self.stats.record(time.perf_counter() - started, calls=True, failures=True, hedged=hedged)
+        raise RuntimeError("; ".join(errors))
+
+    async def astream(self, messages: List[Dict], model: Optional[str] = None, **options) -> AsyncIterator:
+        """
+        Streams a completion from the first available endpoint (streams are not hedged). Stops
+        quietly at the deadline; callers check current_deadline().expired to tell a partial
+        response from a complete one. Callers that stop reading early should close the stream
+        (contextlib.aclosing) so its breaker outcome is recorded straight away.
+        """
+        deadline = current_deadline()
+        endpoint = next(self._endpoints(), None)
+        if endpoint is None:
+            self.stats.record(short_circuited=True)
+            raise CircuitOpen("Ollama is unavailable (circuit open)")
+        _, chat, breaker = endpoint
+        started = time.perf_counter()
+        stream = chat(model, **options).astream(messages)
+        recorded = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=deadline.remaining())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    recorded = True
+                    breaker.release()
+                    self.stats.record(time.perf_counter() - started, calls=True, timeouts=True)
+                    return
+                yield chunk
+            recorded = True
+            breaker.record_success()
+            self.stats.record(time.perf_counter() - started, calls=True)
+        except GeneratorExit:
+            # The consumer stopped reading (break, aclose); the endpoint was answering fine
+            recorded = True
+            breaker.record_success()
+            self.stats.record(time.perf_counter() - started, calls=True)
+            raise
+        except Exception:
+            recorded = True
+            breaker.record_failure()
+            self.stats.record(time.perf_counter() - started, calls=True, failures=True)
+            raise
+        finally:
+            if not recorded:
+                # Cancelled mid-stream: neither outcome is known, but a half-open trial must end
+                breaker.release()
+            await stream.aclose()
+
+    async def guard(self, call: Callable[[], Awaitable]):
+        """
+        Runs a call to the primary endpoint that ainvoke can't make (a client with tools bound, say)
+        under its circuit breaker and the current deadline. Raises DeadlineExceeded or CircuitOpen.
+        """
+        _, _, breaker = self.endpoints[0]
+        if not breaker.allow():
+            self.stats.record(short_circuited=True)
+            raise CircuitOpen("Ollama is unavailable (circuit open)")
+        deadline = current_deadline()
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(call(), timeout=deadline.remaining())
+        except asyncio.TimeoutError:
+            breaker.release()
+            self.stats.record(time.perf_counter() - started, calls=True, timeouts=True)
+            raise DeadlineExceeded(f"No answer from Ollama within {deadline.seconds:.1f}s")
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure()
+            self.stats.record(time.perf_counter() - started, calls=True, failures=True)
+            raise
+        breaker.record_success()
+        self.stats.record(time.perf_counter() - started, calls=True)
+        return result
+
+    def snapshot(self) -> Dict:
+        return {
+            "latency": self.stats.snapshot(),
+            "endpoints": {name: breaker.snapshot() for name, _, breaker in self.endpoints},
+            "hedge_after_ms": self.hedge_after * 1000 if len(self.endpoints) > 1 else None,
+        }
+
+async def within_deadline(awaitable, fraction: float = 1.0, default=None):
+    """
+    Awaits a stage with a share of the remaining time; returns (result, partial). On timeout the
+    stage is cancelled and default is returned with partial=True.
+    """
+    try:
+        return await asyncio.wait_for(awaitable, timeout=current_deadline().budget(fraction)), False
+    except asyncio.TimeoutError:
+        return default, True
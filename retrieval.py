@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from langchain.schema import Document
+from embedding_cache import normalize_text
+
+logging.basicConfig(level=logging.INFO)
+
+# Token counting matches the tiktoken splitter used to build the chunks; falls back to a
+# four-characters-per-token estimate when tiktoken is not installed
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+def choose_k(scores: List[float], k_min: int = 1, k_max: int = 6, relative_cutoff: float = 0.85,
+             min_gap: float = 0.05) -> int:
+    """
+    Picks how many results to keep from relevance scores sorted best first: results scoring
+    below relative_cutoff of the best one are dropped, and the rest is cut at the largest drop
+    between neighbours when that drop is at least min_gap and steeper than the drop to the first
+    excluded result.
+    """
+    if not scores:
+        return 0
+    top = scores[0]
+    k = 1
+    while k < min(len(scores), k_max) and scores[k] >= top * relative_cutoff:
+        k += 1
+    if k > 1:
+        gaps = [scores[i] - scores[i + 1] for i in range(k - 1)]
+        largest = max(range(len(gaps)), key=gaps.__getitem__)
+        boundary = scores[k - 1] - scores[k] if k < len(scores) else 0.0
+        if gaps[largest] >= min_gap and gaps[largest] > boundary:
+            k = largest + 1
+    return max(min(k_min, len(scores)), k)
+
+def _overlap(left: str, right: str, min_overlap: int) -> int:
+    """
+    Length of the longest suffix of left that is also a prefix of right (0 if shorter than min_overlap).
+    """
+    probe = right[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+def pack_context(docs: List[Document], token_budget: int = 1500, min_overlap: int = 50) -> str:
+    """
+    Joins documents best first into at most token_budget tokens. Chunks from the splitter share
+    up to 200 tokens with their neighbours, so text already present in the context (duplicates,
+    or the overlap with an adjacent chunk of the same source) is dropped before counting.
+    """
+    parts: List[Tuple[Optional[str], str]] = []
+    used = 0
+    for doc in docs:
+        text = doc.page_content.strip()
+        source = doc.metadata.get("source")
+        for part_source, part in parts:
+            if part_source != source or not text:
+                continue
+            if text in part:
+                text = ""
+            elif part in text:
+                # A previously packed chunk is contained in this one; keep only the new text around it
+                before, _, after = text.partition(part)
+                text = (before.strip() + "\n" + after.strip()).strip()
+            else:
+                # Overlap with the chunk before or after this one in the source document
+                tail = _overlap(part, text, min_overlap)
+                if tail:
+                    text = text[tail:].strip()
+                else:
+                    head = _overlap(text, part, min_overlap)
+                    if head:
+                        text = text[:len(text) - head].strip()
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            text = truncate_tokens(text, token_budget - used)
+            if text:
+                parts.append((source, text))
+            break
+        parts.append((source, text))
+        used += tokens
+    return "\n\n".join(part for _, part in parts)
+
+# Relevance-scored search with a per-query k and a results cache tied to the index version
+class AdaptiveRetriever:
+    def __init__(self, search: Callable[[str, int], List[Tuple[Document, float]]],
+                 index_version: Callable[[], str], candidates: int = 8, k_min: int = 1, k_max: int = 6,
+                 relative_cutoff: float = 0.85, min_gap: float = 0.05, cache_size: int = 256):
+        """
+        search(query, k) returns (document, relevance) pairs best first, higher meaning more relevant,
+        e.g. a vector store's similarity_search_with_relevance_scores. index_version() must change
+        whenever the underlying index is rebuilt.
+        """
+        self.search = search
+        self.index_version = index_version
+        self.candidates = candidates
+        self.k_min = k_min
+        self.k_max = k_max
+        self.relative_cutoff = relative_cutoff
+        self.min_gap = min_gap
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def similarity_search_with_score(self, query: str) -> List[Tuple[Document, float]]:
+        version = self.index_version()
+        key = normalize_text(query).lower()
+        with self._lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(cached)
+            self.misses += 1
+        results = self.search(query, self.candidates)
+        results = sorted(results, key=lambda pair: pair[1], reverse=True)
+        k = choose_k([score for _, score in results], self.k_min, self.k_max, self.relative_cutoff, self.min_gap)
+        results = results[:k]
+        with self._lock:
+            # Results computed against an index that has since been replaced are not cached
+            if version == self._cache_version:
+                self._cache[key] = results
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def invoke(self, query: str) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._cache),
+                "index_version": self._cache_version,
+            }
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+# Directory shared by all worker processes on this machine
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", "shared_state")
+
+# Cross-process lock on a file (fcntl on POSIX, msvcrt on Windows)
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._thread_lock = threading.Lock()
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+        finally:
+            self._file = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+# Run a build step once per machine: the first process builds, the others wait and reuse the result
+def run_once(name: str, fingerprint: str, build: Callable[[], Any], directory: str = SHARED_STATE_DIR) -> bool:
+    """
+    build() must write its output somewhere under directory. The step is re-run when fingerprint
+    changes (e.g. the list of source URLs). Returns True when this process did the build.
+    """
+    os.makedirs(directory, exist_ok=True)
+    marker_path = os.path.join(directory, f"{name}.done")
+    with FileLock(os.path.join(directory, f"{name}.lock")):
+        if os.path.exists(marker_path):
+            with open(marker_path, "r", encoding="utf-8") as f:
+                if f.read() == fingerprint:
+                    logging.info(f"Shared build '{name}' is up to date; reusing it.")
+                    return False
+        logging.info(f"Running shared build '{name}' in process {os.getpid()}.")
+        build()
+        with open(marker_path, "w", encoding="utf-8") as f:
+            f.write(fingerprint)
+        return True
+
+# Key/value store with expiry shared by all workers, backed by SQLite in WAL mode
+class SharedStore:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(SHARED_STATE_DIR, "shared_store.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections are not shared between threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return default
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires_at)
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: str):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def purge_expired(self) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+# Process-wide store instance
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_shared_store() -> SharedStore:
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = SharedStore()
+        return _shared_store
@@ -0,0 +1,280 @@
+import json
+import logging
+import uuid
+from typing import Dict, List, Optional
+
+from diagram_graph import DiagramGraph
+from tools import clamp_to_canvas, expand_bulk_action, normalize_color, validate_action, validate_actions
+
+logging.basicConfig(level=logging.INFO)
+
+# Speculative execution of Action Agent output. While the model is still streaming, every action
+# that has been fully parsed is checked (schema, canvas bounds, referenced shapes) and sent to the
+# client as a provisional command with an id. When the whole response has been parsed and validated
+# the client gets a commit for those ids, otherwise a rollback.
+#
+#   {"type": "provisional", "command_id": c, "id": "c.0", "action": {...}}
+#   {"type": "commit", "command_id": c, "ids": ["c.0", ...]}
+#   {"type": "rollback", "command_id": c, "ids": ["c.0", ...], "problems": [...]}
+
+DEFAULT_SIZE = 20
+
+# Finds complete top-level actions in streamed JSON: the elements of a top-level array, or a
+# top-level object once it closes
+class IncrementalActionParser:
+    def __init__(self):
+        self.buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._root = None
+        self._element_start = None
+
+    def feed(self, text: str) -> List[Dict]:
+        self.buffer += text
+        actions = []
+        while self._position < len(self.buffer):
+            char = self.buffer[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                if self._depth == 0 and self._root is None:
+                    self._root = char
+                if char == "{" and (self._depth == 0 and self._root == "{" or self._depth == 1 and self._root == "["):
+                    self._element_start = self._position
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if char == "}" and self._element_start is not None and \
+                   (self._depth == 0 and self._root == "{" or self._depth == 1 and self._root == "["):
+                    element = self.buffer[self._element_start:self._position + 1]
+                    self._element_start = None
+                    try:
+                        actions.append(json.loads(element))
+                    except json.JSONDecodeError:
+                        actions.append(None)
+            self._position += 1
+        return actions
+
+# Shapes known to be on a session's canvas: reported by the client or created by committed actions.
+# Connections between them are indexed in a DiagramGraph for structural queries.
+class CanvasState:
+    def __init__(self, shapes: Optional[List[Dict]] = None, synced: bool = False, connections: Optional[List[Dict]] = None):
+        """
+        shapes use the command_parser known_shapes format (name, shape, color, x, y). synced is True
+        once the client has reported its canvas, after which unknown references are rejected.
+        connections are {"from": name, "to": name} pairs.
+        """
+        self.shapes = list(shapes or [])
+        self.synced = synced
+        self.graph = DiagramGraph(self.shapes, connections)
+
+    @property
+    def connections(self) -> List[Dict]:
+        return self.graph.edges()
+
+    def to_dict(self) -> Dict:
+        return {"shapes": self.shapes, "synced": self.synced, "connections": self.connections}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "CanvasState":
+        data = data or {}
+        return cls(data.get("shapes"), data.get("synced", False), data.get("connections"))
+
+    def matches(self, reference) -> List[Dict]:
+        """
+        Shapes matching a reference: a name or description string ("A", "red circle") or a dict of fields.
+        """
+        if isinstance(reference, str):
+            words = {normalize_color(word) for word in reference.split()}
+            return [
+                shape for shape in self.shapes
+                if str(shape.get("name", "")).lower() == reference.lower()
+                or words and words <= {normalize_color(shape.get("color", "")), str(shape.get("shape", "")).lower()}
+            ]
+        return [shape for shape in self.shapes if all(shape.get(key) == value for key, value in reference.items())]
+
+    def _endpoint(self, reference) -> Optional[str]:
+        matched = self.matches(reference) if reference else []
+        if matched:
+            return matched[-1].get("name")
+        if not isinstance(reference, str):
+            return None
+        # Looser matching for names the client abbreviates ("pump" for "Pump P-101")
+        resolved = self.graph.resolve(reference)
+        return resolved[0] if len(resolved) == 1 else reference
+
+    def apply(self, action_id: str, action: Dict):
+        kind = action.get("action")
+        if kind == "create_shape":
+            self.shapes.append({key: action[key] for key in ("shape", "color", "x", "y") if key in action})
+            self.shapes[-1]["name"] = action.get("name") or action_id
+            self.graph.add_shape(self.shapes[-1])
+        elif kind == "connect_shapes":
+            source = self._endpoint(action.get("from") or action.get("shape1"))
+            target = self._endpoint(action.get("to") or action.get("shape2"))
+            if source and target:
+                self.graph.connect(source, target)
+        elif kind in ("delete_shape", "modify_shape"):
+            matched = self.matches(_target_reference(action))
+            if kind == "delete_shape":
+                self.shapes = [shape for shape in self.shapes if not any(shape is m for m in matched)]
+                for shape in matched:
+                    self.graph.remove_shape(shape.get("name"))
+            elif "color" in action:
+                for shape in matched:
+                    shape["color"] = action["color"]
+
+def _target_reference(action: Dict) -> Dict:
+    reference = {"shape": action["shape"]} if "shape" in action else {}
+    if action.get("name"):
+        reference["name"] = action["name"]
+    color = action.get("current_color") if action.get("action") == "modify_shape" else action.get("color")
+    if color:
+        reference["color"] = color
+    return reference
+
+def _references(action: Dict) -> List:
+    kind = action.get("action")
+    if kind == "connect_shapes":
+        return [action.get("from") or action.get("shape1"), action.get("to") or action.get("shape2")]
+    if kind in ("delete_shape", "modify_shape"):
+        return [_target_reference(action)]
+    return []
+
+def check_action(action: Dict, canvas: CanvasState, pending: List[Dict]):
+    """
+    Returns (action to send, problems, unverified references). create_shape sizes must fit the
+    canvas and positions are clamped into it as tools.create_shape does; references must match a shape on the canvas or one
+    created earlier in the same response.
+    """
+    problems = validate_action(action)
+    if problems:
+        return action, problems, []
+    action = dict(action)
+    if action.get("action") == "create_shape":
+        default = action["radius"] * 2 if "radius" in action else DEFAULT_SIZE
+        width, height = action.get("width", default), action.get("height", default)
+        if not 0 < width <= 100 or not 0 < height <= 100:
+            return action, [f"Shape size {width}x{height} does not fit on the canvas."], []
+        # A missing coordinate defaults to the middle of the canvas, as in command_parser
+        action["x"], action["y"] = clamp_to_canvas(action.get("x", 50), action.get("y", 50), width, height)
+    unverified = []
+    candidates = CanvasState(canvas.shapes + pending, canvas.synced)
+    for reference in _references(action):
+        if not reference or candidates.matches(reference):
+            continue
+        if canvas.synced:
+            problems.append(f"Referenced shape {reference} is not on the canvas.")
+        else:
+            unverified.append(reference)
+    return action, problems, unverified
+
+class SpeculativeExecutor:
+    def __init__(self, canvas: CanvasState, command_id: Optional[str] = None):
+        self.canvas = canvas
+        self.command_id = command_id or uuid.uuid4().hex[:12]
+        self.parser = IncrementalActionParser()
+        self.provisional: List[tuple] = []  # (id, action)
+        self.problems: List[str] = []
+        self.done = False
+
+    def rollback(self, problems: List[str]) -> Dict:
+        self.done = True
+        self.problems = problems
+        logging.info(f"Rolling back command {self.command_id}: {problems}")
+        return {"type": "rollback", "command_id": self.command_id,
+                "ids": [action_id for action_id, _ in self.provisional], "problems": problems}
+
+    def _admit(self, action) -> List[Dict]:
+        if action is None:
+            return [self.rollback(["Action is not valid JSON."])]
+        problems = validate_action(action)
+        if problems:
+            return [self.rollback(problems)]
+        # Bulk actions are expanded so each shape gets its own provisional id
+        actions = expand_bulk_action(action) if action.get("action") == "create_shapes_bulk" else [action]
+        events = []
+        for item in actions:
+            pending = [{"name": a.get("name") or item_id, **{k: v for k, v in a.items() if k in ("shape", "color")}}
+                       for item_id, a in self.provisional if a.get("action") == "create_shape"]
+            checked, problems, unverified = check_action(item, self.canvas, pending)
+            if problems:
+                return events + [self.rollback(problems)]
+            action_id = f"{self.command_id}.{len(self.provisional)}"
+            self.provisional.append((action_id, checked))
+            event = {"type": "provisional", "command_id": self.command_id, "id": action_id, "action": checked}
+            if unverified:
+                event["unverified"] = unverified
+            events.append(event)
+        return events
+
+    def feed(self, text: str) -> List[Dict]:
+        """
+        Consumes streamed model output; returns the events to send now.
+        """
+        if self.done:
+            return []
+        events = []
+        for action in self.parser.feed(text):
+            events.extend(self._admit(action))
+            if self.done:
+                break
+        return events
+
+    def admit_all(self, actions: List[Dict]) -> List[Dict]:
+        """
+        Sends already parsed actions (e.g. from the deterministic fast path) and commits them.
+        """
+        events = []
+        for action in actions:
+            events.extend(self._admit(action))
+            if self.done:
+                return events
+        return events + self._commit()
+
+    def finish(self) -> List[Dict]:
+        """
+        Validates the complete response; returns the remaining events ending with commit or rollback.
+        """
+        if self.done:
+            return []
+        try:
+            response = json.loads(self.parser.buffer)
+        except json.JSONDecodeError as e:
+            return [self.rollback([f"Response is not valid JSON: {e}"])]
+        problems = validate_actions(response)
+        if problems:
+            return [self.rollback(problems)]
+        return self._commit()
+
+    def commit_partial(self, reason: str) -> List[Dict]:
+        """
+        Commits the actions admitted so far when the response was cut short, e.g. by the request
+        deadline; the commit is marked partial. Rolls back when nothing was admitted.
+        """
+        if self.done:
+            return []
+        if not self.provisional:
+            return [self.rollback([reason])]
+        return [dict(event, partial=True, reason=reason) for event in self._commit()]
+
+    def _commit(self) -> List[Dict]:
+        self.done = True
+        if not self.provisional:
+            return [self.rollback(["Response contained no actions."])]
+        for action_id, action in self.provisional:
+            self.canvas.apply(action_id, action)
+        return [{"type": "commit", "command_id": self.command_id, "ids": [action_id for action_id, _ in self.provisional]}]
+
+    @property
+    def actions(self) -> List[Dict]:
+        return [action for _, action in self.provisional]
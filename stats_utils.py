@@ -0,0 +1,15 @@
+import math
+from typing import List
+
+# Small statistics helpers shared by the latency tracking in the service and the benchmark scripts.
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    Nearest-rank percentile (0-100) of values; 0.0 when there are none.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # The smallest value with at least rank percent of the values at or below it
+    index = min(len(ordered) - 1, max(0, math.ceil(rank / 100.0 * len(ordered)) - 1))
+    return ordered[index]
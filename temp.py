@@ -9,13 +9,17 @@ from langchain_community.vectorstores import SKLearnVectorStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_nomic.embeddings import NomicEmbeddings
 from typing import Dict, List, Union
+from ollama_cassette import cassette_client_kwargs
+from command_parser import parse_command
+from tools import expand_bulk_actions
+from retrieval import AdaptiveRetriever, pack_context
 
 logging.basicConfig(level=logging.INFO)
 
 # Initialize LLM
 local_llm = "llama3.2:3b-instruct-fp16"
-llm = ChatOllama(model=local_llm, temperature=0)
-llm_json_mode = ChatOllama(model=local_llm, temperature=0, format="json")
+llm = ChatOllama(model=local_llm, temperature=0, client_kwargs=cassette_client_kwargs())
+llm_json_mode = ChatOllama(model=local_llm, temperature=0, format="json", client_kwargs=cassette_client_kwargs())
 
 # Load Documents from URLs (Placeholder for future RAG integration)
 urls = [
@@ -39,7 +43,8 @@ try:
         documents=doc_splits,
         embedding=NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local"),
     )
-    retriever = vectorstore.as_retriever(k=3)
+    # The vector store is built once per process, so its version never changes
+    retriever = AdaptiveRetriever(vectorstore.similarity_search_with_relevance_scores, index_version=lambda: "static")
     HARD_CODED_DOCUMENT = loaded_docs[0].page_content if loaded_docs else "Default hardcoded content for testing."
 except Exception as e:
     logging.error(f"Failed to load documents from URLs: {e}")
@@ -84,6 +89,10 @@ class VisioAgent:
         }
 
     def parse_user_message(self, user_message: str) -> Union[Dict, List[Dict]]:
+        # Fully specified commands skip the LLM entirely
+        actions = parse_command(user_message)
+        if actions is not None:
+            return [self._from_action_schema(action) for action in expand_bulk_actions(actions)]
         prompt = f'''
 You are an AI assistant that interprets user requests to perform actions on a canvas.
 
@@ -106,11 +115,19 @@ AI Response:
         logging.info(f"VisioAgent AI Response: {full_response}")
         try:
             command_data = json.loads(full_response)
-            return command_data
+            return expand_bulk_actions(command_data)
         except json.JSONDecodeError:
             logging.error(f"Failed to parse AI response as JSON: {full_response}")
             return {"error": "Invalid JSON response from AI"}
 
+    def _from_action_schema(self, action: Dict) -> Dict:
+        # The parser emits the Action Agent schema; map modifications onto modify_properties
+        if action["action"] != "modify_shape":
+            return action
+        changes = {k: v for k, v in action.items() if k not in ("action", "shape", "current_color")}
+        property_name, value = next(iter(changes.items())) if len(changes) == 1 else ("properties", changes)
+        return {"action": "modify_properties", "shape": action["shape"], "property": property_name, "value": value}
+
     def execute_action(self, command_data: Union[Dict, List[Dict]]) -> Union[str, List[str]]:
         if isinstance(command_data, list):
             return [self._execute_single_action(cmd) for cmd in command_data]
@@ -154,7 +171,7 @@ AI Response:
             return json.dumps(execution_result, indent=2)
         elif route == "retrieval":
             retrieved_docs = retriever.invoke(user_message)
-            context = "\n\n".join(doc.page_content for doc in retrieved_docs)
+            context = pack_context(retrieved_docs)
             rag_prompt = f"""
 You are an assistant for question-answering tasks.
 
@@ -7,13 +7,14 @@ from langchain_community.vectorstores import SKLearnVectorStore
 from langchain_nomic.embeddings import NomicEmbeddings
 from langchain.schema import Document
 from typing import List
+from ollama_cassette import cassette_client_kwargs
 
 logging.basicConfig(level=logging.INFO)
 
 # Initialize LLM
 local_llm = "llama3.2:3b-instruct-fp16"
-llm = ChatOllama(model=local_llm, temperature=0)
-llm_json_mode = ChatOllama(model=local_llm, temperature=0, format="json")
+llm = ChatOllama(model=local_llm, temperature=0, client_kwargs=cassette_client_kwargs())
+llm_json_mode = ChatOllama(model=local_llm, temperature=0, format="json", client_kwargs=cassette_client_kwargs())
 
 # Load Documents from URLs
 urls = [
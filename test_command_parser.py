@@ -0,0 +1,30 @@
+from command_parser import parse_command
+
+def test_square_with_two_different_sides_goes_to_the_model():
+    assert parse_command("create a red square 10x20 at 30,30") is None
+    assert parse_command("create a square size 10 width 20") is None
+
+def test_square_with_one_side_is_square():
+    [action] = parse_command("create a square width 12")
+
+    assert (action["width"], action["height"]) == (12, 12)
+
+def test_circle_with_equal_sides_gets_radius():
+    [action] = parse_command("create a circle 8x8")
+
+    assert action["radius"] == 4
+
+CANVAS = [
+    {"name": "A", "shape": "circle", "color": "red", "x": 20, "y": 20},
+    {"name": "B", "shape": "square", "color": "blue", "x": 60, "y": 20},
+]
+
+def test_references_are_checked_against_the_canvas():
+    assert parse_command("make the red circle green", known_shapes=CANVAS)[0]["color"] == "green"
+    assert parse_command("make the green circle blue", known_shapes=CANVAS) is None
+    assert parse_command("connect A to B", known_shapes=CANVAS) is not None
+    assert parse_command("connect A to C", known_shapes=CANVAS) is None
+    assert parse_command("delete the blue triangle", known_shapes=CANVAS) is None
+
+def test_references_are_not_checked_without_a_canvas():
+    assert parse_command("connect A to C") is not None
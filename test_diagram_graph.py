@@ -0,0 +1,45 @@
+from diagram_graph import DiagramGraph, answer_structural_query
+
+def _graph():
+    shapes = [{"name": name, "shape": "rectangle", "color": "blue"} for name in ("pump", "valve", "tank")]
+    return DiagramGraph(shapes, [{"from": "pump", "to": "valve"}, {"from": "valve", "to": "tank"}])
+
+def test_recolor_downstream_with_color_name():
+    result = answer_structural_query("make everything downstream of the pump red", _graph())
+
+    assert result["query"] == "modify"
+    assert result["shapes"] == ["valve", "tank"]
+    assert {action["color"] for action in result["actions"]} == {"red"}
+
+def test_recolor_with_hex_code():
+    result = answer_structural_query("color everything downstream of pump #FF8800", _graph())
+
+    assert {action["color"] for action in result["actions"]} == {"#ff8800"}
+
+def test_modify_with_unknown_word_falls_back_to_model():
+    assert answer_structural_query("make everything downstream of the pump bigger", _graph()) is None
+    assert answer_structural_query("make everything downstream of the pump #12", _graph()) is None
+
+def _lettered():
+    shapes = [{"name": name, "shape": "circle", "color": "red"} for name in ("A", "B", "C")]
+    return DiagramGraph(shapes, [{"from": "A", "to": "B"}, {"from": "B", "to": "C"}])
+
+def test_resolve_shape_named_like_an_article():
+    graph = _lettered()
+
+    assert graph.resolve("A") == ["A"]
+    assert graph.resolve("the A") == ["A"]
+
+def test_structural_query_on_single_letter_names():
+    graph = _lettered()
+
+    assert answer_structural_query("what is connected to A", graph)["shapes"] == ["B"]
+    assert answer_structural_query("delete everything downstream of A", graph)["shapes"] == ["B", "C"]
+
+def test_resolve_description_against_hex_colors():
+    # shapes read back from a .vsdx carry their fill as a hex code
+    graph = DiagramGraph([{"name": "Sheet.1", "shape": "circle", "color": "#FF0000"},
+                          {"name": "Sheet.2", "shape": "circle", "color": "#0000FF"}])
+
+    assert graph.resolve("the red circle") == ["Sheet.1"]
+    assert graph.resolve("blue circle") == ["Sheet.2"]
@@ -0,0 +1,30 @@
+from document_pipeline import split_document
+
+def test_list_without_sentence_punctuation_is_not_truncated():
+    lines = [f"- Pump P-{i} discharges to tank T-{i} via valve V-{i}" for i in range(200)]
+    text = "\n".join(lines)
+    assert len(text) > 10000
+
+    chunks = split_document(text, chunk_chars=3000)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 3000 for chunk in chunks)
+    combined = "\n".join(chunks).splitlines()
+    assert all(line in combined for line in lines)
+
+def test_unbroken_text_is_split_into_consecutive_windows():
+    text = "x" * 7000
+
+    chunks = split_document(text, chunk_chars=3000)
+
+    assert all(len(chunk) <= 3000 for chunk in chunks)
+    assert "".join(chunks) == text
+
+def test_paragraphs_pack_with_overlap():
+    paragraphs = [f"Paragraph {i} feeds paragraph {i + 1}." for i in range(50)]
+
+    chunks = split_document("\n\n".join(paragraphs), chunk_chars=200)
+
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(any(p in chunk for chunk in chunks) for p in paragraphs)
+    assert chunks[1].startswith(chunks[0].split("\n\n")[-1])
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, ResilientOllama, deadline_scope, within_deadline
+
+class FakeChat:
+    """
+    Stands in for ChatOllama: replies after delay seconds, or raises error.
+    """
+    def __init__(self, reply="ok", delay=0.0, error=None):
+        self.reply = reply
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, model=None, **options):
+        return self
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.reply
+
+    async def astream(self, messages):
+        self.calls += 1
+        for chunk in self.reply.split():
+            await asyncio.sleep(self.delay)
+            if self.error:
+                raise self.error
+            yield chunk
+
+def _half_open(ollama):
+    breaker = ollama.endpoints[0][2]
+    breaker.failures, breaker.opened_at = breaker.failure_threshold, time.monotonic() - breaker.reset_seconds
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures():
+    chat = FakeChat(error=ConnectionError("refused"))
+    ollama = ResilientOllama(chat)
+
+    async def run():
+        for _ in range(ollama.endpoints[0][2].failure_threshold):
+            with pytest.raises(RuntimeError):
+                await ollama.ainvoke([])
+        with pytest.raises(CircuitOpen):
+            await ollama.ainvoke([])
+
+    asyncio.run(run())
+    assert chat.calls == ollama.endpoints[0][2].failure_threshold
+    assert ollama.snapshot()["endpoints"]["primary"]["state"] == "open"
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_deadline_is_not_a_failure():
+    ollama = ResilientOllama(FakeChat(delay=1))
+
+    async def run():
+        with deadline_scope(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await ollama.ainvoke([])
+
+    asyncio.run(run())
+    assert ollama.endpoints[0][2].failures == 0
+    assert ollama.stats.counts["timeouts"] == 1
+
+def test_stream_trial_stopped_early_closes_the_breaker():
+    ollama = ResilientOllama(FakeChat(reply="one two three"))
+    breaker = _half_open(ollama)
+
+    async def run():
+        async with aclosing(ollama.astream([])) as stream:
+            async for _ in stream:
+                break
+        return await ollama.ainvoke([])
+
+    assert asyncio.run(run()) == "one two three"
+    assert breaker.state == "closed"
+
+def test_cancelled_stream_trial_releases_the_breaker():
+    ollama = ResilientOllama(FakeChat(reply="one two three", delay=1))
+    breaker = _half_open(ollama)
+
+    async def consume():
+        async for _ in ollama.astream([]):
+            pass
+
+    async def run():
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+def test_guard_records_call_outcomes():
+    ollama = ResilientOllama(FakeChat())
+    breaker = ollama.endpoints[0][2]
+
+    async def fail():
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(ollama.guard(fail))
+    assert breaker.failures == 1
+    assert asyncio.run(ollama.guard(lambda: asyncio.sleep(0, result="done"))) == "done"
+    assert breaker.failures == 0
+
+def test_within_deadline_returns_default_when_the_stage_runs_out_of_time():
+    async def run():
+        with deadline_scope(1):
+            fast = await within_deadline(asyncio.sleep(0, result="fast"), 0.5)
+            slow = await within_deadline(asyncio.sleep(1, result="slow"), 0.05, default=[])
+        return fast, slow
+
+    assert asyncio.run(run()) == (("fast", False), ([], True))
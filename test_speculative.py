@@ -0,0 +1,18 @@
+from speculative import CanvasState, check_action
+
+def test_oversized_shape_is_rejected_without_a_position():
+    action, problems, _ = check_action({"action": "create_shape", "shape": "circle", "radius": 200}, CanvasState(), [])
+
+    assert problems == ["Shape size 400x400 does not fit on the canvas."]
+
+def test_missing_position_defaults_to_the_centre_before_clamping():
+    action, problems, _ = check_action({"action": "create_shape", "shape": "square", "x": 98, "width": 10},
+                                       CanvasState(), [])
+
+    assert not problems
+    assert (action["x"], action["y"]) == (95, 50)
+
+def test_description_matches_hex_colored_shapes():
+    canvas = CanvasState([{"name": "Sheet.1", "shape": "circle", "color": "#FF0000"}], synced=True)
+
+    assert [shape["name"] for shape in canvas.matches("red circle")] == ["Sheet.1"]
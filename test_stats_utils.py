@@ -0,0 +1,14 @@
+from stats_utils import percentile
+
+def test_nearest_rank():
+    values = list(range(1, 11))
+
+    assert percentile(values, 50) == 5
+    assert percentile(values, 95) == 10
+    assert percentile(values, 0) == 1
+    assert percentile(values, 100) == 10
+
+def test_tail_of_a_small_sample_is_its_maximum():
+    assert percentile([0.1, 0.2, 0.3, 5.0], 99) == 5.0
+    assert percentile([0.3, 0.1, 0.2, 5.0], 50) == 0.2
+    assert percentile([], 99) == 0.0
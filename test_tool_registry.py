@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from tool_registry import ToolRegistry, call_dependencies, tool_schema, visio_tools
+
+def _call(tool, call_id, **args):
+    return {"name": tool, "id": call_id, "args": args}
+
+def test_connect_waits_for_the_shapes_it_names():
+    calls = [
+        _call("create_shape", "a", shape_type="circle", x=20, y=20, width=10, height=10, name="A"),
+        _call("create_shape", "b", shape_type="square", x=60, y=20, width=10, height=10, color="red"),
+        _call("connect_shapes", "c", shape1="A", shape2="red square"),
+        _call("modify_shape_properties", "d", shape="A", property_name="color", value="blue"),
+        _call("modify_shape_properties", "e", shape="A", property_name="width", value="20"),
+    ]
+
+    assert call_dependencies(calls) == [set(), set(), {0, 1}, {0}, {0, 3}]
+
+def test_execute_runs_independent_calls_in_one_wave():
+    calls = [
+        _call("create_shape", "a", shape_type="circle", x=20, y=20, width=10, height=10, name="A"),
+        _call("create_shape", "b", shape_type="circle", x=60, y=20, width=10, height=10, name="B"),
+        _call("connect_shapes", "c", shape1="A", shape2="B"),
+    ]
+
+    execution = asyncio.run(visio_tools.execute(calls))
+
+    assert execution["waves"] == [["a", "b"], ["c"]]
+    assert [result["status"] for result in execution["results"]] == ["success"] * 3
+
+def test_execute_overlaps_blocking_tools():
+    registry = ToolRegistry()
+
+    def slow(name: str):
+        """Takes a while."""
+        time.sleep(0.2)
+        return {"status": "success", "name": name}
+
+    registry.register(slow)
+    started = time.perf_counter()
+    execution = asyncio.run(registry.execute([_call("slow", str(i), name=str(i)) for i in range(4)]))
+
+    assert len(execution["waves"]) == 1
+    assert time.perf_counter() - started < 0.6
+
+def test_failed_call_fails_the_calls_depending_on_it():
+    calls = [
+        _call("create_shape", "a", shape_type="circle", x="left", y=20, width=10, height=10, name="A"),
+        _call("connect_shapes", "b", shape1="A", shape2="B"),
+        _call("create_shape", "c", shape_type="square", x=60, y=20, width=10, height=10, name="C"),
+    ]
+
+    results = asyncio.run(visio_tools.execute(calls))["results"]
+
+    assert [result["status"] for result in results] == ["error", "error", "success"]
+    assert results[1]["error"] == "Depends on failed call a"
+
+def test_unknown_tool_and_arguments_are_errors():
+    calls = [_call("rotate_shape", "a", shape="A"), _call("connect_shapes", "b", shape1="A", shape2="B", colour="red")]
+
+    results = asyncio.run(visio_tools.execute(calls))["results"]
+
+    assert results[0]["error"] == "Unknown tool 'rotate_shape'"
+    assert results[1]["error"] == "Tool 'connect_shapes' got unknown arguments ['colour']"
+
+def test_schema_from_signature():
+    parameters = tool_schema(visio_tools.functions["connect_shapes"])["function"]["parameters"]
+
+    assert parameters["required"] == ["shape1", "shape2"]
+    assert parameters["properties"]["connection_type"] == {"type": "string", "enum": ["line", "arrow"], "default": "line"}
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+from workflow_engine import WorkflowEngine, WorkflowError
+
+def _engine(replies, shape_requests=None):
+    """
+    Engine over the shipped workflows: the model answers with replies in turn, and the shape
+    command route the service implements records its requests.
+    """
+    replies = iter(replies)
+    shape_requests = [] if shape_requests is None else shape_requests
+
+    async def llm(model, prompt):
+        return next(replies)
+
+    async def execute_shape_command(body):
+        shape_requests.append(body)
+        return {"status": "success"}
+
+    return WorkflowEngine.from_files(llm=llm, local_routes={"execute-shape-command": execute_shape_command})
+
+def _statuses(run):
+    return {timing["node"]: timing["status"] for timing in run.timings}
+
+def test_shipped_workflows_load_without_unsupported_nodes():
+    engine = _engine([])
+
+    assert {w["name"]: w["unsupported"] for w in engine.describe()} == {
+        "VisioCommandProcessorWorkflow": [], "VisioChat_Agents": [], "OngoingAgent": []}
+    assert set(engine.routes) == {"process-visio-command", "chat-agent"}
+
+def test_command_processor_takes_only_the_matching_branch():
+    requests = []
+    engine = _engine([], requests)
+
+    run = asyncio.run(engine.run_webhook("process-visio-command", {"command": "DeleteShape", "parameters": {"name": "A"}}))
+
+    assert run.result() == {"status": "success"}
+    assert requests == [{"command": "DeleteShape", "parameters": {"name": "A"}}]
+    statuses = _statuses(run)
+    assert statuses["HTTP Request DeleteShape"] == "ok"
+    assert statuses["HTTP Request CreateShape"] == statuses["HTTP Request ConnectShapes"] == "skipped"
+
+def test_chat_agent_answers_manager_replies():
+    engine = _engine([json.dumps({"route": "manager", "reply": "Hello"})])
+
+    run = asyncio.run(engine.run_webhook("chat-agent", {"message": "hi"}))
+
+    assert run.result() == {"message": "Hello"}
+    assert _statuses(run)["action_agent1"] == "skipped"
+
+def test_chat_agent_hands_actions_to_the_action_agent():
+    actions = [{"action": "create_shape", "shape": "circle", "x": 50, "y": 50}]
+    engine = _engine([json.dumps({"route": "action_agent", "reply": ""}), json.dumps(actions)])
+
+    run = asyncio.run(engine.run_webhook("chat-agent", {"message": "draw a circle"}))
+
+    assert run.result() == actions
+    assert _statuses(run)["Respond chat_from_manager1"] == "skipped"
+
+def test_inactive_workflow_runs_from_its_trigger():
+    engine = _engine([json.dumps({"route": "manager", "reply": "Hello"})])
+    workflow = engine.workflows["OngoingAgent"]
+
+    run = asyncio.run(engine.run(workflow, "Chat_Visio", {"headers": {}, "params": {}, "query": {}, "body": {"message": "hi"}}))
+
+    assert run.result() == "Hello"
+    assert [timing["node"] for timing in run.report()["nodes"]][:3] == ["Chat_Visio", "Code2", "Merge Chat_Visio and Chat"]
+
+def test_failing_node_raises_with_the_partial_run():
+    engine = _engine(["not json"])
+
+    with pytest.raises(WorkflowError) as error:
+        asyncio.run(engine.run_webhook("chat-agent", {"message": "hi"}))
+
+    statuses = _statuses(error.value.run)
+    assert statuses["Chat LLM Chain"] == "ok"
+    assert statuses["Code1"] == "error"
+    assert statuses["Switch1"] == "skipped"
@@ -0,0 +1,233 @@
+import asyncio
+import inspect
+import logging
+import time
+import typing
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from speculative import CanvasState
+from tools import NUMERIC_FIELDS, SHAPE_TYPES, create_shape, connect_shapes, modify_shape_properties
+
+logging.basicConfig(level=logging.INFO)
+
+# Exposes the functions in tools.py to the model through Ollama's tool-calling API. Schemas are
+# generated from the function signatures (annotations, defaults, docstrings). All tool calls of one
+# model turn are executed together: calls that don't depend on each other run concurrently, and a
+# call that refers to a shape created in the same turn (connect after create) waits for it.
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+
+def _parameter_schema(annotation) -> Dict:
+    if typing.get_origin(annotation) is typing.Literal:
+        values = list(typing.get_args(annotation))
+        return {"type": _JSON_TYPES.get(type(values[0]), "string"), "enum": values}
+    if typing.get_origin(annotation) is typing.Union:
+        # Optional[X] is described as X
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    return {"type": _JSON_TYPES.get(annotation, "string")}
+
+def tool_schema(func: Callable, name: Optional[str] = None, description: Optional[str] = None) -> Dict:
+    """
+    Ollama / OpenAI function schema for a Python function. Parameters without a default are required.
+    """
+    hints = typing.get_type_hints(func)
+    properties, required = {}, []
+    for parameter in inspect.signature(func).parameters.values():
+        schema = _parameter_schema(hints.get(parameter.name, str))
+        if parameter.default is inspect.Parameter.empty:
+            required.append(parameter.name)
+        elif parameter.default is not None:
+            schema["default"] = parameter.default
+        properties[parameter.name] = schema
+    return {
+        "type": "function",
+        "function": {
+            "name": name or func.__name__,
+            "description": description or " ".join((inspect.getdoc(func) or "").split()),
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+class ToolRegistry:
+    def __init__(self):
+        self.functions: Dict[str, Callable] = {}
+        self.schemas: Dict[str, Dict] = {}
+
+    def register(self, func: Callable, name: Optional[str] = None, description: Optional[str] = None) -> Callable:
+        name = name or func.__name__
+        self.functions[name] = func
+        self.schemas[name] = tool_schema(func, name, description)
+        return func
+
+    def tools(self) -> List[Dict]:
+        return list(self.schemas.values())
+
+    async def call(self, name: str, args: Dict):
+        func = self.functions.get(name)
+        if func is None:
+            raise ValueError(f"Unknown tool '{name}'")
+        signature = inspect.signature(func)
+        unknown = set(args) - set(signature.parameters)
+        if unknown:
+            raise ValueError(f"Tool '{name}' got unknown arguments {sorted(unknown)}")
+        if inspect.iscoroutinefunction(func):
+            return await func(**args)
+        # Synchronous tools (COM-backed ones block) run in worker threads so calls overlap
+        return await asyncio.to_thread(func, **args)
+
+    async def execute(self, tool_calls: List[Dict]) -> Dict:
+        """
+        Runs one turn's tool calls ({"name", "args", "id"}) in dependency order, independent ones
+        concurrently. Returns results in call order and the waves they ran in.
+        """
+        started = time.perf_counter()
+        calls = [dict(call, id=call.get("id") or uuid.uuid4().hex[:8]) for call in tool_calls]
+        dependencies = call_dependencies(calls)
+        results: Dict[int, Dict] = {}
+        waves, remaining = [], set(range(len(calls)))
+        while remaining:
+            ready = sorted(i for i in remaining if dependencies[i] <= set(results))
+            if not ready:
+                raise ValueError("Tool calls have circular dependencies")
+            waves.append([calls[i]["id"] for i in ready])
+
+            async def run(i):
+                call = calls[i]
+                failed = [d for d in dependencies[i] if results[d]["status"] == "error"]
+                if failed:
+                    return i, {"id": call["id"], "name": call["name"], "status": "error",
+                               "error": f"Depends on failed call {calls[failed[0]]['id']}"}
+                try:
+                    result = await self.call(call["name"], call.get("args") or {})
+                    if isinstance(result, dict) and result.get("status") == "error":
+                        return i, {"id": call["id"], "name": call["name"], "status": "error",
+                                   "error": result.get("message", "Tool reported an error")}
+                    return i, {"id": call["id"], "name": call["name"], "status": "success", "result": result}
+                except Exception as e:
+                    logging.error(f"Tool call {call['name']} failed: {e}")
+                    return i, {"id": call["id"], "name": call["name"], "status": "error", "error": str(e)}
+
+            for i, result in await asyncio.gather(*(run(i) for i in ready)):
+                results[i] = result
+            remaining -= set(ready)
+        return {
+            "results": [results[i] for i in range(len(calls))],
+            "waves": waves,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+def _created_shape(call: Dict) -> Optional[Dict]:
+    if call["name"] != "create_shape":
+        return None
+    args = call.get("args") or {}
+    return {"name": args.get("name") or call["id"], "shape": args.get("shape_type"), "color": args.get("color")}
+
+def _references(call: Dict) -> List[str]:
+    args = call.get("args") or {}
+    if call["name"] == "connect_shapes":
+        return [args.get("shape1"), args.get("shape2")]
+    if call["name"] == "modify_shape_properties":
+        return [args.get("shape")]
+    return []
+
+def call_dependencies(calls: List[Dict]) -> List[set]:
+    """
+    For each call, the indexes of earlier calls it must wait for: the create_shape calls whose
+    shapes it refers to, and earlier modifications of the same shape.
+    """
+    dependencies = []
+    for i, call in enumerate(calls):
+        needs = set()
+        for reference in filter(None, _references(call)):
+            for j in range(i):
+                created = _created_shape(calls[j])
+                if created is not None and CanvasState([created]).matches(reference):
+                    needs.add(j)
+                elif calls[j]["name"] == "modify_shape_properties" and call["name"] == "modify_shape_properties" \
+                        and (calls[j].get("args") or {}).get("shape") == reference:
+                    needs.add(j)
+        dependencies.append(needs)
+    return dependencies
+
+def _modify_target(reference: str, created: CanvasState) -> Dict:
+    # Modify actions name their target like command_parser does: shape type plus name or current color
+    matched = created.matches(reference)
+    if matched:
+        return {"shape": matched[0]["shape"], "name": matched[0]["name"]}
+    words = reference.lower().split()
+    shapes = [word for word in words if word in SHAPE_TYPES]
+    if not shapes:
+        return {"name": reference}
+    target = {"shape": shapes[0]}
+    colors = [word for word in words if word not in SHAPE_TYPES]
+    if colors:
+        target["current_color"] = " ".join(colors)
+    return target
+
+def result_actions(execution: Dict, calls: List[Dict]) -> List[Dict]:
+    """
+    Successful tool results as Action Agent actions, in call order, for clients of the JSON schema.
+    """
+    actions = []
+    created = CanvasState()
+    for call, outcome in zip(calls, execution["results"]):
+        result = outcome.get("result")
+        if outcome["status"] != "success" or not isinstance(result, dict):
+            continue
+        if call["name"] == "create_shape":
+            action = {"action": "create_shape", "shape": result["shape_type"], "x": result["position"]["x"],
+                      "y": result["position"]["y"], "width": result["dimensions"]["width"],
+                      "height": result["dimensions"]["height"], "color": result["color"]}
+            if result.get("name"):
+                action["name"] = result["name"]
+            created.apply(call["id"], action)
+        elif call["name"] == "connect_shapes":
+            action = {"action": "connect_shapes", "shape": "line", "shape1": result["shapes"][0],
+                      "shape2": result["shapes"][1], "connection_type": result["connection_type"]}
+        elif call["name"] == "modify_shape_properties":
+            action = {"action": "modify_shape", **_modify_target(result["shape"], created)}
+            value = result["new_value"]
+            if result["property"] in NUMERIC_FIELDS:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+            action[result["property"]] = value
+        else:
+            action = {"action": call["name"], "result": result}
+        actions.append(action)
+    return actions
+
+# Registry of the Visio tools in tools.py
+visio_tools = ToolRegistry()
+visio_tools.register(create_shape)
+visio_tools.register(connect_shapes)
+visio_tools.register(modify_shape_properties)
+
+TOOL_CALLING_INSTRUCTIONS = """
+You are the Action Agent for a Visio-like canvas. The canvas is 100x100 with (0,0) at the top left.
+Perform the user's request by calling the tools, all in this one reply. Give new shapes a short
+name when later calls refer to them, and refer to shapes by that name.
+"""
+
+async def run_tool_turn(llm, command: str, registry: ToolRegistry = visio_tools,
+                        guard: Optional[Callable[[Callable[[], Awaitable]], Awaitable]] = None) -> Dict:
+    """
+    One model turn with the registry's tools bound, then parallel execution of the calls it made.
+    guard, if given, wraps the model call (the service passes ResilientOllama.guard).
+    """
+    bound = llm.bind_tools(registry.tools())
+    messages = [
+        {"role": "system", "content": TOOL_CALLING_INSTRUCTIONS},
+        {"role": "user", "content": command},
+    ]
+    model_started = time.perf_counter()
+    response = await (guard(lambda: bound.ainvoke(messages)) if guard else bound.ainvoke(messages))
+    model_ms = round((time.perf_counter() - model_started) * 1000, 3)
+    calls = [{"name": call["name"], "args": call["args"], "id": call.get("id")} for call in response.tool_calls]
+    if not calls:
+        return {"calls": [], "results": [], "waves": [], "actions": [], "model_ms": model_ms, "reply": response.content}
+    calls = [dict(call, id=call["id"] or f"call_{i}") for i, call in enumerate(calls)]
+    execution = await registry.execute(calls)
+    return dict(execution, calls=calls, actions=result_actions(execution, calls), model_ms=model_ms)
@@ -1,10 +1,21 @@
 import logging
+import math
+from typing import Literal, Optional
+import numpy as np
 
 logging.basicConfig(level=logging.INFO)
 
-def create_shape(shape_type, x, y, width, height, color="default"):
+def clamp_to_canvas(x, y, width, height):
+    """
+    Adjusts coordinates based on shape size to ensure it's fully within the canvas.
+    """
+    return max(width / 2, min(x, 100 - width / 2)), max(height / 2, min(y, 100 - height / 2))
+
+def create_shape(shape_type: Literal["circle", "square", "rectangle", "line"], x: float, y: float,
+                 width: float, height: float, color: str = "default", name: str = None):
     """
     Creates a shape in Visio at given coordinates with specified dimensions.
+    Coordinates and sizes are percentages of the canvas; y grows downward. name lets later calls refer to the shape.
     """
     # Validate input types
     if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
@@ -14,23 +25,25 @@ def create_shape(shape_type, x, y, width, height, color="default"):
     if not isinstance(color, str):
         raise ValueError("Color must be a string.")
 
-    # Adjust coordinates based on shape size to ensure it's fully within the canvas
-    adjusted_x = max(width / 2, min(x, 100 - width / 2))
-    adjusted_y = max(height / 2, min(y, 100 - height / 2))
+    adjusted_x, adjusted_y = clamp_to_canvas(x, y, width, height)
     
     logging.info(f"Creating shape '{shape_type}' at ({adjusted_x}%, {adjusted_y}%) with dimensions {width}%x{height}% and color {color}")
     
-    return {
+    result = {
         "status": "success",
         "shape_type": shape_type,
         "position": {"x": adjusted_x, "y": adjusted_y},
         "dimensions": {"width": width, "height": height},
         "color": color
     }
+    if name:
+        result["name"] = name
+    return result
 
-def connect_shapes(shape1, shape2, connection_type="line"):
+def connect_shapes(shape1: str, shape2: str, connection_type: Literal["line", "arrow"] = "line"):
     """
     Connects two shapes in Visio with a specific connection type (line, arrow, etc.)
+    Shapes are given by name or description, e.g. "A" or "red circle".
     """
     logging.info(f"Connecting shape '{shape1}' with shape '{shape2}' using {connection_type}.")
     return {
@@ -39,9 +52,10 @@ def connect_shapes(shape1, shape2, connection_type="line"):
         "shapes": [shape1, shape2]
     }
 
-def modify_shape_properties(shape, property_name, value):
+def modify_shape_properties(shape: str, property_name: Literal["color", "width", "height", "line_style"], value: str):
     """
     Simulates modifying properties of a shape in Visio.
+    The shape is given by name or description, e.g. "A" or "red circle".
     """
     valid_properties = ["color", "width", "height", "line_style"]  # Add more as needed
 
@@ -60,3 +74,189 @@ def modify_shape_properties(shape, property_name, value):
         "property": property_name,
         "new_value": value
     }
+
+# Named colors as Visio fill values; drawings read back from .vsdx carry the hex form
+COLOR_HEX = {
+    "red": "#FF0000", "green": "#008000", "blue": "#0000FF", "yellow": "#FFFF00", "orange": "#FFA500",
+    "purple": "#800080", "pink": "#FFC0CB", "black": "#000000", "white": "#FFFFFF", "gray": "#808080",
+    "grey": "#808080", "brown": "#A52A2A", "cyan": "#00FFFF", "magenta": "#FF00FF", "teal": "#008080",
+    "navy": "#000080", "lime": "#00FF00", "maroon": "#800000", "olive": "#808000", "violet": "#EE82EE",
+    "gold": "#FFD700", "silver": "#C0C0C0",
+}
+
+def color_hex(color: Optional[str]) -> Optional[str]:
+    if not color or color == "default":
+        return None
+    if color.startswith("#") and len(color) == 7:
+        return color.upper()
+    return COLOR_HEX.get(color.lower())
+
+def normalize_color(color) -> str:
+    """
+    One comparable form for a color name or hex code ("red", "#ff0000" and "#FF0000" all give "#FF0000").
+    Unknown names come back lowercased.
+    """
+    return color_hex(str(color)) or str(color).lower()
+
+# Parametric bulk creation: the model emits one "create_shapes_bulk" action and the service expands it
+BULK_LAYOUTS = ["grid", "circle", "row", "column", "random"]
+DEFAULT_PALETTE = ["red", "blue", "green", "orange", "purple", "yellow", "cyan", "magenta", "brown", "gray"]
+MAX_BULK_SHAPES = 1000
+
+def create_shapes_bulk(count, shapes=None, layout="grid", palette=None, size_range=(8, 12),
+                       center=(50, 50), spread=80, seed=0):
+    """
+    Lays out count shapes in one vectorized pass and returns them as create_shape actions.
+    shapes and palette are cycled over the shapes; sizes step evenly through size_range.
+    """
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_BULK_SHAPES:
+        raise ValueError(f"Count must be an integer between 1 and {MAX_BULK_SHAPES}.")
+    if layout not in BULK_LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'. Expected one of {BULK_LAYOUTS}.")
+    shapes = shapes or ["rectangle"]
+    palette = palette or DEFAULT_PALETTE
+
+    index = np.arange(count)
+    low, high = float(min(size_range)), float(max(size_range))
+    sizes = np.linspace(low, high, count) if count > 1 else np.array([(low + high) / 2])
+    center_x, center_y = center
+    half = spread / 2
+
+    if layout == "grid":
+        columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        xs = center_x - half + (index % columns + 0.5) * spread / columns
+        ys = center_y - half + (index // columns + 0.5) * spread / rows
+    elif layout == "row":
+        xs = center_x - half + (index + 0.5) * spread / count
+        ys = np.full(count, float(center_y))
+    elif layout == "column":
+        xs = np.full(count, float(center_x))
+        ys = center_y - half + (index + 0.5) * spread / count
+    elif layout == "circle":
+        angles = 2 * np.pi * index / count
+        xs = center_x + half * np.cos(angles)
+        ys = center_y + half * np.sin(angles)
+    else:
+        rng = np.random.default_rng(seed)
+        xs = rng.uniform(center_x - half, center_x + half, count)
+        ys = rng.uniform(center_y - half, center_y + half, count)
+
+    # Same clamping as create_shape, applied to all shapes at once
+    xs = np.clip(xs, sizes / 2, 100 - sizes / 2).round(2).tolist()
+    ys = np.clip(ys, sizes / 2, 100 - sizes / 2).round(2).tolist()
+    sizes = sizes.round(2).tolist()
+    shape_types = [shapes[i % len(shapes)] for i in range(count)]
+    colors = [palette[i % len(palette)] for i in range(count)]
+
+    actions = []
+    for shape_type, x, y, size, color in zip(shape_types, xs, ys, sizes, colors):
+        action = {"action": "create_shape", "shape": shape_type, "x": x, "y": y,
+                  "width": size, "height": size, "color": color}
+        if shape_type == "circle":
+            action["radius"] = size / 2
+        actions.append(action)
+    logging.info(f"Expanded bulk request into {count} '{layout}' shapes.")
+    return actions
+
+def expand_bulk_action(action):
+    problems = validate_bulk_action(action)
+    if problems:
+        raise ValueError(f"Invalid create_shapes_bulk action: {' '.join(problems)}")
+    size_range = action.get("size_range") or [8, 12]
+    shapes = action.get("shapes") or ([action["shape"]] if action.get("shape") else None)
+    return create_shapes_bulk(
+        count=action["count"],
+        shapes=shapes,
+        layout=action.get("layout", "grid"),
+        palette=action.get("palette") or ([action["color"]] if action.get("color") else None),
+        size_range=(size_range[0], size_range[-1]),
+        center=(action.get("x", 50), action.get("y", 50)),
+        spread=action.get("spread", 80),
+        seed=action.get("seed", 0),
+    )
+
+def expand_bulk_actions(actions):
+    """
+    Replaces create_shapes_bulk actions with the create_shape actions they describe.
+    Responses without bulk actions are returned unchanged.
+    """
+    single = isinstance(actions, dict)
+    items = [actions] if single else actions
+    if not isinstance(items, list) or not any(isinstance(a, dict) and a.get("action") == "create_shapes_bulk" for a in items):
+        return actions
+    expanded = []
+    for action in items:
+        if isinstance(action, dict) and action.get("action") == "create_shapes_bulk":
+            expanded.extend(expand_bulk_action(action))
+        else:
+            expanded.append(action)
+    return expanded
+
+# Action schema used by the Action Agent (see agent_prompts.action_agent_instructions)
+ACTION_TYPES = ["create_shape", "modify_shape", "delete_shape", "connect_shapes", "create_shapes_bulk"]
+SHAPE_TYPES = ["circle", "square", "rectangle", "line"]
+NUMERIC_FIELDS = ["x", "y", "width", "height", "radius"]
+
+def validate_bulk_action(action):
+    problems = []
+    count = action.get("count")
+    if "count" not in action:
+        problems.append("Missing required key 'count'.")
+    elif isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= MAX_BULK_SHAPES:
+        problems.append(f"Field 'count' must be an integer between 1 and {MAX_BULK_SHAPES}.")
+    shapes = action.get("shapes") or ([action["shape"]] if "shape" in action else [])
+    if not isinstance(shapes, list) or any(shape not in SHAPE_TYPES for shape in shapes):
+        problems.append(f"Field 'shapes' must list shapes from {SHAPE_TYPES}.")
+    if action.get("layout", "grid") not in BULK_LAYOUTS:
+        problems.append(f"Unknown layout '{action.get('layout')}'.")
+    palette = action.get("palette", [])
+    if not isinstance(palette, list) or not all(isinstance(color, str) for color in palette):
+        problems.append("Field 'palette' must be a list of colors.")
+    size_range = action.get("size_range", [8, 12])
+    if not isinstance(size_range, list) or not 1 <= len(size_range) <= 2 or \
+       not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0 for v in size_range):
+        problems.append("Field 'size_range' must be [min, max] with positive numbers.")
+    for key in ("x", "y", "spread"):
+        if key in action and (isinstance(action[key], bool) or not isinstance(action[key], (int, float))):
+            problems.append(f"Field '{key}' must be a number.")
+    return problems
+
+def validate_action(action):
+    """
+    Checks a single action against the Action Agent schema and returns a list of problems (empty when valid).
+    """
+    if not isinstance(action, dict):
+        return ["Action must be a JSON object."]
+
+    if action.get("action") == "create_shapes_bulk":
+        return validate_bulk_action(action)
+
+    problems = []
+    for key in ["action", "shape"]:
+        if key not in action:
+            problems.append(f"Missing required key '{key}'.")
+    if "action" in action and action["action"] not in ACTION_TYPES:
+        problems.append(f"Unknown action '{action['action']}'.")
+    if "shape" in action and action["shape"] not in SHAPE_TYPES:
+        problems.append(f"Unknown shape '{action['shape']}'.")
+    for key in NUMERIC_FIELDS:
+        if key in action and (isinstance(action[key], bool) or not isinstance(action[key], (int, float))):
+            problems.append(f"Field '{key}' must be a number.")
+    if "color" in action and not isinstance(action["color"], str):
+        problems.append("Field 'color' must be a string.")
+    return problems
+
+def validate_actions(actions):
+    """
+    Validates a single action or a list of actions and returns a list of problems (empty when valid).
+    """
+    if isinstance(actions, dict):
+        actions = [actions]
+    if not isinstance(actions, list) or not actions:
+        return ["Response must be a non-empty JSON object or array."]
+
+    problems = []
+    for index, action in enumerate(actions):
+        problems.extend(f"Action {index}: {problem}" for problem in validate_action(action))
+    return problems
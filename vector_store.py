@@ -0,0 +1,357 @@
+import logging
+import os
+import threading
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from langchain.schema import Document
+from flat_index import FlatIndex, _normalize
+
+logging.basicConfig(level=logging.INFO)
+
+# One interface over the vector stores used in this project. Every backend stores L2-normalized
+# vectors with their text and metadata, scores results by cosine similarity (higher is better)
+# and rejects vectors whose dimension differs from the one the store was created with.
+#
+#   numpy   in-process arrays, fastest for small corpora, lost on restart
+#   flat    memory-mapped files (see flat_index.py), shared by worker processes
+#   qdrant  a Qdrant collection, for corpora that outgrow one machine's memory
+#   ivf     in-process approximate index persisted to disk (see ivf_index.py), for large corpora without Qdrant
+
+class SearchHit(NamedTuple):
+    id: str
+    score: float
+    text: str
+    metadata: Dict
+
+def embedding_dimension(embeddings) -> int:
+    """
+    Dimension of the vectors produced by a LangChain embeddings object, found by embedding a probe text.
+    """
+    dimension = len(embeddings.embed_query("dimension probe"))
+    if not dimension:
+        raise ValueError("Embeddings returned an empty vector")
+    return dimension
+
+class VectorStore:
+    backend = None
+
+    def __init__(self, dimension: Optional[int] = None):
+        self.dimension = dimension
+        self._lock = threading.RLock()
+
+    def _check(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if vectors.ndim != 2:
+            raise ValueError(f"Expected a 2-D array of vectors, got shape {vectors.shape}")
+        if self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"{self.backend} store holds {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+        return vectors
+
+    def add(self, vectors, texts: Sequence[str], metadatas: Optional[Sequence[Dict]] = None,
+            ids: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        Inserts a batch; returns the ids of the new entries in input order.
+        """
+        vectors = self._check(vectors)
+        if len(texts) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(texts)} texts")
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if len(vectors):
+            with self._lock:
+                self._add(_normalize(vectors), list(texts), metadatas, ids)
+        return ids
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        Removes entries by id; returns how many were found.
+        """
+        ids = set(ids)
+        if not ids:
+            return 0
+        with self._lock:
+            return self._delete(ids)
+
+    def clear(self):
+        """
+        Removes every entry; the dimension is kept.
+        """
+        with self._lock:
+            self._clear()
+
+    def search(self, query_vector, k: int = 4) -> List[SearchHit]:
+        return self.search_batch([query_vector], k)[0]
+
+    def search_batch(self, query_vectors, k: int = 4) -> List[List[SearchHit]]:
+        """
+        Results for several queries at once, each best first.
+        """
+        queries = self._check(query_vectors)
+        if len(queries) == 0:
+            return []
+        return self._search_batch(_normalize(queries), k)
+
+    def flush(self):
+        """
+        Persists pending inserts for backends that write to disk in bulk.
+        """
+
+    def _add(self, vectors: np.ndarray, texts: List[str], metadatas: List[Dict], ids: List[str]):
+        raise NotImplementedError
+
+    def _delete(self, ids: set) -> int:
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _search_batch(self, queries: np.ndarray, k: int) -> List[List[SearchHit]]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Row-wise indexes of the k largest scores, best first.
+    """
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+# In-process store; the vector array grows geometrically so batch inserts stay amortized O(n)
+class NumpyVectorStore(VectorStore):
+    backend = "numpy"
+
+    def __init__(self, dimension: Optional[int] = None):
+        super().__init__(dimension)
+        self._vectors = None
+        self._size = 0
+        self.texts: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.ids: List[str] = []
+
+    def _add(self, vectors, texts, metadatas, ids):
+        needed = self._size + len(vectors)
+        if self._vectors is None or needed > len(self._vectors):
+            grown = np.zeros((max(needed, 2 * self._size, 64), self.dimension), dtype=np.float32)
+            if self._size:
+                grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size:needed] = vectors
+        self._size = needed
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.ids.extend(ids)
+
+    def _keep(self, ids: set) -> np.ndarray:
+        # Compacts the arrays to the entries not in ids; returns the kept positions
+        keep = np.array([i not in ids for i in self.ids], dtype=bool)
+        positions = np.flatnonzero(keep)
+        self._vectors = self._vectors[positions]
+        self._size = len(positions)
+        self.texts = [self.texts[i] for i in positions]
+        self.metadatas = [self.metadatas[i] for i in positions]
+        self.ids = [self.ids[i] for i in positions]
+        return keep
+
+    def _delete(self, ids):
+        before = self._size
+        if before:
+            self._keep(ids)
+        return before - self._size
+
+    def _clear(self):
+        self._vectors = None
+        self._size = 0
+        self.texts, self.metadatas, self.ids = [], [], []
+
+    def _search_batch(self, queries, k):
+        # Deletes compact the arrays in place, so searches hold the lock too
+        with self._lock:
+            if self._size == 0:
+                return [[] for _ in queries]
+            scores = queries @ self._vectors[:self._size].T
+            return [
+                [SearchHit(self.ids[i], float(row_scores[i]), self.texts[i], self.metadatas[i]) for i in row]
+                for row, row_scores in zip(_top_k(scores, k), scores)
+            ]
+
+    def __len__(self) -> int:
+        return self._size
+
+# Store backed by a FlatIndex directory; each add rewrites the files, so insert in large batches
+class FlatFileVectorStore(VectorStore):
+    backend = "flat"
+
+    def __init__(self, directory: str, dimension: Optional[int] = None):
+        super().__init__(dimension)
+        self.directory = directory
+        self.index = None
+        if os.path.exists(os.path.join(directory, "vectors.npy")):
+            self.index = FlatIndex(directory)
+            if len(self.index):
+                self._check(self.index.vectors[:1])
+
+    def _add(self, vectors, texts, metadatas, ids):
+        existing = len(self.index) if self.index is not None else 0
+        all_vectors = np.concatenate([self.index.vectors, vectors]) if existing else vectors
+        all_texts = [self.index.text(i) for i in range(existing)] + texts
+        all_metadatas = (self.index.metadata if existing else []) + [dict(m, _id=i) for m, i in zip(metadatas, ids)]
+        FlatIndex.save(self.directory, all_vectors, all_texts, all_metadatas)
+        self.index = FlatIndex(self.directory)
+
+    def _delete(self, ids):
+        if self.index is None:
+            return 0
+        kept = [i for i, metadata in enumerate(self.index.metadata) if metadata.get("_id", str(i)) not in ids]
+        removed = len(self.index) - len(kept)
+        if removed:
+            vectors = np.asarray(self.index.vectors)[kept] if kept else np.zeros((0, self.dimension), dtype=np.float32)
+            FlatIndex.save(self.directory, vectors, [self.index.text(i) for i in kept],
+                           [self.index.metadata[i] for i in kept])
+            self.index = FlatIndex(self.directory)
+        return removed
+
+    def _clear(self):
+        if self.index is not None:
+            FlatIndex.save(self.directory, np.zeros((0, self.dimension or 0), dtype=np.float32), [], [])
+            self.index = FlatIndex(self.directory)
+
+    def _search_batch(self, queries, k):
+        # Writes replace self.index as a whole, so one search keeps using the index it started with
+        index = self.index
+        if index is None or len(index) == 0:
+            return [[] for _ in queries]
+        scores = queries @ np.asarray(index.vectors).T
+        results = []
+        for row, row_scores in zip(_top_k(scores, k), scores):
+            hits = []
+            for i in row:
+                metadata = dict(index.metadata[i])
+                hit_id = metadata.pop("_id", str(i))
+                hits.append(SearchHit(hit_id, float(row_scores[i]), index.text(int(i)), metadata))
+            results.append(hits)
+        return results
+
+    def __len__(self) -> int:
+        return len(self.index) if self.index is not None else 0
+
+# Store backed by a Qdrant collection; text and metadata travel in the point payload
+class QdrantVectorStore(VectorStore):
+    backend = "qdrant"
+
+    def __init__(self, client, collection_name: str, dimension: Optional[int] = None, quantization: bool = False):
+        from qdrant_db import ensure_collection_exists
+        super().__init__(dimension)
+        self.client = client
+        self.collection_name = collection_name
+        if client.collection_exists(collection_name):
+            info = client.get_collection(collection_name)
+            size = info.config.params.vectors.size
+            if dimension is not None and size != dimension:
+                raise ValueError(f"Qdrant collection '{collection_name}' holds {size}-dimensional vectors, "
+                                 f"but the embedding model produces {dimension}")
+            self.dimension = size
+        elif dimension is not None:
+            ensure_collection_exists(client, collection_name, vector_size=dimension, quantization=quantization)
+        self._quantization = quantization
+
+    def _add(self, vectors, texts, metadatas, ids):
+        from qdrant_client.http.models import PointStruct
+        from qdrant_db import ensure_collection_exists
+        if not self.client.collection_exists(self.collection_name):
+            ensure_collection_exists(self.client, self.collection_name, vector_size=self.dimension,
+                                     quantization=self._quantization)
+        points = [
+            PointStruct(id=point_id, vector=vector.tolist(), payload={"text": text, "metadata": metadata})
+            for point_id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+
+    def _delete(self, ids):
+        from qdrant_client.http.models import PointIdsList
+        if not self.client.collection_exists(self.collection_name):
+            return 0
+        found = self.client.retrieve(collection_name=self.collection_name, ids=list(ids),
+                                     with_payload=False, with_vectors=False)
+        if found:
+            self.client.delete(collection_name=self.collection_name,
+                               points_selector=PointIdsList(points=[point.id for point in found]), wait=True)
+        return len(found)
+
+    def _clear(self):
+        # The collection is recreated on the next add
+        if self.client.collection_exists(self.collection_name):
+            self.client.delete_collection(self.collection_name)
+
+    def _search_batch(self, queries, k):
+        from qdrant_client.http.models import QueryRequest
+        if not self.client.collection_exists(self.collection_name):
+            return [[] for _ in queries]
+        requests = [QueryRequest(query=query.tolist(), limit=k, with_payload=True) for query in queries]
+        responses = self.client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        return [
+            [SearchHit(str(point.id), float(point.score), point.payload.get("text", ""), point.payload.get("metadata", {}))
+             for point in response.points]
+            for response in responses
+        ]
+
+    def __len__(self) -> int:
+        if not self.client.collection_exists(self.collection_name):
+            return 0
+        return self.client.count(collection_name=self.collection_name, exact=True).count
+
+def create_vector_store(backend: str = None, dimension: Optional[int] = None, **options) -> VectorStore:
+    """
+    backend defaults to VECTOR_STORE_BACKEND (numpy). flat and ivf take directory=; ivf also takes
+    n_lists= and n_probe= (IVF_N_LISTS, IVF_N_PROBE); qdrant takes client= (or host=/port=) and collection_name=.
+    """
+    backend = (backend or os.environ.get("VECTOR_STORE_BACKEND", "numpy")).lower()
+    if backend == "numpy":
+        return NumpyVectorStore(dimension)
+    if backend == "flat":
+        return FlatFileVectorStore(options.get("directory") or os.environ.get("VECTOR_STORE_DIR", "vector_store"), dimension)
+    if backend == "ivf":
+        from ivf_index import IVFVectorStore
+        n_lists = options.get("n_lists") or os.environ.get("IVF_N_LISTS")
+        # An explicit directory=None keeps the index in memory only
+        directory = options["directory"] if "directory" in options else os.environ.get("VECTOR_STORE_DIR", "vector_store")
+        return IVFVectorStore(dimension, directory=directory,
+                              n_lists=int(n_lists) if n_lists else None,
+                              n_probe=int(options.get("n_probe") or os.environ.get("IVF_N_PROBE", "8")))
+    if backend == "qdrant":
+        client = options.get("client")
+        if client is None:
+            from qdrant_db import initialize_qdrant_client
+            client = initialize_qdrant_client(host=options.get("host", os.environ.get("QDRANT_HOST", "localhost")),
+                                              port=int(options.get("port", os.environ.get("QDRANT_PORT", "6333"))))
+        return QdrantVectorStore(client, options.get("collection_name", "documents"), dimension,
+                                 quantization=options.get("quantization", False))
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+# LangChain-style search over a VectorStore, usable as the search function of retrieval.AdaptiveRetriever
+class EmbeddingSearch:
+    def __init__(self, store: VectorStore, embeddings):
+        self.store = store
+        self.embeddings = embeddings
+
+    def add_documents(self, documents: List[Document], batch_size: int = 256) -> List[str]:
+        ids = []
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start:start + batch_size]
+            texts = [doc.page_content for doc in batch]
+            ids.extend(self.store.add(self.embeddings.embed_documents(texts), texts, [doc.metadata for doc in batch]))
+        self.store.flush()
+        return ids
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[tuple]:
+        hits = self.store.search(self.embeddings.embed_query(query), k)
+        return [(Document(page_content=hit.text, metadata=dict(hit.metadata)), hit.score) for hit in hits]
@@ -0,0 +1,164 @@
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from stats_utils import percentile
+from vector_store import VectorStore, create_vector_store
+
+logging.basicConfig(level=logging.INFO)
+
+# Synthetic corpus with some cluster structure so nearest neighbours are meaningful
+def synthetic_corpus(size: int, dimension: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 50), dimension)).astype(np.float32)
+    assignment = rng.integers(0, len(centers), size=size)
+    vectors = centers[assignment] + 0.3 * rng.normal(size=(size, dimension)).astype(np.float32)
+    picks = rng.integers(0, size, size=queries)
+    query_vectors = vectors[picks] + 0.1 * rng.normal(size=(queries, dimension)).astype(np.float32)
+    texts = [f"chunk {i} of cluster {assignment[i]}" for i in range(size)]
+    return vectors, texts, query_vectors
+
+# Corpus built from real text through an embeddings object (e.g. the RAG document splits)
+def embedded_corpus(embeddings, texts: List[str], queries: List[str]):
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32), texts, \
+        np.asarray([embeddings.embed_query(q) for q in queries], dtype=np.float32)
+
+def benchmark_store(store: VectorStore, vectors, texts, query_vectors, k: int = 5, batch_size: int = 256,
+                    exact: List[List[str]] = None) -> Dict:
+    """
+    Inserts the corpus in batches, then times single and batched searches. When exact holds the
+    ids of the true top-k per query, recall@k is reported too.
+    """
+    start = time.perf_counter()
+    ids = []
+    for offset in range(0, len(texts), batch_size):
+        ids.extend(store.add(vectors[offset:offset + batch_size], texts[offset:offset + batch_size]))
+    insert_time = time.perf_counter() - start
+
+    latencies = []
+    single_results = []
+    for query in query_vectors:
+        start = time.perf_counter()
+        single_results.append(store.search(query, k))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    store.search_batch(query_vectors, k)
+    batch_time = time.perf_counter() - start
+
+    report = {
+        "backend": store.backend,
+        "size": len(store),
+        "dimension": store.dimension,
+        "insert_per_sec": len(texts) / insert_time if insert_time else 0.0,
+        "search_p50_ms": percentile(latencies, 50) * 1000,
+        "search_p95_ms": percentile(latencies, 95) * 1000,
+        "search_p99_ms": percentile(latencies, 99) * 1000,
+        "batch_queries_per_sec": len(query_vectors) / batch_time if batch_time else 0.0,
+    }
+    if exact is not None:
+        # Map the ids this store assigned back to corpus positions before comparing
+        position = {hit_id: i for i, hit_id in enumerate(ids)}
+        found = [{position.get(hit.id) for hit in hits} for hits in single_results]
+        report["recall_at_k"] = float(np.mean([len(f & set(e)) / len(e) for f, e in zip(found, exact)]))
+    return report, ids
+
+def exact_neighbours(vectors, query_vectors, k: int) -> List[List[int]]:
+    norm = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    queries = query_vectors / np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    return [list(np.argsort(-row)[:k]) for row in queries @ norm.T]
+
+def sweep_probes(store, query_vectors, exact: List[List[int]], ids: List[str], probes: List[int], k: int = 5) -> List[Dict]:
+    """
+    Recall@k and latency of an IVF store at several n_probe settings, reusing the built index.
+    """
+    position = {hit_id: i for i, hit_id in enumerate(ids)}
+    reports = []
+    for n_probe in probes:
+        store.n_probe = n_probe
+        latencies, found = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            hits = store.search(query, k)
+            latencies.append(time.perf_counter() - start)
+            found.append({position.get(hit.id) for hit in hits})
+        reports.append({
+            "backend": f"ivf/probe={n_probe}",
+            "size": len(store),
+            "dimension": store.dimension,
+            "search_p50_ms": percentile(latencies, 50) * 1000,
+            "search_p95_ms": percentile(latencies, 95) * 1000,
+            "search_p99_ms": percentile(latencies, 99) * 1000,
+            "recall_at_k": float(np.mean([len(f & set(e)) / len(e) for f, e in zip(found, exact)])),
+        })
+    return reports
+
+def run_benchmark(backends: List[str], vectors, texts, query_vectors, k: int = 5, batch_size: int = 256,
+                  qdrant_location: str = ":memory:", ivf_probes: List[int] = None, n_lists: int = None) -> List[Dict]:
+    exact = exact_neighbours(vectors, query_vectors, k)
+    reports = []
+    for backend in backends:
+        workdir = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+        try:
+            options = {"directory": workdir, "n_lists": n_lists}
+            if backend == "qdrant":
+                from qdrant_client import QdrantClient
+                options["client"] = QdrantClient(location=qdrant_location) if qdrant_location == ":memory:" \
+                    else QdrantClient(url=qdrant_location)
+                options["collection_name"] = f"benchmark_{int(time.time())}"
+            store = create_vector_store(backend, dimension=vectors.shape[1], **options)
+            report, ids = benchmark_store(store, vectors, texts, query_vectors, k, batch_size, exact)
+            reports.append(report)
+            if backend == "ivf" and ivf_probes:
+                reports.extend(sweep_probes(store, query_vectors, exact, ids, ivf_probes, k))
+            if backend == "qdrant":
+                options["client"].delete_collection(options["collection_name"])
+        except Exception as e:
+            logging.error(f"Benchmark of {backend} failed: {e}")
+            reports.append({"backend": backend, "error": str(e)})
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return reports
+
+def print_reports(reports: List[Dict]):
+    metrics = ["size", "dimension", "insert_per_sec", "search_p50_ms", "search_p95_ms", "search_p99_ms",
+               "batch_queries_per_sec", "recall_at_k"]
+    print(f"{'metric':<24}" + "".join(f"{r['backend'][:15]:>16}" for r in reports))
+    for metric in metrics:
+        cells = []
+        for report in reports:
+            value = report.get(metric, report.get("error", "-") if metric == "size" else "-")
+            cells.append(f"{value:>16.3f}" if isinstance(value, float) else f"{str(value)[:15]:>16}")
+        print(f"{metric:<24}" + "".join(cells))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vector store backends on the same corpus.")
+    parser.add_argument("--backends", default="numpy,flat,qdrant,ivf")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated corpus sizes")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--qdrant", default=":memory:", help="Qdrant URL, or :memory: for local mode")
+    parser.add_argument("--ivf-probes", default="1,4,16,64", help="n_probe values to sweep for the ivf backend")
+    parser.add_argument("--ivf-lists", type=int, help="IVF list count (default ~4*sqrt(n))")
+    parser.add_argument("--output", help="Write all reports as JSON")
+    args = parser.parse_args()
+
+    all_reports = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        vectors, texts, query_vectors = synthetic_corpus(size, args.dimension, args.queries)
+        reports = run_benchmark(args.backends.split(","), vectors, texts, query_vectors, args.k,
+                                args.batch_size, args.qdrant, [int(p) for p in args.ivf_probes.split(",")], args.ivf_lists)
+        print(f"\nCorpus of {size} vectors, dimension {args.dimension}")
+        print_reports(reports)
+        all_reports[size] = reports
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(all_reports, f, indent=2)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+# Streaming reader for .vsdx drawings (an OPC zip of XML parts). Pages are read one at a time with
+# iterparse and every shape element is dropped from the tree once it has been converted, so memory
+# is bounded by the largest page's shape list rather than the size of the drawing.
+#
+# Shapes come out in the service's canvas model: x, y, width and height are percentages of the
+# page with y growing downward, matching the coordinates the add-in's VisioCommandProcessor takes.
+
+VISIO_NS = "http://schemas.microsoft.com/office/visio/2012/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+def _tag(name: str) -> str:
+    return f"{{{VISIO_NS}}}{name}"
+
+# Master names mapped onto the shape types used by the Action Agent schema (tools.SHAPE_TYPES)
+MASTER_SHAPE_TYPES = {
+    "circle": "circle", "ellipse": "circle",
+    "square": "square",
+    "rectangle": "rectangle", "process": "rectangle",
+    "dynamic connector": "line", "line": "line", "connector": "line",
+}
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _relationships(package: zipfile.ZipFile, part: str) -> Dict[str, str]:
+    """
+    Relationship id -> target part path for a package part.
+    """
+    folder, name = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", f"{name}.rels")
+    if rels_part not in package.namelist():
+        return {}
+    root = ET.fromstring(package.read(rels_part))
+    return {
+        rel.get("Id"): posixpath.normpath(posixpath.join(folder, rel.get("Target")))
+        for rel in root.iter(f"{{{PACKAGE_REL_NS}}}Relationship")
+    }
+
+def _cells(element) -> Dict[str, str]:
+    return {cell.get("N"): cell.get("V") for cell in element.findall(_tag("Cell"))}
+
+def _geometry(element) -> List[Dict]:
+    rows = []
+    for section in element.findall(_tag("Section")):
+        if section.get("N") != "Geometry":
+            continue
+        for row in section.findall(_tag("Row")):
+            cells = _cells(row)
+            rows.append({"type": row.get("T"), "x": _number(cells.get("X")), "y": _number(cells.get("Y"))})
+    return rows
+
+def _text(element) -> str:
+    text = element.find(_tag("Text"))
+    return " ".join("".join(text.itertext()).split()) if text is not None else ""
+
+def _read_masters(package: zipfile.ZipFile) -> Dict[str, Dict]:
+    """
+    Master id -> name and the default cells of its top shape, which instances inherit.
+    """
+    part = "visio/masters/masters.xml"
+    if part not in package.namelist():
+        return {}
+    rels = _relationships(package, part)
+    masters = {}
+    for master in ET.fromstring(package.read(part)).iter(_tag("Master")):
+        info = {"name": master.get("NameU") or master.get("Name"), "cells": {}, "geometry": [], "text": ""}
+        rel = master.find(_tag("Rel"))
+        target = rels.get(rel.get(f"{{{REL_NS}}}id")) if rel is not None else None
+        if target in package.namelist():
+            with package.open(target) as f:
+                for _, element in ET.iterparse(f):
+                    if element.tag == _tag("Shape"):
+                        # The last Shape to close is the outermost one
+                        info["cells"], info["geometry"], info["text"] = _cells(element), _geometry(element), _text(element)
+                        element.clear()
+        masters[master.get("ID")] = info
+    return masters
+
+def _read_pages(package: zipfile.ZipFile) -> List[Dict]:
+    part = "visio/pages/pages.xml"
+    rels = _relationships(package, part)
+    pages = []
+    for page in ET.fromstring(package.read(part)).iter(_tag("Page")):
+        sheet = page.find(_tag("PageSheet"))
+        cells = _cells(sheet) if sheet is not None else {}
+        rel = page.find(_tag("Rel"))
+        pages.append({
+            "id": page.get("ID"),
+            "name": page.get("NameU") or page.get("Name"),
+            "width": _number(cells.get("PageWidth")) or 8.5,
+            "height": _number(cells.get("PageHeight")) or 11.0,
+            "part": rels.get(rel.get(f"{{{REL_NS}}}id")) if rel is not None else None,
+        })
+    return pages
+
+def _shape_record(element, masters: Dict[str, Dict], page: Dict, parent: Optional[str], master_id: Optional[str]) -> Dict:
+    master = masters.get(master_id, {"name": None, "cells": {}, "geometry": [], "text": ""})
+    cells = dict(master["cells"], **{k: v for k, v in _cells(element).items() if v is not None})
+    pin_x, pin_y = _number(cells.get("PinX")), _number(cells.get("PinY"))
+    if parent is not None:
+        # Group members are positioned in their group's local coordinates, not the page's
+        pin_x = pin_y = None
+    width, height = _number(cells.get("Width")) or 0.0, _number(cells.get("Height")) or 0.0
+    master_name = master["name"]
+    record = {
+        "id": element.get("ID"),
+        "name": element.get("NameU") or element.get("Name") or f"Sheet.{element.get('ID')}",
+        "master": master_name,
+        "shape": MASTER_SHAPE_TYPES.get((master_name or "").lower(), (master_name or element.get("Type") or "shape").lower()),
+        "text": _text(element) or master["text"],
+        "x": round(pin_x / page["width"] * 100, 3) if pin_x is not None else None,
+        "y": round((1 - pin_y / page["height"]) * 100, 3) if pin_y is not None else None,
+        "width": round(width / page["width"] * 100, 3),
+        "height": round(height / page["height"] * 100, 3),
+        "geometry": _geometry(element) or master["geometry"],
+        "parent": parent,
+    }
+    fill = cells.get("FillForegnd")
+    if fill and fill.startswith("#"):
+        record["color"] = fill
+    if cells.get("BeginX") is not None:
+        # 1-D shapes (connectors, lines) also carry their end points
+        record["begin"] = [_number(cells.get("BeginX")), _number(cells.get("BeginY"))]
+        record["end"] = [_number(cells.get("EndX")), _number(cells.get("EndY"))]
+    return record
+
+def _parse_page(package: zipfile.ZipFile, page: Dict, masters: Dict[str, Dict]) -> Dict:
+    shapes, connects = [], []
+    stack = []  # open elements, so finished shapes can be detached from their parent
+    groups = []  # ids of the Shape elements currently open, for group membership
+    with package.open(page["part"]) as f:
+        for event, element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                if element.tag == _tag("Shape"):
+                    groups.append(element.get("ID"))
+                continue
+            stack.pop()
+            if element.tag == _tag("Shape"):
+                groups.pop()
+                # Sub-shapes of a master instance have no Master attribute and keep only their own cells
+                shapes.append(_shape_record(element, masters, page, groups[-1] if groups else None, element.get("Master")))
+                if stack:
+                    stack[-1].remove(element)
+            elif element.tag == _tag("Connect"):
+                connects.append({key: element.get(key) for key in ("FromSheet", "FromCell", "ToSheet", "ToCell")})
+                if stack:
+                    stack[-1].remove(element)
+    return {
+        "page": page["name"],
+        "width": page["width"],
+        "height": page["height"],
+        "shapes": shapes,
+        "connections": _connections(connects, shapes),
+    }
+
+def _connections(connects: List[Dict], shapes: List[Dict]) -> List[Dict]:
+    """
+    Pairs each connector's BeginX and EndX glue into one connection between the two glued shapes.
+    """
+    names = {shape["id"]: shape["name"] for shape in shapes}
+    ends = {}
+    for connect in connects:
+        ends.setdefault(connect["FromSheet"], {})[connect["FromCell"]] = connect["ToSheet"]
+    connections = []
+    for connector, glued in ends.items():
+        source, target = glued.get("BeginX"), glued.get("EndX")
+        if source is None and target is None:
+            continue
+        connections.append({
+            "connector": names.get(connector, connector),
+            "from": names.get(source, source),
+            "to": names.get(target, target),
+        })
+    return connections
+
+def iter_vsdx_pages(path: str) -> Iterator[Dict]:
+    """
+    Yields one diagram dict per page: page name and size, shapes and connections.
+    """
+    with zipfile.ZipFile(path) as package:
+        masters = _read_masters(package)
+        for page in _read_pages(package):
+            if page["part"] is None or page["part"] not in package.namelist():
+                continue
+            diagram = _parse_page(package, page, masters)
+            diagram["source"] = path
+            yield diagram
+
+def canvas_shapes(diagram: Dict) -> List[Dict]:
+    """
+    Shapes in the known_shapes format of command_parser and speculative.CanvasState.
+    """
+    return [
+        {key: shape[key] for key in ("name", "shape", "color", "x", "y") if shape.get(key) is not None}
+        for shape in diagram["shapes"] if shape["parent"] is None
+    ]
+
+def diagram_text(diagram: Dict) -> str:
+    """
+    Plain-text description of a page for the vector index: one line per shape and connection.
+    """
+    lines = [f"Diagram page '{diagram['page']}' of {os.path.basename(diagram.get('source', ''))}"]
+    for shape in diagram["shapes"]:
+        if shape["shape"] == "line" and not shape["text"]:
+            continue
+        description = f"Shape {shape['name']} ({shape['master'] or shape['shape']})"
+        if shape["text"]:
+            description += f": {shape['text']}"
+        lines.append(description)
+    for connection in diagram["connections"]:
+        lines.append(f"{connection['from']} is connected to {connection['to']}")
+    return "\n".join(lines)
+
+def summarize_vsdx(path: str) -> Dict:
+    """
+    Parses a whole drawing into picklable results; used as the process pool task.
+    """
+    try:
+        pages = list(iter_vsdx_pages(path))
+        return {"source": path, "pages": pages, "text": "\n\n".join(diagram_text(page) for page in pages)}
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        logging.error(f"Error parsing {path}: {e}")
+        return {"source": path, "pages": [], "text": "", "error": str(e)}
+
+def find_drawings(paths: List[str]) -> List[str]:
+    drawings = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+                drawings.extend(os.path.join(folder, name) for name in sorted(files) if name.lower().endswith(".vsdx"))
+        else:
+            drawings.append(path)
+    return drawings
+
+def parse_many(paths: List[str], workers: int = None) -> Iterator[Dict]:
+    """
+    Parses many drawings in a process pool; results are yielded in input order.
+    """
+    drawings = find_drawings(paths)
+    if workers == 1 or len(drawings) <= 1:
+        yield from map(summarize_vsdx, drawings)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(summarize_vsdx, drawings, chunksize=max(1, len(drawings) // ((workers or os.cpu_count() or 1) * 4)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract shapes, text and connections from .vsdx drawings.")
+    parser.add_argument("paths", nargs="+", help=".vsdx files or folders to search")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: one per CPU)")
+    parser.add_argument("--output", default="diagrams.jsonl", help="One JSON line per page")
+    args = parser.parse_args()
+
+    pages = shapes = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for result in parse_many(args.paths, args.workers):
+            for page in result["pages"]:
+                f.write(json.dumps(page) + "\n")
+                pages += 1
+                shapes += len(page["shapes"])
+    print(f"Wrote {pages} pages with {shapes} shapes to {args.output}")
@@ -0,0 +1,374 @@
+import argparse
+import io
+import json
+import logging
+import os
+import posixpath
+import time
+import uuid
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+from tools import clamp_to_canvas, color_hex, expand_bulk_actions, validate_actions
+from speculative import DEFAULT_SIZE, CanvasState, _target_reference
+from vsdx_parser import VISIO_NS, REL_NS, PACKAGE_REL_NS, _relationships, _tag
+
+logging.basicConfig(level=logging.INFO)
+
+# Writes Action Agent output straight into a .vsdx package, so a large diagram reaches Visio as one
+# file the add-in opens or pastes in a single operation instead of one COM call per shape.
+#
+# Shapes are instances of masters looked up by name in the stencil catalog. When the catalog's
+# stencil file is available its master parts are copied into the drawing; otherwise a built-in
+# master with the same name and simple geometry is written. Masters are flagged MatchByName, so
+# Visio maps them onto the stencil's masters when shapes are pasted into a document using it.
+# Positions are 0-100 percentages of the page with y growing downward, as for CreateShape.
+
+# shape type -> master name; "stencil" is the file the add-in's CurrentCategory would point at
+DEFAULT_STENCIL_CATALOG = {
+    "stencil": "BASIC_M.vssx",
+    "masters": {"circle": "Circle", "square": "Square", "rectangle": "Rectangle", "line": "Dynamic connector"},
+}
+STENCIL_CATALOG_PATH = os.environ.get("VSDX_STENCIL_CATALOG")
+STENCIL_DIR = os.environ.get("VSDX_STENCIL_DIR", "stencils")
+# Parts other than pages and masters (document settings, styles, theme) come from this drawing
+TEMPLATE_PATH = os.environ.get("VSDX_TEMPLATE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Test.vsdx"))
+
+# Page size of Test.vsdx (A4 landscape, inches)
+DEFAULT_PAGE_WIDTH = 11.69291338582677
+DEFAULT_PAGE_HEIGHT = 8.26771653543307
+
+CONTENT_TYPES = {
+    "document": "application/vnd.ms-visio.drawing.main+xml",
+    "pages": "application/vnd.ms-visio.pages+xml",
+    "page": "application/vnd.ms-visio.page+xml",
+    "masters": "application/vnd.ms-visio.masters+xml",
+    "master": "application/vnd.ms-visio.master+xml",
+}
+REL_TYPES = {
+    "document": "http://schemas.microsoft.com/visio/2010/relationships/document",
+    "pages": "http://schemas.microsoft.com/visio/2010/relationships/pages",
+    "page": "http://schemas.microsoft.com/visio/2010/relationships/page",
+    "masters": "http://schemas.microsoft.com/visio/2010/relationships/masters",
+    "master": "http://schemas.microsoft.com/visio/2010/relationships/master",
+}
+CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+XML_HEADER = "<?xml version='1.0' encoding='utf-8' ?>\n"
+ROOT_ATTRIBUTES = f"xmlns='{VISIO_NS}' xmlns:r='{REL_NS}' xml:space='preserve'"
+# Master elements copied from stencils are re-serialized with the prefixes Visio uses
+ET.register_namespace("", VISIO_NS)
+ET.register_namespace("r", REL_NS)
+
+def load_stencil_catalog(path: Optional[str] = None) -> Dict:
+    path = path or STENCIL_CATALOG_PATH
+    if not path:
+        return DEFAULT_STENCIL_CATALOG
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _cell(name: str, value, formula: Optional[str] = None) -> str:
+    value = round(value, 6) if isinstance(value, float) else value
+    formula = f" F={quoteattr(formula)}" if formula else ""
+    return f"<Cell N='{name}' V={quoteattr(str(value))}{formula}/>"
+
+# Built-in master geometry, in the master's own coordinates
+def _builtin_geometry(shape_type: str) -> str:
+    if shape_type == "circle":
+        row = ("<Row T='Ellipse' IX='1'>" + _cell("X", 0.5, "Width*0.5") + _cell("Y", 0.5, "Height*0.5") +
+               _cell("A", 1, "Width*1") + _cell("B", 0.5, "Height*0.5") +
+               _cell("C", 0.5, "Width*0.5") + _cell("D", 1, "Height*1") + "</Row>")
+        return f"<Section N='Geometry' IX='0'>{row}</Section>"
+    if shape_type == "line":
+        return ("<Section N='Geometry' IX='0'><Row T='MoveTo' IX='1'>" + _cell("X", 0) + _cell("Y", 0) +
+                "</Row><Row T='LineTo' IX='2'>" + _cell("X", 1, "Width*1") + _cell("Y", 0) + "</Row></Section>")
+    corners = [(0, 0, "Width*0", "Height*0"), (1, 0, "Width*1", "Height*0"), (1, 1, "Width*1", "Height*1"),
+               (0, 1, "Width*0", "Height*1"), (0, 0, "Geometry1.X1", "Geometry1.Y1")]
+    rows = "".join(
+        f"<Row T='{'MoveTo' if i == 0 else 'LineTo'}' IX='{i + 1}'>" + _cell("X", x, fx) + _cell("Y", y, fy) + "</Row>"
+        for i, (x, y, fx, fy) in enumerate(corners)
+    )
+    return f"<Section N='Geometry' IX='0'>{rows}</Section>"
+
+def _builtin_master(shape_type: str) -> str:
+    if shape_type == "line":
+        cells = (_cell("Width", 1) + _cell("Height", 0) + _cell("ObjType", 2) +
+                 _cell("BeginX", 0) + _cell("BeginY", 0) + _cell("EndX", 1) + _cell("EndY", 0) + _cell("EndArrow", 13))
+    else:
+        cells = _cell("Width", 1) + _cell("Height", 1) + _cell("LocPinX", 0.5, "Width*0.5") + _cell("LocPinY", 0.5, "Height*0.5")
+    return (f"{XML_HEADER}<MasterContents {ROOT_ATTRIBUTES}><Shapes><Shape ID='5' Type='Shape'>"
+            f"{cells}{_builtin_geometry(shape_type)}</Shape></Shapes></MasterContents>")
+
+def _shape_tree(element) -> List[tuple]:
+    """
+    (id, children) for each direct sub-shape of a master's shape, recursively.
+    """
+    shapes = element.find(_tag("Shapes"))
+    if shapes is None:
+        return []
+    return [(shape.get("ID"), _shape_tree(shape)) for shape in shapes.findall(_tag("Shape"))]
+
+def _stencil_master(stencil_path: str, name: str):
+    """
+    (Master element, master part XML, top shape id, sub-shape tree) for a master of a stencil file, or None.
+    """
+    with zipfile.ZipFile(stencil_path) as package:
+        part = "visio/masters/masters.xml"
+        rels = _relationships(package, part)
+        for master in ET.fromstring(package.read(part)).iter(_tag("Master")):
+            if name not in (master.get("NameU"), master.get("Name")):
+                continue
+            rel = master.find(_tag("Rel"))
+            contents = package.read(rels[rel.get(f"{{{REL_NS}}}id")])
+            top = ET.fromstring(contents).find(_tag("Shapes")).find(_tag("Shape"))
+            return master, contents, top.get("ID"), _shape_tree(top)
+    return None
+
+class _Masters:
+    """
+    Masters used by a drawing, added on first use.
+    """
+    def __init__(self, catalog: Dict, stencil_dir: str):
+        self.catalog = catalog
+        self.stencil_dir = stencil_dir
+        self.entries: Dict[str, Dict] = {}  # shape type -> id, name, element XML, part XML, sub-shape tree
+
+    def get(self, shape_type: str) -> Dict:
+        entry = self.entries.get(shape_type)
+        if entry is not None:
+            return entry
+        name = self.catalog["masters"].get(shape_type)
+        if name is None:
+            raise ValueError(f"Stencil catalog has no master for shape '{shape_type}'")
+        master_id = str(len(self.entries) + 2)
+        rel_id = f"rId{len(self.entries) + 1}"
+        stencil = self.catalog.get("stencil")
+        stencil_path = os.path.join(self.stencil_dir, stencil) if stencil else None
+        found = _stencil_master(stencil_path, name) if stencil_path and os.path.isfile(stencil_path) else None
+        if found is not None:
+            master, contents, top_id, tree = found
+            master.set("ID", master_id)
+            master.set("MatchByName", "1")
+            master.find(_tag("Rel")).set(f"{{{REL_NS}}}id", rel_id)
+            element = ET.tostring(master, encoding="unicode")
+        else:
+            unique = uuid.uuid5(uuid.NAMESPACE_URL, f"vsdx-writer:{name}")
+            element = (f"<Master ID='{master_id}' NameU={quoteattr(name)} Name={quoteattr(name)} IconSize='1' "
+                       f"AlignName='2' MatchByName='1' IconUpdate='1' UniqueID='{{{unique}}}' BaseID='{{{unique}}}' "
+                       f"PatternFlags='0' Hidden='0' MasterType='2'><Rel r:id='{rel_id}'/></Master>")
+            contents, top_id, tree = _builtin_master(shape_type).encode("utf-8"), "5", []
+        entry = self.entries[shape_type] = {
+            "id": master_id, "name": name, "rel_id": rel_id, "element": element,
+            "contents": contents, "top_id": top_id, "tree": tree,
+        }
+        return entry
+
+def _resolve(reference, shapes: List[Dict]) -> Optional[Dict]:
+    if not reference:
+        return None
+    matched = CanvasState(shapes).matches(reference)
+    return matched[-1] if matched else None
+
+def layout_actions(actions, connections: Optional[List[Dict]] = None) -> tuple:
+    """
+    Applies a validated action list in order; returns (shapes, connectors). connect_shapes actions
+    and the extra connections ({"from": ..., "to": ...} names or field dicts) become connectors
+    between the shapes they reference, which must exist by then.
+    """
+    problems = validate_actions(actions)
+    if problems:
+        raise ValueError("; ".join(problems))
+    actions = expand_bulk_actions(actions)
+    actions = [actions] if isinstance(actions, dict) else actions
+    shapes, links = [], []
+    for action in actions + [dict(c, action="connect_shapes") for c in connections or []]:
+        kind = action["action"]
+        if kind == "create_shape":
+            default = action["radius"] * 2 if "radius" in action else DEFAULT_SIZE
+            width, height = action.get("width", default), action.get("height", default)
+            x, y = clamp_to_canvas(action.get("x", 50), action.get("y", 50), width, height)
+            shape = {"shape": action["shape"], "x": x, "y": y, "width": width, "height": height,
+                     "color": action.get("color"), "text": action.get("text")}
+            shape["name"] = action.get("name") or f"{action['shape']}.{len(shapes) + 1}"
+            shapes.append(shape)
+        elif kind in ("modify_shape", "delete_shape"):
+            target = _resolve(_target_reference(action), shapes)
+            if target is None:
+                raise ValueError(f"{kind} references a shape that is not in the diagram: {_target_reference(action)}")
+            if kind == "delete_shape":
+                shapes = [shape for shape in shapes if shape is not target]
+                links = [link for link in links if all(end is not target for end in link)]
+            else:
+                target.update({key: action[key] for key in ("color", "width", "height", "x", "y") if key in action})
+        elif kind == "connect_shapes":
+            ends = (action.get("from") or action.get("shape1"), action.get("to") or action.get("shape2"))
+            resolved = [_resolve(end, shapes) for end in ends]
+            if None in resolved:
+                raise ValueError(f"Connection references a shape that is not in the diagram: {ends}")
+            links.append(tuple(resolved))
+    return shapes, links
+
+def _instance_shapes(tree: List[tuple], next_id) -> str:
+    return "".join(
+        f"<Shape ID='{next_id()}' Type='Shape' MasterShape='{sub_id}'>" +
+        (f"<Shapes>{_instance_shapes(children, next_id)}</Shapes>" if children else "") + "</Shape>"
+        for sub_id, children in tree
+    )
+
+def _page_contents(shapes: List[Dict], links: List[tuple], masters: _Masters, width: float, height: float) -> str:
+    counter = iter(range(1, 1 << 30))
+    next_id = lambda: next(counter)
+    parts, connects = [], []
+    for shape in shapes:
+        master = masters.get(shape["shape"])
+        shape["_id"] = next_id()
+        pin_x, pin_y = shape["x"] / 100 * width, (1 - shape["y"] / 100) * height
+        cells = (_cell("PinX", pin_x) + _cell("PinY", pin_y) + _cell("Width", shape["width"] / 100 * width) +
+                 _cell("Height", shape["height"] / 100 * height) +
+                 _cell("LocPinX", shape["width"] / 200 * width, "Width*0.5") +
+                 _cell("LocPinY", shape["height"] / 200 * height, "Height*0.5"))
+        fill = color_hex(shape.get("color"))
+        if fill:
+            cells += _cell("FillForegnd", fill)
+        text = f"<Text>{escape(shape['text'])}</Text>" if shape.get("text") else ""
+        children = f"<Shapes>{_instance_shapes(master['tree'], next_id)}</Shapes>" if master["tree"] else ""
+        parts.append(f"<Shape ID='{shape['_id']}' NameU={quoteattr(shape['name'])} Name={quoteattr(shape['name'])} "
+                     f"Type='{'Group' if master['tree'] else 'Shape'}' Master='{master['id']}'>{cells}{text}{children}</Shape>")
+    for source, target in links:
+        master = masters.get("line")
+        connector_id = next_id()
+        begin = (source["x"] / 100 * width, (1 - source["y"] / 100) * height)
+        end = (target["x"] / 100 * width, (1 - target["y"] / 100) * height)
+        # Glued with the same triggers Visio writes, so the connector follows the shapes when moved
+        cells = (_cell("BeginX", begin[0], "_WALKGLUE(BegTrigger,EndTrigger,WalkPreference)") +
+                 _cell("BeginY", begin[1], "_WALKGLUE(BegTrigger,EndTrigger,WalkPreference)") +
+                 _cell("EndX", end[0], "_WALKGLUE(EndTrigger,BegTrigger,WalkPreference)") +
+                 _cell("EndY", end[1], "_WALKGLUE(EndTrigger,BegTrigger,WalkPreference)") +
+                 _cell("BegTrigger", 2, f"_XFTRIGGER(Sheet.{source['_id']}!EventXFMod)") +
+                 _cell("EndTrigger", 2, f"_XFTRIGGER(Sheet.{target['_id']}!EventXFMod)"))
+        name = f"Connector.{connector_id}"
+        parts.append(f"<Shape ID='{connector_id}' NameU='{name}' Name='{name}' Type='Shape' Master='{master['id']}'>{cells}</Shape>")
+        connects.append(f"<Connect FromSheet='{connector_id}' FromCell='BeginX' FromPart='9' ToSheet='{source['_id']}' ToCell='PinX' ToPart='3'/>")
+        connects.append(f"<Connect FromSheet='{connector_id}' FromCell='EndX' FromPart='12' ToSheet='{target['_id']}' ToCell='PinX' ToPart='3'/>")
+    connects_xml = f"<Connects>{''.join(connects)}</Connects>" if connects else ""
+    return f"{XML_HEADER}<PageContents {ROOT_ATTRIBUTES}><Shapes>{''.join(parts)}</Shapes>{connects_xml}</PageContents>"
+
+def _relationships_xml(relationships: List[tuple]) -> str:
+    rels = "".join(f"<Relationship Id='{rel_id}' Type='{rel_type}' Target='{target}'/>" for rel_id, rel_type, target in relationships)
+    return f"{XML_HEADER}<Relationships xmlns='{PACKAGE_REL_NS}'>{rels}</Relationships>"
+
+def _template_parts(template: Optional[str]) -> Dict[str, bytes]:
+    """
+    Parts of the template drawing other than its pages and masters.
+    """
+    if not template or not os.path.isfile(template):
+        return {}
+    with zipfile.ZipFile(template) as package:
+        return {
+            name: package.read(name) for name in package.namelist()
+            if not name.startswith(("visio/pages/", "visio/masters/")) and not name.startswith("docProps/thumbnail")
+        }
+
+def _content_types(parts: Dict[str, bytes], overrides: Dict[str, str]) -> str:
+    defaults = {"rels": "application/vnd.openxmlformats-package.relationships+xml", "xml": "application/xml"}
+    if "[Content_Types].xml" in parts:
+        root = ET.fromstring(parts["[Content_Types].xml"])
+        for default in root.iter(f"{{{CONTENT_TYPES_NS}}}Default"):
+            defaults[default.get("Extension")] = default.get("ContentType")
+        for override in root.iter(f"{{{CONTENT_TYPES_NS}}}Override"):
+            name = override.get("PartName").lstrip("/")
+            if name in parts and not name.startswith(("visio/pages/", "visio/masters/")):
+                overrides.setdefault(name, override.get("ContentType"))
+    body = "".join(f"<Default Extension='{ext}' ContentType='{ct}'/>" for ext, ct in defaults.items())
+    body += "".join(f"<Override PartName='/{name}' ContentType='{ct}'/>" for name, ct in overrides.items())
+    return f"{XML_HEADER}<Types xmlns='{CONTENT_TYPES_NS}'>{body}</Types>"
+
+def _document_relationships(parts: Dict[str, bytes], has_masters: bool) -> str:
+    relationships = []
+    if "visio/_rels/document.xml.rels" in parts:
+        root = ET.fromstring(parts["visio/_rels/document.xml.rels"])
+        relationships = [
+            (rel.get("Id"), rel.get("Type"), rel.get("Target"))
+            for rel in root.iter(f"{{{PACKAGE_REL_NS}}}Relationship")
+            if rel.get("Type") not in (REL_TYPES["pages"], REL_TYPES["masters"])
+        ]
+    relationships.append(("rIdPages", REL_TYPES["pages"], "pages/pages.xml"))
+    if has_masters:
+        relationships.append(("rIdMasters", REL_TYPES["masters"], "masters/masters.xml"))
+    return _relationships_xml(relationships)
+
+def build_vsdx(actions, connections: Optional[List[Dict]] = None, page_width: float = DEFAULT_PAGE_WIDTH,
+               page_height: float = DEFAULT_PAGE_HEIGHT, page_name: str = "Page-1", catalog: Optional[Dict] = None,
+               template: Optional[str] = TEMPLATE_PATH, stencil_dir: str = STENCIL_DIR) -> bytes:
+    """
+    Returns a .vsdx package with one page holding the shapes and connectors of the action list.
+    Raises ValueError for invalid actions or references to shapes that don't exist.
+    """
+    started = time.perf_counter()
+    shapes, links = layout_actions(actions, connections)
+    masters = _Masters(catalog or load_stencil_catalog(), stencil_dir)
+    page = _page_contents(shapes, links, masters, page_width, page_height)
+    parts = _template_parts(template)
+    overrides = {"visio/document.xml": CONTENT_TYPES["document"], "visio/pages/pages.xml": CONTENT_TYPES["pages"],
+                 "visio/pages/page1.xml": CONTENT_TYPES["page"]}
+    if "visio/document.xml" not in parts:
+        parts["visio/document.xml"] = f"{XML_HEADER}<VisioDocument {ROOT_ATTRIBUTES}/>".encode("utf-8")
+        parts["_rels/.rels"] = _relationships_xml([("rId1", REL_TYPES["document"], "visio/document.xml")]).encode("utf-8")
+    parts["visio/_rels/document.xml.rels"] = _document_relationships(parts, bool(masters.entries)).encode("utf-8")
+    parts["visio/pages/pages.xml"] = (
+        f"{XML_HEADER}<Pages {ROOT_ATTRIBUTES}><Page ID='0' NameU={quoteattr(page_name)} Name={quoteattr(page_name)}>"
+        f"<PageSheet>{_cell('PageWidth', page_width)}{_cell('PageHeight', page_height)}</PageSheet>"
+        f"<Rel r:id='rId1'/></Page></Pages>"
+    ).encode("utf-8")
+    parts["visio/pages/_rels/pages.xml.rels"] = _relationships_xml([("rId1", REL_TYPES["page"], "page1.xml")]).encode("utf-8")
+    parts["visio/pages/page1.xml"] = page.encode("utf-8")
+    if masters.entries:
+        entries = sorted(masters.entries.values(), key=lambda entry: int(entry["id"]))
+        parts["visio/masters/masters.xml"] = (
+            f"{XML_HEADER}<Masters {ROOT_ATTRIBUTES}>{''.join(entry['element'] for entry in entries)}</Masters>"
+        ).encode("utf-8")
+        parts["visio/masters/_rels/masters.xml.rels"] = _relationships_xml(
+            [(entry["rel_id"], REL_TYPES["master"], f"master{entry['id']}.xml") for entry in entries]).encode("utf-8")
+        overrides["visio/masters/masters.xml"] = CONTENT_TYPES["masters"]
+        for entry in entries:
+            parts[f"visio/masters/master{entry['id']}.xml"] = entry["contents"]
+            overrides[f"visio/masters/master{entry['id']}.xml"] = CONTENT_TYPES["master"]
+    # The template's package relationships may point at its thumbnail, which is not copied
+    if "_rels/.rels" in parts:
+        root = ET.fromstring(parts["_rels/.rels"])
+        parts["_rels/.rels"] = _relationships_xml([
+            (rel.get("Id"), rel.get("Type"), rel.get("Target")) for rel in root.iter(f"{{{PACKAGE_REL_NS}}}Relationship")
+            if posixpath.normpath(rel.get("Target")).lstrip("/") in parts
+        ]).encode("utf-8")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", _content_types(parts, overrides))
+        for name, data in parts.items():
+            if name != "[Content_Types].xml":
+                package.writestr(name, data)
+    logging.info(f"Wrote .vsdx with {len(shapes)} shapes and {len(links)} connectors in "
+                 f"{(time.perf_counter() - started) * 1000:.1f} ms.")
+    return buffer.getvalue()
+
+def write_vsdx(path: str, actions, connections: Optional[List[Dict]] = None, **options) -> str:
+    data = build_vsdx(actions, connections, **options)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write Action Agent actions to a .vsdx drawing.")
+    parser.add_argument("actions", help="JSON file with an action object or array")
+    parser.add_argument("--connections", help="JSON file with [{\"from\": ..., \"to\": ...}] connections")
+    parser.add_argument("--output", default="diagram.vsdx")
+    args = parser.parse_args()
+
+    with open(args.actions, "r", encoding="utf-8") as f:
+        actions = json.load(f)
+    connections = None
+    if args.connections:
+        with open(args.connections, "r", encoding="utf-8") as f:
+            connections = json.load(f)
+    print(write_vsdx(args.output, actions, connections))
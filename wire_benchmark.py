@@ -0,0 +1,109 @@
+import argparse
+import json
+import logging
+import random
+import time
+from typing import Dict, List
+
+from stats_utils import percentile
+from tools import DEFAULT_PALETTE, SHAPE_TYPES
+from wire_format import MSGPACK_AVAILABLE, WireFormat
+
+logging.basicConfig(level=logging.INFO)
+
+# Serialization time and bytes on the wire for the payloads the add-in and the service exchange,
+# built for realistic diagrams: the canvas report a client sends, the action list the service
+# returns, and a parsed .vsdx page (vsdx_parser) with text, geometry and connections.
+
+def synthetic_diagram(shapes: int, seed: int = 0) -> Dict[str, object]:
+    rng = random.Random(seed)
+    names = [f"{rng.choice(['Process', 'Decision', 'Server', 'Database', 'User'])} {i}" for i in range(shapes)]
+    records = []
+    for i, name in enumerate(names):
+        shape = rng.choice(SHAPE_TYPES[:3])
+        records.append({
+            "name": name, "shape": shape, "color": rng.choice(DEFAULT_PALETTE),
+            "x": round(rng.uniform(5, 95), 3), "y": round(rng.uniform(5, 95), 3),
+            "width": round(rng.uniform(2, 10), 3), "height": round(rng.uniform(2, 10), 3),
+        })
+    links = [(rng.randrange(shapes), rng.randrange(shapes)) for _ in range(shapes // 2)]
+    canvas = {"type": "canvas_state", "shapes": [{k: r[k] for k in ("name", "shape", "color", "x", "y")} for r in records]}
+    actions = [dict(record, action="create_shape") for record in records] + [
+        {"action": "connect_shapes", "shape": "line", "shape1": names[a], "shape2": names[b]} for a, b in links
+    ]
+    page = {
+        "page": "Page-1", "width": 11.0, "height": 8.5, "source": "diagram.vsdx",
+        "shapes": [
+            dict(record, id=str(i + 1), master=record["shape"].capitalize(), parent=None,
+                 text=f"{record['name']} handles step {i} of the workflow",
+                 geometry=[{"type": "MoveTo", "x": 0.0, "y": 0.0}, {"type": "LineTo", "x": record["width"], "y": 0.0},
+                           {"type": "LineTo", "x": record["width"], "y": record["height"]},
+                           {"type": "LineTo", "x": 0.0, "y": 0.0}])
+            for i, record in enumerate(records)
+        ],
+        "connections": [{"connector": f"Dynamic connector.{i}", "from": names[a], "to": names[b]} for i, (a, b) in enumerate(links)],
+    }
+    return {"canvas_state": canvas, "actions": actions, "vsdx_page": page}
+
+def benchmark_payload(payload, wire: WireFormat, repeat: int) -> Dict:
+    encode_times, decode_times = [], []
+    data = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data, _ = wire.encode(payload)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        decoded = wire.decode(data)
+        decode_times.append(time.perf_counter() - start)
+    assert decoded == payload, "payload did not survive a round trip"
+    return {
+        "bytes": len(data),
+        "encode_p50_ms": percentile(encode_times, 50) * 1000,
+        "encode_p99_ms": percentile(encode_times, 99) * 1000,
+        "decode_p50_ms": percentile(decode_times, 50) * 1000,
+        "decode_p99_ms": percentile(decode_times, 99) * 1000,
+    }
+
+def wire_formats(levels: List[int]) -> Dict[str, WireFormat]:
+    formats = {"json": WireFormat("json")}
+    formats.update({f"json+gzip{level}": WireFormat("json", True, 0, level) for level in levels})
+    if MSGPACK_AVAILABLE:
+        formats["msgpack"] = WireFormat("msgpack")
+        formats.update({f"msgpack+gzip{level}": WireFormat("msgpack", True, 0, level) for level in levels})
+    return formats
+
+def run_benchmark(shapes: int, repeat: int, levels: List[int]) -> Dict[str, List[Dict]]:
+    reports = {}
+    for name, payload in synthetic_diagram(shapes).items():
+        reports[name] = []
+        baseline = None
+        for label, wire in wire_formats(levels).items():
+            report = dict(benchmark_payload(payload, wire, repeat), format=label)
+            baseline = baseline or report["bytes"]
+            report["size_vs_json"] = report["bytes"] / baseline
+            reports[name].append(report)
+    return reports
+
+def print_reports(name: str, reports: List[Dict]):
+    metrics = ["bytes", "size_vs_json", "encode_p50_ms", "encode_p99_ms", "decode_p50_ms", "decode_p99_ms"]
+    print(f"\n{name}")
+    print(f"{'format':<16}" + "".join(f"{metric:>15}" for metric in metrics))
+    for report in reports:
+        print(f"{report['format']:<16}" + "".join(
+            f"{report[metric]:>15.3f}" if isinstance(report[metric], float) else f"{report[metric]:>15}" for metric in metrics))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare JSON and MessagePack (with and without gzip) for diagram payloads.")
+    parser.add_argument("--shapes", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--gzip-levels", default="1,6", help="Comma-separated gzip levels to compare")
+    parser.add_argument("--output", help="Write all reports as JSON")
+    args = parser.parse_args()
+
+    all_reports = run_benchmark(args.shapes, args.repeat, [int(level) for level in args.gzip_levels.split(",")])
+    print(f"Diagrams with {args.shapes} shapes, {args.repeat} runs per format")
+    for name, reports in all_reports.items():
+        print_reports(name, reports)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(all_reports, f, indent=2)
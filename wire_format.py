@@ -0,0 +1,242 @@
+import gzip
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.websockets import WebSocketDisconnect
+
+logging.basicConfig(level=logging.INFO)
+
+# Optional binary encoding between clients and the service. JSON stays the default; a client opts
+# into MessagePack per connection, and large payloads are gzip-compressed in either encoding.
+#
+#   HTTP       "Accept: application/msgpack" for msgpack responses, "Content-Type: application/msgpack"
+#              for msgpack request bodies, "Accept-Encoding: gzip" / "Content-Encoding: gzip" as usual
+#   WebSocket  subprotocol "visio.msgpack" or "visio.json" (add "+gzip" for compression), or the
+#              query parameters ?wire=msgpack&compress=1. Msgpack messages travel as binary frames;
+#              a compressed frame is a gzip stream and is recognised by its magic bytes.
+#
+#   WIRE_COMPRESS_MIN_BYTES  payloads smaller than this are sent uncompressed (default 4096)
+#   WIRE_COMPRESS_LEVEL      gzip level (default 1; higher levels cost far more time than they save bytes)
+WIRE_COMPRESS_MIN_BYTES = int(os.environ.get("WIRE_COMPRESS_MIN_BYTES", "4096"))
+WIRE_COMPRESS_LEVEL = int(os.environ.get("WIRE_COMPRESS_LEVEL", "1"))
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+WEBSOCKET_SUBPROTOCOLS = ["visio.msgpack+gzip", "visio.msgpack", "visio.json+gzip", "visio.json"]
+GZIP_MAGIC = b"\x1f\x8b"
+
+# ormsgpack is preferred for speed; the msgpack package works too, and without either only JSON is offered
+try:
+    import ormsgpack
+
+    def _packb(value) -> bytes:
+        return ormsgpack.packb(value, option=ormsgpack.OPT_NON_STR_KEYS | ormsgpack.OPT_SERIALIZE_NUMPY)
+
+    _unpackb = ormsgpack.unpackb
+except ImportError:
+    try:
+        import msgpack
+
+        def _packb(value) -> bytes:
+            return msgpack.packb(value, use_bin_type=True)
+
+        def _unpackb(data: bytes):
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except ImportError:
+        _packb = _unpackb = None
+
+MSGPACK_AVAILABLE = _packb is not None
+
+class WireFormat:
+    def __init__(self, encoding: str = "json", compress: bool = False,
+                 compress_min_bytes: int = WIRE_COMPRESS_MIN_BYTES, compress_level: int = WIRE_COMPRESS_LEVEL):
+        if encoding == "msgpack" and not MSGPACK_AVAILABLE:
+            raise ValueError("MessagePack encoding needs the ormsgpack or msgpack package")
+        self.encoding = encoding
+        self.compress = compress
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+
+    @property
+    def media_type(self) -> str:
+        return MSGPACK_MEDIA_TYPES[0] if self.encoding == "msgpack" else JSON_MEDIA_TYPE
+
+    @property
+    def subprotocol(self) -> str:
+        return f"visio.{self.encoding}" + ("+gzip" if self.compress else "")
+
+    def encode(self, value) -> Tuple[bytes, bool]:
+        """
+        Serialized value and whether it was compressed.
+        """
+        data = _packb(value) if self.encoding == "msgpack" else json.dumps(value).encode("utf-8")
+        if self.compress and len(data) >= self.compress_min_bytes:
+            return gzip.compress(data, self.compress_level), True
+        return data, False
+
+    def decode(self, data: bytes):
+        if data[:2] == GZIP_MAGIC:
+            data = gzip.decompress(data)
+        return _unpackb(data) if self.encoding == "msgpack" else json.loads(data)
+
+def negotiate_websocket(scope) -> WireFormat:
+    """
+    Wire format for a WebSocket connection: the first supported subprotocol the client offers,
+    else the ?wire= and ?compress= query parameters, else plain JSON.
+    """
+    for offered in scope.get("subprotocols") or []:
+        if offered in WEBSOCKET_SUBPROTOCOLS:
+            encoding, _, compression = offered[len("visio."):].partition("+")
+            if encoding == "msgpack" and not MSGPACK_AVAILABLE:
+                continue
+            return WireFormat(encoding, compression == "gzip")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    encoding = query.get("wire", ["json"])[0].lower()
+    compress = query.get("compress", ["0"])[0].lower() in ("1", "true", "yes")
+    if encoding != "msgpack" or not MSGPACK_AVAILABLE:
+        encoding = "json"
+    return WireFormat(encoding, compress)
+
+class WebSocketWire:
+    """
+    Sends and receives messages on a WebSocket in the negotiated format. JSON messages that are not
+    compressed stay text frames, so existing clients see no change.
+    """
+    def __init__(self, websocket, wire: WireFormat, subprotocol: Optional[str] = None):
+        self.websocket = websocket
+        self.wire = wire
+        self.subprotocol = subprotocol
+
+    @classmethod
+    async def accept(cls, websocket) -> "WebSocketWire":
+        wire = negotiate_websocket(websocket.scope)
+        subprotocol = wire.subprotocol if wire.subprotocol in (websocket.scope.get("subprotocols") or []) else None
+        await websocket.accept(subprotocol=subprotocol)
+        return cls(websocket, wire, subprotocol)
+
+    async def receive(self):
+        """
+        The next message: text frames are returned as received, binary frames decoded.
+        """
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        if message.get("text") is not None:
+            return message["text"]
+        return self.wire.decode(message["bytes"])
+
+    async def send(self, value):
+        data, compressed = self.wire.encode(value)
+        if self.wire.encoding == "json" and not compressed:
+            await self.websocket.send_text(data.decode("utf-8"))
+        else:
+            await self.websocket.send_bytes(data)
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> str:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1").lower()
+    return ""
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    return any(part.split(";")[0].strip() == "gzip" and "q=0" not in part.replace(" ", "")
+               for part in accept_encoding.split(","))
+
+class WireFormatMiddleware:
+    """
+    HTTP side of the wire format: msgpack and gzip request bodies are turned into JSON before the
+    endpoint sees them, and JSON responses are re-encoded as msgpack and/or gzipped as the client asks.
+    """
+    def __init__(self, app, compress_min_bytes: int = WIRE_COMPRESS_MIN_BYTES, compress_level: int = WIRE_COMPRESS_LEVEL):
+        self.app = app
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = scope.get("headers", [])
+        content_type = _header(headers, b"content-type").split(";")[0].strip()
+        request_gzip = _header(headers, b"content-encoding") == "gzip"
+        request_msgpack = content_type in MSGPACK_MEDIA_TYPES and MSGPACK_AVAILABLE
+        accept = _header(headers, b"accept")
+        encoding = "msgpack" if MSGPACK_AVAILABLE and any(t in accept for t in MSGPACK_MEDIA_TYPES) else "json"
+        compress = _accepts_gzip(_header(headers, b"accept-encoding"))
+        if not (request_gzip or request_msgpack or encoding == "msgpack" or compress):
+            await self.app(scope, receive, send)
+            return
+
+        if request_gzip or request_msgpack:
+            scope, receive = await self._convert_request(scope, receive, request_gzip, request_msgpack)
+        wire = WireFormat(encoding, compress, self.compress_min_bytes, self.compress_level)
+        await self.app(scope, receive, self._response_sender(send, wire))
+
+    async def _convert_request(self, scope, receive, request_gzip: bool, request_msgpack: bool):
+        body, more = b"", True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        if request_gzip:
+            body = gzip.decompress(body)
+        if request_msgpack:
+            body = json.dumps(_unpackb(body)).encode("utf-8") if body else b""
+        dropped = (b"content-type", b"content-length", b"content-encoding")
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in dropped]
+        headers += [(b"content-length", str(len(body)).encode())]
+        if request_msgpack:
+            headers.append((b"content-type", JSON_MEDIA_TYPE.encode()))
+        else:
+            headers += [(k, v) for k, v in scope["headers"] if k.lower() == b"content-type"]
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return dict(scope, headers=headers), replay
+
+    def _response_sender(self, send, wire: WireFormat):
+        start = None
+        chunks = []
+
+        async def sender(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                media_type = _header(message.get("headers", []), b"content-type").split(";")[0].strip()
+                encoded = _header(message.get("headers", []), b"content-encoding")
+                if encoded or not (media_type == JSON_MEDIA_TYPE or wire.compress and media_type.startswith("text/")):
+                    # Already encoded, or not something this middleware rewrites
+                    start = None
+                    await send(message)
+                return
+            if start is None:
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await send_body(b"".join(chunks))
+
+        async def send_body(body: bytes):
+            headers = [(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"content-length", b"content-type")]
+            media_type = _header(start.get("headers", []), b"content-type")
+            if media_type.startswith(JSON_MEDIA_TYPE) and wire.encoding == "msgpack" and body:
+                body, media_type = _packb(json.loads(body)), wire.media_type
+            if wire.compress and len(body) >= wire.compress_min_bytes:
+                body = gzip.compress(body, wire.compress_level)
+                headers.append((b"content-encoding", b"gzip"))
+            headers += [(b"content-type", media_type.encode("latin-1")), (b"content-length", str(len(body)).encode())]
+            headers.append((b"vary", b"Accept, Accept-Encoding"))
+            await send(dict(start, headers=headers))
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        return sender
@@ -0,0 +1,622 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+logging.basicConfig(level=logging.INFO)
+
+# Runs the n8n workflow definitions in this repository inside the service. A workflow is loaded
+# from its exported JSON and executed as an async DAG starting at a webhook: every node starts as
+# soon as the nodes feeding it have finished, so independent branches run concurrently, and each
+# node's duration is recorded. HTTP nodes that call another workflow's webhook on the n8n host, or a
+# route the service registers, are executed in-process instead of going over the network.
+#
+# Supported node types: webhook and chat triggers, code, switch, HTTP request, merge, respond to
+# webhook, and LLM chain / agent nodes (a single model call through the llm hook; agent tools are
+# not run). Code nodes hold JavaScript, so each one runs through a Python port registered under a
+# digest of its source; a node whose code was edited without updating its port is reported as
+# unsupported instead of running stale logic.
+
+WORKFLOW_FILES = os.environ.get(
+    "WORKFLOW_FILES", "VisioCommandProcessorWorkflow.json,VisioChat_Agents.json,OngoingAgent.json").split(",")
+N8N_BASE_URLS = os.environ.get("N8N_BASE_URLS", "http://localhost:5678,http://127.0.0.1:5678").split(",")
+
+class UnsupportedNode(Exception):
+    pass
+
+class WorkflowError(Exception):
+    def __init__(self, message: str, run: "WorkflowRun"):
+        super().__init__(message)
+        self.run = run
+
+# Python ports of Code nodes, keyed by a digest of the whitespace-normalized JavaScript
+CODE_NODES: Dict[str, Callable[[Dict], object]] = {}
+
+def code_digest(js_code: str) -> str:
+    return hashlib.sha1(" ".join(js_code.split()).encode("utf-8")).hexdigest()[:16]
+
+def code_node(digest: str):
+    def register(port):
+        CODE_NODES[digest] = port
+        return port
+    return register
+
+# VisioCommandProcessorWorkflow "Parse Command"
+@code_node("f64c0760c5a12b00")
+def _parse_command(item):
+    source = item.get("body") if item.get("body") is not None else item
+    return {"command": source.get("command"), "parameters": source.get("parameters")}
+
+# VisioChat_Agents "Code1": the Manager's JSON reply split into route and reply
+@code_node("24b40b5aef1889f1")
+def _manager_route(item):
+    output = json.loads(item.get("text"))
+    output = output if isinstance(output, dict) else {}
+    return {"route": output.get("route"), "reply": output.get("reply")}
+
+# OngoingAgent "Code1": as above, but a reply that isn't JSON is a chat answer
+@code_node("62c407c24ac8aa6f")
+def _manager_route_or_chat(item):
+    try:
+        output = json.loads(item.get("text"))
+    except (TypeError, json.JSONDecodeError):
+        return {"route": "manager", "reply": item.get("text")}
+    output = output if isinstance(output, dict) else {}
+    return {"route": output.get("route"), "reply": output.get("reply")}
+
+# OngoingAgent "Code"
+@code_node("bdf926b8b2f21970")
+def _reply_text(item):
+    return [{"text": item.get("reply")}]
+
+# OngoingAgent "Code2": the webhook's message renamed to chatInput
+@code_node("985ca1b5b9748516")
+def _chat_input(item):
+    body = item.get("body")
+    if isinstance(body, dict) and body.get("message"):
+        return {"chatInput": body["message"]}
+    return {"chatInput": "No chatInput found"}
+
+# n8n expressions: "={{ ... }}" strings. Only what these workflows use is understood: $json paths,
+# $('Node').item.json paths, string literals and || between them.
+_TEMPLATE = re.compile(r"\{\{(.*?)\}\}", re.S)
+_NODE_REFERENCE = re.compile(r"""\$\(\s*(['"])(.+?)\1\s*\)\.(?:item|first\(\))\.json""")
+_PATH_PART = re.compile(r"""\s*(?:\.([A-Za-z_$][\w$]*)|\[\s*(['"])(.*?)\2\s*\]|\[\s*(\d+)\s*\])""")
+_STRING = re.compile(r"""\s*(['"])(.*)\1\s*$""", re.S)
+
+def _split_or(expression: str) -> List[str]:
+    terms, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(expression):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "|" and depth == 0 and expression[i:i + 2] == "||":
+            terms.append(expression[start:i])
+            start = i + 2
+    terms.append(expression[start:])
+    return [term for term in terms if term and term != "|"]
+
+def _term(term: str, item: Dict, run: "WorkflowRun"):
+    term = term.strip()
+    if match := _STRING.match(term):
+        return match.group(2)
+    if term.startswith("$json"):
+        value, rest = item, term[len("$json"):]
+    elif match := _NODE_REFERENCE.match(term):
+        value, rest = run.first_item(match.group(2)), term[match.end():]
+    else:
+        raise UnsupportedNode(f"Unsupported expression: {term}")
+    while rest.strip():
+        match = _PATH_PART.match(rest)
+        if match is None:
+            raise UnsupportedNode(f"Unsupported expression: {term}")
+        key = match.group(1) or match.group(3)
+        if match.group(4) is not None:
+            value = value[int(match.group(4))] if isinstance(value, list) and int(match.group(4)) < len(value) else None
+        else:
+            value = value.get(key) if isinstance(value, dict) else None
+        rest = rest[match.end():]
+    return value
+
+def evaluate(expression: str, item: Dict, run: "WorkflowRun"):
+    value = None
+    for term in _split_or(expression):
+        value = _term(term, item, run)
+        if value:
+            return value
+    return value
+
+def render(value, item: Dict, run: "WorkflowRun", lenient: bool = False):
+    """
+    Resolves a node parameter. Strings starting with "=" are templates; a template that is a single
+    {{ }} keeps the value's type, otherwise values are interpolated as text. lenient keeps
+    expressions that can't be evaluated as written (prompts use {{ name }} as placeholders).
+    """
+    if not isinstance(value, str) or not value.startswith("="):
+        return value
+    template = value[1:]
+    whole = _TEMPLATE.fullmatch(template.strip())
+    if whole:
+        return evaluate(whole.group(1), item, run)
+    def interpolate(match):
+        try:
+            result = evaluate(match.group(1), item, run)
+        except UnsupportedNode:
+            if lenient:
+                return match.group(0)
+            raise
+        if result is None:
+            return ""
+        return json.dumps(result) if isinstance(result, (dict, list)) else str(result)
+    return _TEMPLATE.sub(interpolate, template)
+
+def _node_kind(node: Dict) -> str:
+    return node["type"].rsplit(".", 1)[-1]
+
+TRIGGER_KINDS = {"webhook", "chatTrigger", "manualTrigger", "executeWorkflowTrigger"}
+# Nodes wired into others through ai_* connections (models, tools, memory) or not executed at all
+CONFIG_KINDS = {"stickyNote", "lmOllama", "lmChatOllama", "toolCode", "toolWorkflow", "memoryBufferWindow"}
+
+class Workflow:
+    def __init__(self, definition: Dict, source: Optional[str] = None):
+        self.name = definition.get("name") or source
+        self.id = definition.get("id")
+        self.active = bool(definition.get("active", True))
+        self.source = source
+        self.nodes: Dict[str, Dict] = {}
+        for node in definition.get("nodes", []):
+            if node["name"] in self.nodes:
+                logging.warning(f"Workflow {self.name} has several nodes named '{node['name']}'; using the first.")
+                continue
+            self.nodes[node["name"]] = node
+        # node -> output index -> [(child, input index)] for main connections
+        self.edges: Dict[str, List[List[tuple]]] = {}
+        # node -> connection type -> [parent] for ai_* connections (model, tools, memory)
+        self.attachments: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+        for parent, by_type in definition.get("connections", {}).items():
+            for connection_type, outputs in by_type.items():
+                for output_index, targets in enumerate(outputs):
+                    for target in targets or []:
+                        if connection_type == "main":
+                            edges = self.edges.setdefault(parent, [])
+                            edges.extend([] for _ in range(output_index + 1 - len(edges)))
+                            edges[output_index].append((target["node"], target.get("index", 0)))
+                        else:
+                            self.attachments[target["node"]][connection_type].append(parent)
+        self._check_acyclic()
+
+    @classmethod
+    def load(cls, path: str) -> "Workflow":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), source=path)
+
+    def _check_acyclic(self):
+        state = {}
+        def visit(name):
+            state[name] = "open"
+            for targets in self.edges.get(name, []):
+                for child, _ in targets:
+                    if state.get(child) == "open":
+                        raise ValueError(f"Workflow {self.name} has a cycle through '{child}'")
+                    if child not in state:
+                        visit(child)
+            state[name] = "done"
+        for name in list(self.edges):
+            if name not in state:
+                visit(name)
+
+    def webhooks(self) -> Dict[str, str]:
+        """
+        Webhook path (without leading slash) -> trigger node name.
+        """
+        return {
+            node["parameters"].get("path", "").strip("/"): name
+            for name, node in self.nodes.items() if _node_kind(node) in ("webhook", "chatTrigger")
+            and node["parameters"].get("path")
+        }
+
+    def reachable(self, start: str) -> List[str]:
+        seen, order = {start}, [start]
+        for name in order:
+            for targets in self.edges.get(name, []):
+                for child, _ in targets:
+                    if child not in seen:
+                        seen.add(child)
+                        order.append(child)
+        return order
+
+    def unsupported(self) -> List[str]:
+        """
+        Nodes that can't run in-process: unknown node types and Code nodes without a Python port.
+        """
+        problems = []
+        for name, node in self.nodes.items():
+            kind = _node_kind(node)
+            if kind in CONFIG_KINDS:
+                continue
+            if kind not in NODE_EXECUTORS:
+                problems.append(f"{name}: node type {node['type']} is not supported")
+            elif kind == "code" and code_digest(node["parameters"].get("jsCode", "")) not in CODE_NODES:
+                problems.append(f"{name}: no Python port for code {code_digest(node['parameters'].get('jsCode', ''))}")
+        return problems
+
+class WorkflowRun:
+    def __init__(self, engine: "WorkflowEngine", workflow: Workflow):
+        self.engine = engine
+        self.workflow = workflow
+        self.outputs: Dict[str, List[List[Dict]]] = {}
+        self.timings: List[Dict] = []
+        self.response = None
+        self.responded = False
+        self.started = time.perf_counter()
+
+    def first_item(self, node_name: str) -> Dict:
+        outputs = self.outputs.get(node_name) or []
+        for items in outputs:
+            if items:
+                return items[0]
+        return {}
+
+    def result(self):
+        """
+        What the webhook answers: the Respond to Webhook body, else the last executed node's first item.
+        """
+        if self.responded:
+            return self.response
+        executed = [timing["node"] for timing in self.timings if timing["status"] == "ok"]
+        return self.first_item(executed[-1]) if executed else {}
+
+    def report(self) -> Dict:
+        return {
+            "workflow": self.workflow.name,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "nodes": self.timings,
+        }
+
+# Node executors: (run, node, items by input index) -> items per output
+async def _trigger(run, node, inputs):
+    return [inputs.get(0, [])]
+
+async def _code(run, node, inputs):
+    port = CODE_NODES.get(code_digest(node["parameters"].get("jsCode", "")))
+    if port is None:
+        raise UnsupportedNode(f"Code node '{node['name']}' has no Python port")
+    items = []
+    for item in inputs.get(0, []):
+        result = port(item)
+        items.extend(result if isinstance(result, list) else [result])
+    # Code nodes may return {"json": {...}} items
+    return [[item["json"] if isinstance(item, dict) and set(item) <= {"json", "pairedItem"} and "json" in item
+             else item for item in items]]
+
+_OPERATIONS = {
+    "equals": lambda a, b: a == b, "equal": lambda a, b: a == b,
+    "notEquals": lambda a, b: a != b, "notEqual": lambda a, b: a != b,
+    "contains": lambda a, b: isinstance(a, str) and str(b) in a,
+    "notContains": lambda a, b: not (isinstance(a, str) and str(b) in a),
+    "startsWith": lambda a, b: isinstance(a, str) and a.startswith(str(b)),
+    "endsWith": lambda a, b: isinstance(a, str) and a.endswith(str(b)),
+    "exists": lambda a, b: a is not None, "notExists": lambda a, b: a is None,
+    "gt": lambda a, b: a is not None and a > b, "larger": lambda a, b: a is not None and a > b,
+    "lt": lambda a, b: a is not None and a < b, "smaller": lambda a, b: a is not None and a < b,
+    "true": lambda a, b: a is True, "false": lambda a, b: a is False,
+}
+
+def _condition(condition: Dict, item: Dict, run: WorkflowRun, case_sensitive: bool) -> bool:
+    left, right = render(condition.get("leftValue"), item, run), render(condition.get("rightValue"), item, run)
+    operation = condition.get("operator", {}).get("operation", "equals")
+    if not case_sensitive and isinstance(left, str) and isinstance(right, str):
+        left, right = left.lower(), right.lower()
+    check = _OPERATIONS.get(operation)
+    if check is None:
+        raise UnsupportedNode(f"Unsupported condition operation: {operation}")
+    return check(left, right)
+
+def _rule_matches(rule: Dict, item: Dict, run: WorkflowRun) -> bool:
+    conditions = rule.get("conditions", {})
+    case_sensitive = conditions.get("options", {}).get("caseSensitive", True)
+    results = [_condition(c, item, run, case_sensitive) for c in conditions.get("conditions", [])]
+    return any(results) if conditions.get("combinator") == "or" else all(results)
+
+async def _switch(run, node, inputs):
+    parameters = node["parameters"]
+    if node.get("typeVersion", 1) >= 3:
+        rules = parameters.get("rules", {}).get("values", [])
+        matches = [lambda item, rule=rule: _rule_matches(rule, item, run) for rule in rules]
+        outputs_for = list(range(len(rules)))
+    else:
+        # Version 1: value1 compared with each rule's value2, routed to the rule's output
+        rules = parameters.get("rules", {}).get("rules", [])
+        operation = lambda rule: rule.get("operation", "equal")
+        matches = [
+            lambda item, rule=rule: _OPERATIONS[operation(rule)](render(parameters.get("value1"), item, run),
+                                                                 render(rule.get("value2"), item, run))
+            for rule in rules
+        ]
+        outputs_for = [rule.get("output", i) for i, rule in enumerate(rules)]
+    fallback = parameters.get("options", {}).get("fallbackOutput", parameters.get("fallbackOutput", -1))
+    all_matching = parameters.get("options", {}).get("allMatchingOutputs", False)
+    outputs = [[] for _ in range(max(outputs_for + [fallback if isinstance(fallback, int) else -1, -1]) + 1)]
+    for item in inputs.get(0, []):
+        matched = False
+        for match, output in zip(matches, outputs_for):
+            if match(item):
+                outputs[output].append(item)
+                matched = True
+                if not all_matching:
+                    break
+        if not matched and isinstance(fallback, int) and fallback >= 0:
+            outputs[fallback].append(item)
+    return outputs
+
+async def _http_request(run, node, inputs):
+    parameters = node["parameters"]
+    results = []
+    for item in inputs.get(0, []):
+        url = render(parameters.get("url"), item, run)
+        method = (render(parameters.get("method") or parameters.get("requestMethod"), item, run) or "GET").upper()
+        body = None
+        if parameters.get("sendBody") and parameters.get("specifyBody") == "json":
+            body = render(parameters.get("jsonBody"), item, run)
+        elif parameters.get("sendBody"):
+            body = {p["name"]: render(p.get("value"), item, run)
+                    for p in parameters.get("bodyParameters", {}).get("parameters", []) if p.get("name")}
+        elif parameters.get("jsonParameters") and "bodyParametersJson" in parameters:
+            body = render(parameters.get("bodyParametersJson"), item, run)
+        if isinstance(body, str):
+            body = json.loads(body) if body.strip() else None
+        results.append(await run.engine.request(method, url, body, run))
+    return [results]
+
+async def _respond(run, node, inputs):
+    items = inputs.get(0, [])
+    item = items[0] if items else {}
+    parameters = node["parameters"]
+    respond_with = parameters.get("respondWith", "firstIncomingItem")
+    if respond_with == "json":
+        body = render(parameters.get("responseBody", "{}"), item, run)
+        response = json.loads(body) if isinstance(body, str) else body
+    elif respond_with == "text":
+        body = render(parameters.get("responseBody"), item, run)
+        response = body if body is not None else json.dumps(item)
+    elif respond_with == "allIncomingItems":
+        response = items
+    else:
+        response = item
+    if not run.responded:
+        run.response, run.responded = response, True
+    return [items]
+
+async def _merge(run, node, inputs):
+    mode = node["parameters"].get("mode", "append")
+    if mode == "passThrough":
+        output = node["parameters"].get("output", "input1")
+        return [inputs.get(0 if output == "input1" else 1, [])]
+    if mode == "append":
+        return [[item for index in sorted(inputs) for item in inputs[index]]]
+    raise UnsupportedNode(f"Merge mode '{mode}' is not supported")
+
+def _model_name(run: WorkflowRun, node: Dict) -> Optional[str]:
+    for parent in run.workflow.attachments.get(node["name"], {}).get("ai_languageModel", []):
+        return run.workflow.nodes[parent]["parameters"].get("model")
+    return None
+
+async def _llm(run, node, inputs):
+    kind = _node_kind(node)
+    if run.engine.llm is None:
+        raise UnsupportedNode(f"Node '{node['name']}' needs a model, but no llm hook is configured")
+    if kind == "agent" and run.workflow.attachments.get(node["name"], {}).get("ai_tool"):
+        logging.info(f"Agent '{node['name']}' runs without its tools in-process.")
+    items = []
+    for item in inputs.get(0, []):
+        prompt = render(node["parameters"].get("text"), item, run, lenient=True)
+        if prompt is None or node["parameters"].get("promptType") not in ("define", None):
+            prompt = item.get("chatInput") or item.get("body", {}).get("message")
+        text = await run.engine.llm(_model_name(run, node), prompt)
+        items.append({"text": text} if kind == "chainLlm" else {"output": text})
+    return [items]
+
+NODE_EXECUTORS = {
+    "webhook": _trigger, "chatTrigger": _trigger, "manualTrigger": _trigger, "executeWorkflowTrigger": _trigger,
+    "code": _code, "switch": _switch, "httpRequest": _http_request, "respondToWebhook": _respond,
+    "merge": _merge, "chainLlm": _llm, "agent": _llm,
+}
+
+# Per-node duration totals across runs
+class WorkflowStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nodes: Dict[tuple, Dict] = {}
+        self.runs: Dict[str, Dict] = {}
+
+    def record(self, report: Dict):
+        with self._lock:
+            run = self.runs.setdefault(report["workflow"], {"runs": 0, "total_ms": 0.0, "max_ms": 0.0})
+            run["runs"] += 1
+            run["total_ms"] += report["total_ms"]
+            run["max_ms"] = max(run["max_ms"], report["total_ms"])
+            for timing in report["nodes"]:
+                if timing["status"] == "skipped":
+                    continue
+                entry = self.nodes.setdefault((report["workflow"], timing["node"]), {"runs": 0, "total_ms": 0.0, "max_ms": 0.0})
+                entry["runs"] += 1
+                entry["total_ms"] += timing["duration_ms"]
+                entry["max_ms"] = max(entry["max_ms"], timing["duration_ms"])
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "workflows": {name: dict(s, mean_ms=s["total_ms"] / s["runs"]) for name, s in self.runs.items()},
+                "nodes": [
+                    dict(s, workflow=workflow, node=node, mean_ms=s["total_ms"] / s["runs"])
+                    for (workflow, node), s in sorted(self.nodes.items())
+                ],
+            }
+
+class WorkflowEngine:
+    def __init__(self, workflows: List[Workflow], llm: Optional[Callable[[Optional[str], str], Awaitable[str]]] = None,
+                 local_routes: Optional[Dict[str, Callable[[object], Awaitable[object]]]] = None,
+                 n8n_base_urls: Optional[List[str]] = None, timeout: float = 30):
+        """
+        llm(model, prompt) answers LLM chain and agent nodes. local_routes maps webhook paths to
+        coroutines taking the request body, for routes the service implements itself.
+        """
+        self.workflows = {workflow.name: workflow for workflow in workflows}
+        self.llm = llm
+        self.local_routes = {path.strip("/"): handler for path, handler in (local_routes or {}).items()}
+        self.n8n_base_urls = [url.rstrip("/") for url in (n8n_base_urls or N8N_BASE_URLS)]
+        self.timeout = timeout
+        self.stats = WorkflowStats()
+        self._client = None
+        self.routes: Dict[str, tuple] = {}
+        for workflow in workflows:
+            for problem in workflow.unsupported():
+                logging.warning(f"Workflow {workflow.name}: {problem}")
+            if not workflow.active:
+                continue
+            for path, trigger in workflow.webhooks().items():
+                if path in self.routes:
+                    logging.warning(f"Webhook /{path} of {workflow.name} is already served by {self.routes[path][0].name}")
+                    continue
+                self.routes[path] = (workflow, trigger)
+
+    @classmethod
+    def from_files(cls, paths: Optional[List[str]] = None, **options) -> "WorkflowEngine":
+        workflows = []
+        for path in paths or WORKFLOW_FILES:
+            # Relative paths are looked up next to this module, where the exported workflows live
+            path = path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+            try:
+                workflows.append(Workflow.load(path))
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Error loading workflow {path}: {e}")
+        return cls(workflows, **options)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def describe(self) -> List[Dict]:
+        return [
+            {"name": w.name, "source": w.source, "active": w.active, "webhooks": sorted(w.webhooks()),
+             "nodes": len(w.nodes), "unsupported": w.unsupported()}
+            for w in self.workflows.values()
+        ]
+
+    def _local_path(self, url: str) -> Optional[str]:
+        """
+        Webhook path for URLs on the n8n host (/webhook/<path> or /<path>), None for other hosts.
+        """
+        for base in self.n8n_base_urls:
+            if url.startswith(base + "/"):
+                path = urlparse(url).path.strip("/")
+                return path[len("webhook/"):] if path.startswith("webhook/") else path
+        return None
+
+    async def request(self, method: str, url: str, body, run: Optional[WorkflowRun] = None):
+        path = self._local_path(url)
+        if path is not None and path in self.local_routes:
+            return await self.local_routes[path](body)
+        if path is not None and path in self.routes:
+            return (await self.run_webhook(path, body if body is not None else {})).result()
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        response = await self._client.request(method, url, json=body)
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            return {"data": response.text}
+
+    async def run_webhook(self, path: str, body, headers: Optional[Dict] = None, query: Optional[Dict] = None) -> WorkflowRun:
+        route = self.routes.get(path.strip("/"))
+        if route is None:
+            raise KeyError(f"No active workflow serves webhook /{path}")
+        workflow, trigger = route
+        item = {"headers": headers or {}, "params": {}, "query": query or {}, "body": body}
+        return await self.run(workflow, trigger, item)
+
+    async def run(self, workflow: Workflow, trigger: str, item: Dict) -> WorkflowRun:
+        """
+        Executes the part of the workflow reachable from the trigger. Raises WorkflowError (with the
+        partial run) when a node fails.
+        """
+        run = WorkflowRun(self, workflow)
+        nodes = workflow.reachable(trigger)
+        parents = defaultdict(set)
+        for name in nodes:
+            for targets in workflow.edges.get(name, []):
+                for child, _ in targets:
+                    parents[child].add(name)
+        inputs = {name: defaultdict(list) for name in nodes}
+        inputs[trigger][0].append(item)
+        done = {name: asyncio.Event() for name in nodes}
+        failures = []
+
+        async def execute(name: str):
+            await asyncio.gather(*(done[parent].wait() for parent in parents[name]))
+            node = workflow.nodes.get(name)
+            started = time.perf_counter()
+            timing = {"node": name, "type": node["type"] if node else None,
+                      "started_ms": round((started - run.started) * 1000, 3)}
+            try:
+                if node is None:
+                    raise UnsupportedNode(f"Connection to unknown node '{name}'")
+                if failures or not any(inputs[name].values()):
+                    # Nodes on branches that received no items (e.g. a switch output not taken) don't run
+                    run.outputs[name] = []
+                    timing.update(status="skipped", duration_ms=0.0, items=0)
+                    return
+                executor = NODE_EXECUTORS.get(_node_kind(node))
+                if executor is None:
+                    raise UnsupportedNode(f"Node '{name}' has unsupported type {node['type']}")
+                outputs = await executor(run, node, dict(inputs[name]))
+                run.outputs[name] = outputs
+                for output_index, items in enumerate(outputs):
+                    targets = workflow.edges.get(name, [])
+                    for child, input_index in targets[output_index] if output_index < len(targets) else []:
+                        inputs[child][input_index].extend(items)
+                timing.update(status="ok", duration_ms=round((time.perf_counter() - started) * 1000, 3),
+                              items=sum(len(items) for items in outputs))
+            except Exception as e:
+                failures.append((name, e))
+                timing.update(status="error", duration_ms=round((time.perf_counter() - started) * 1000, 3), error=str(e))
+            finally:
+                run.timings.append(timing)
+                done[name].set()
+
+        await asyncio.gather(*(execute(name) for name in nodes))
+        run.timings.sort(key=lambda timing: timing["started_ms"])
+        report = run.report()
+        self.stats.record(report)
+        logging.info(f"Workflow {workflow.name} ran in {report['total_ms']:.1f} ms")
+        if failures:
+            name, error = failures[0]
+            raise WorkflowError(f"Node '{name}' of workflow {workflow.name} failed: {error}", run) from error
+        return run
+
+def server_timing(report: Dict) -> str:
+    """
+    Server-Timing header value with one entry per executed node.
+    """
+    entries = [f'total;dur={report["total_ms"]}']
+    for index, timing in enumerate(report["nodes"]):
+        if timing["status"] != "skipped":
+            description = timing["node"].replace('"', "'")
+            entries.append(f'n{index};desc="{description}";dur={timing["duration_ms"]}')
+    return ", ".join(entries)